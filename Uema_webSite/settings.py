@@ -52,13 +52,24 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Primeiro da lista para medir a requisição inteira (veja app/instrumentation.py)
+    'app.instrumentation.RequestMetricsMiddleware',
+    # Primário/réplicas; antes da sessão para ver também as escritas dela
+    'app.db_router.DatabaseRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # Arquivos de STATIC_ROOT, já comprimidos (veja app/static_assets.py)
+    'app.static_assets.StaticFilesMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # AuthenticationMiddleware do Django + sessões antigas (veja app/auth.py)
+    'app.auth.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    # Carrega/grava o carrinho da vitrine (veja app/cart_storage.py)
+    'app.cart_storage.CartMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Limite de requisições por cliente, antes das views (veja app/ratelimit.py)
+    'app.ratelimit.RateLimitMiddleware',
 ]
 
 ROOT_URLCONF = 'Uema_webSite.urls'
@@ -80,6 +91,11 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'Uema_webSite.wsgi.application'
 
+# Usa as versões assíncronas (async def) das views da vitrine, do carrinho e
+# da API. Ligue apenas quando servir o projeto por ASGI (Uema_webSite/asgi.py,
+# ex.: uvicorn Uema_webSite.asgi:application).
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', 'False') == 'True'
+
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
@@ -99,8 +115,83 @@ DATABASES = {
         'PASSWORD': os.getenv('DB_PASSWORD'),
         'HOST': os.getenv('DB_HOST'),
         'PORT': os.getenv('DB_PORT'),
+        # Conexões persistentes: reaproveitadas entre requisições (em vez de
+        # reconectar a cada uma) e testadas antes do uso. No ASGI o Django
+        # ainda fecha a conexão por requisição; use um pooler (pgbouncer).
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+    }
+}
+
+# Réplicas de leitura (app/db_router.py): DB_REPLICA_HOSTS="host1,host2:5433"
+# cria os aliases replica_1, replica_2... com as mesmas credenciais do
+# primário. Com DB_SIMULATE_REPLICA=True (desenvolvimento), sem réplicas reais,
+# replica_1 é uma segunda conexão ao próprio banco local. Nos testes as
+# réplicas espelham o banco de teste do primário (TEST MIRROR).
+_replica_hosts = [host.strip() for host in os.getenv('DB_REPLICA_HOSTS', '').split(',') if host.strip()]
+if not _replica_hosts and os.getenv('DB_SIMULATE_REPLICA', 'False') == 'True':
+    _replica_hosts = [f"{DATABASES['default']['HOST'] or ''}:{DATABASES['default']['PORT'] or ''}"]
+for _index, _host in enumerate(_replica_hosts, start=1):
+    _host, _, _port = _host.partition(':')
+    DATABASES[f'replica_{_index}'] = {
+        **DATABASES['default'],
+        'HOST': _host or DATABASES['default']['HOST'],
+        'PORT': _port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['app.db_router.PrimaryReplicaRouter']
+# Depois de gravar no banco, o visitante lê do primário por este tempo
+# (a réplica pode estar alguns instantes atrasada)
+DB_READ_STICKY_SECONDS = 5
+
+# Cache
+# Sem REDIS_URL usamos o cache em memória local (um por processo). Em produção,
+# com vários workers, defina REDIS_URL para que todos compartilhem o mesmo cache
+# (e a mesma versão do catálogo).
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
     }
+
+# Carrega o Customer junto com o usuário da sessão (veja app/auth.py)
+AUTHENTICATION_BACKENDS = ['app.auth.CustomerModelBackend']
+
+# Hash de senhas (app/hashers.py)
+# O primeiro hasher grava as senhas novas; os demais só conferem senhas
+# antigas, regravadas com o primeiro no próximo login. PASSWORD_HASHER:
+# 'scrypt' (padrão, biblioteca padrão), 'argon2' (pip install argon2-cffi)
+# ou 'pbkdf2' (padrão do Django). Meça com `python manage.py bench_hashers`.
+_hashers = {
+    'scrypt': 'app.hashers.TunedScryptPasswordHasher',
+    'argon2': 'app.hashers.TunedArgon2PasswordHasher',
+    'pbkdf2': 'app.hashers.TunedPBKDF2PasswordHasher',
 }
+_preferred_hasher = _hashers[os.getenv('PASSWORD_HASHER', 'scrypt')]
+PASSWORD_HASHERS = [_preferred_hasher] + [hasher for hasher in _hashers.values() if hasher != _preferred_hasher] + [
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
+# Custo de cada algoritmo; mudar um valor regrava as senhas no próximo login
+PASSWORD_SCRYPT_WORK_FACTOR = int(os.getenv('PASSWORD_SCRYPT_WORK_FACTOR', 2 ** 14))  # N (potência de 2)
+PASSWORD_SCRYPT_BLOCK_SIZE = int(os.getenv('PASSWORD_SCRYPT_BLOCK_SIZE', 8))  # r
+PASSWORD_SCRYPT_PARALLELISM = int(os.getenv('PASSWORD_SCRYPT_PARALLELISM', 5))  # p (N=2**14, r=8, p=5: mínimo da OWASP)
+PASSWORD_ARGON2_TIME_COST = int(os.getenv('PASSWORD_ARGON2_TIME_COST', 2))
+PASSWORD_ARGON2_MEMORY_COST = int(os.getenv('PASSWORD_ARGON2_MEMORY_COST', 64 * 1024))  # KiB
+PASSWORD_ARGON2_PARALLELISM = int(os.getenv('PASSWORD_ARGON2_PARALLELISM', 1))
+PASSWORD_PBKDF2_ITERATIONS = int(os.getenv('PASSWORD_PBKDF2_ITERATIONS', 1_000_000))
+# Threads por processo que calculam hashes (login, cadastro); limita quantos
+# rodam ao mesmo tempo. 0 = na própria thread da requisição.
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', 2))
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -121,6 +212,20 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Logs do app (worker de tarefas, limites de consultas...) no console.
+# APP_LOG_LEVEL=WARNING no .env deixa só os avisos.
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'app': {'handlers': ['console'], 'level': os.getenv('APP_LOG_LEVEL', 'INFO')},
+    },
+}
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
 
@@ -137,6 +242,26 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/5.2/howto/static-files/
 
 STATIC_URL = 'static/'
+# Destino do `collectstatic`; servido pelo app.static_assets.StaticFilesMiddleware
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+STATIC_MAX_AGE = 60  # Segundos de cache dos arquivos sem hash no nome (os com hash são "immutable")
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    # Nomes com hash do conteúdo + irmãos .gz/.br (veja app/static_assets.py)
+    'staticfiles': {
+        'BACKEND': 'app.static_assets.CompressedManifestStaticFilesStorage',
+    },
+}
+
+# Tailwind compilado só com as classes usadas nos templates (`python manage.py
+# build_css`). Enquanto o arquivo não existir, as páginas usam o CDN do
+# Tailwind. TAILWIND_CSS vazio força o CDN.
+TAILWIND_CSS = os.getenv('TAILWIND_CSS', 'app/css/tailwind.css')
+# Comando do Tailwind CLI: o executável standalone (`tailwindcss`) ou via npm
+TAILWIND_CLI = os.getenv('TAILWIND_CLI', 'tailwindcss')
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
@@ -145,4 +270,122 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
 MEDIA_URL = '/media/'
-MEDIA_ROOT = BASE_DIR / 'media'
\ No newline at end of file
+MEDIA_ROOT = BASE_DIR / 'media'
+
+# Carrinho
+# Cache em memória (por processo) dos dados de produto exibidos no carrinho.
+CART_SNAPSHOT_CACHE_SIZE = 1000  # Número máximo de produtos no cache
+CART_SNAPSHOT_TTL = 300  # Segundos até um snapshot ser buscado de novo no banco
+
+
+# Catálogo
+CATALOG_PAGE_SIZE = 24  # Produtos por página na vitrine
+CATALOG_FRAGMENT_TTL = 60 * 60  # Segundos que uma página da grade fica em cache
+CATALOG_CACHED_PAGES = 5  # Só as primeiras páginas da grade vão para o cache
+
+
+# Reservas de estoque (app/stock.py)
+STOCK_RESERVATION_TTL = 15 * 60  # Segundos que um item no carrinho fica reservado
+STOCK_AVAILABLE_TTL = 60  # Segundos que o disponível de um produto fica em cache
+LOW_STOCK_THRESHOLD = 5  # A partir daqui o card mostra "Restam N"
+
+
+# Carrinho da vitrine (app/cart_storage.py)
+# Onde o carrinho fica guardado, em vez da sessão:
+#   app.cart_storage.SignedCookieCartStore -> num cookie assinado (nenhuma escrita no servidor)
+#   app.cart_storage.CacheCartStore        -> no cache do Django (OPTIONS: alias)
+#   app.cart_storage.FileCartStore         -> um arquivo por carrinho (OPTIONS: path)
+CART_STORE = {
+    'BACKEND': os.getenv('CART_STORE_BACKEND', 'app.cart_storage.SignedCookieCartStore'),
+    'OPTIONS': {
+        'max_age': 60 * 60 * 24 * 30,  # Segundos até um carrinho sem alterações expirar
+    },
+}
+
+
+# API JSON (app/api.py)
+# Backend de armazenamento dos carrinhos e pedidos da API (veja app/api_storage.py):
+#   app.api_storage.MemoryApiStore   -> em memória, um por processo (desenvolvimento)
+#   app.api_storage.SQLiteApiStore   -> arquivo SQLite (WAL) compartilhado pelos workers
+#   app.api_storage.DatabaseApiStore -> banco principal, em Order/OrderItem
+API_STORE = {
+    'BACKEND': os.getenv('API_STORE_BACKEND', 'app.api_storage.MemoryApiStore'),
+    'OPTIONS': {
+        'max_carts': 10000,  # Carrinhos guardados no máximo
+        'max_orders': 10000,  # Pedidos guardados no máximo (Memory/SQLite)
+        'cart_ttl': 60 * 60 * 24,  # Segundos sem uso até um carrinho ser descartado
+    },
+}
+
+
+# Tarefas em segundo plano (app/task_queue.py), executadas pelo
+# `python manage.py run_worker`:
+#   app.task_queue.DatabaseQueue -> no banco principal, modelo Job (vários servidores)
+#   app.task_queue.SQLiteQueue   -> arquivo SQLite local (OPTIONS: path), uma só máquina
+TASK_QUEUE = {
+    'BACKEND': os.getenv('TASK_QUEUE_BACKEND', 'app.task_queue.DatabaseQueue'),
+    'OPTIONS': {
+        'lease': 5 * 60,  # Segundos até uma tarefa de um worker que sumiu voltar para a fila
+    },
+}
+TASK_MODULES = ['app.tasks']  # Módulos com funções @task
+
+# E-mail (confirmação de pedidos). Sem EMAIL_BACKEND os e-mails vão para o console.
+EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+EMAIL_HOST = os.getenv('EMAIL_HOST', 'localhost')
+EMAIL_PORT = int(os.getenv('EMAIL_PORT', 25))
+EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER', '')
+EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD', '')
+EMAIL_USE_TLS = os.getenv('EMAIL_USE_TLS', 'False') == 'True'
+DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', 'loja@localhost')
+
+
+# Limite de requisições por cliente (app/ratelimit.py)
+# Por nome de URL: taxa ('N/s', 'N/m', 'N/h' ou 'N/d'), critérios que
+# identificam o cliente ('ip', 'session', 'user') e, opcionalmente, os
+# métodos HTTP limitados. Acima da taxa a resposta é 429 com Retry-After.
+# RATE_LIMITS vazio desliga o limite.
+_cart_limit = {'rate': '60/m', 'keys': ['ip', 'session']}
+RATE_LIMITS = {
+    'add_to_cart': _cart_limit,
+    'update_cart': _cart_limit,
+    'remove_from_cart': _cart_limit,
+    'cart_batch': _cart_limit,
+    'checkout': {'rate': '10/m', 'keys': ['ip', 'user'], 'methods': ['POST']},
+    'login': {'rate': '10/m', 'keys': ['ip'], 'methods': ['POST']},
+    'register': {'rate': '10/h', 'keys': ['ip'], 'methods': ['POST']},
+    'api_products': {'rate': '120/m', 'keys': ['ip']},
+    'api_search': {'rate': '120/m', 'keys': ['ip']},
+    'api_cart': {'rate': '60/m', 'keys': ['ip']},
+    'api_checkout': {'rate': '10/m', 'keys': ['ip']},
+}
+# Onde ficam os contadores:
+#   app.ratelimit.LocMemRateLimitStore -> em memória, um por processo (limite efetivo x nº de workers)
+#   app.ratelimit.SQLiteRateLimitStore -> arquivo SQLite (WAL) compartilhado pelos workers (OPTIONS: path)
+RATE_LIMIT_STORE = {
+    'BACKEND': os.getenv('RATE_LIMIT_STORE_BACKEND', 'app.ratelimit.LocMemRateLimitStore'),
+    'OPTIONS': {},
+}
+# Proxies reversos confiáveis na frente do Django (0 = usa REMOTE_ADDR;
+# 1 = o último IP do X-Forwarded-For, posto pelo nginx...)
+RATE_LIMIT_PROXY_COUNT = int(os.getenv('RATE_LIMIT_PROXY_COUNT', 0))
+
+
+# Miniaturas das imagens de produto (app/images.py)
+IMAGE_WORKERS = 2  # Threads que geram as miniaturas; 0 = gera na própria requisição
+
+
+# Métricas por requisição (app/instrumentation.py)
+# Cabeçalho Server-Timing para todos os visitantes; a equipe (staff) sempre o recebe
+REQUEST_METRICS_HEADERS = DEBUG
+REQUEST_METRICS_WINDOW = 1000  # Amostras guardadas por view no histograma
+# Número máximo de consultas SQL por view (nome da URL). Acima disso é
+# registrado um aviso; com QUERY_BUDGET_STRICT = True (nos testes) é um erro.
+VIEW_QUERY_BUDGETS = {
+    'product_list': 4,
+    'checkout': 15,
+    'add_to_cart': 8,  # inclui a reserva de estoque (app/stock.py)
+    'update_cart': 5,
+    'remove_from_cart': 5,
+}
+QUERY_BUDGET_STRICT = False
@@ -19,6 +19,8 @@ from django.urls import path,include #1. Importa a função 'include'
 from django.conf import settings
 from django.conf.urls.static import static
 
+from app.images import serve_rendition
+
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -30,4 +32,8 @@ urlpatterns = [
 ]
 
 if settings.DEBUG:
+    # As miniaturas vêm antes do resto de /media/ para sair com cache "immutable"
+    urlpatterns += [
+        path(f'{settings.MEDIA_URL.lstrip("/")}renditions/<path:path>', serve_rendition),
+    ]
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
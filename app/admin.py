@@ -1,11 +1,251 @@
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.conf import settings
+from django.db.models import Case, Count, DecimalField, ExpressionWrapper, F, IntegerField, OuterRef, Subquery, Sum, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.functional import cached_property
 
 # Register your models here.
-from .models import Product # Importa o modelo Product que você criou
+from .api_storage import DatabaseApiStore
+from .models import Customer, Job, Order, OrderItem, Product, StockReservation # Importa o modelo Product que você criou
+from .search import filter_products
+
+MONEY = DecimalField(max_digits=12, decimal_places=2)
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginador que, para a listagem sem filtros nem busca (`unfiltered`), usa
+    a estimativa de linhas do PostgreSQL (`pg_class.reltuples`) em vez de
+    `COUNT(*)`, que percorre a tabela toda. A estimativa é da tabela inteira,
+    mesmo que o `get_queryset` do admin esconda algumas linhas (ex.: os
+    carrinhos da API em `OrderAdmin`). Com filtros, ou se a tabela for
+    pequena, conta de verdade.
+    """
+    exact_below = 10000
+
+    def __init__(self, *args, unfiltered=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.unfiltered = unfiltered
+
+    @cached_property
+    def count(self):
+        if self.unfiltered:
+            estimate = self.estimated_count()
+            if estimate is not None and estimate >= self.exact_below:
+                return estimate
+        return super().count
+
+    def estimated_count(self):
+        """Linhas da tabela segundo as estatísticas do banco; None fora do PostgreSQL."""
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT reltuples FROM pg_class WHERE relname = %s", [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+        return int(row[0]) if row else None
+
+
+class FastListAdmin(admin.ModelAdmin):
+    """Base dos admins de tabelas grandes: sem o `COUNT(*)` extra da listagem."""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 100
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        # Sem filtros nem busca, a listagem tem as mesmas condições que o
+        # queryset base do admin (que pode ter as suas, como um `exclude`)
+        unfiltered = queryset.query.where == self.get_queryset(request).query.where
+        return self.paginator(queryset, per_page, orphans, allow_empty_first_page, unfiltered=unfiltered)
+
+
+def _item_subquery(aggregate):
+    """
+    Agregado dos itens de cada pedido como subconsulta correlacionada: só é
+    calculado para as linhas da página, e não para a tabela inteira como um
+    JOIN + GROUP BY.
+    """
+    return Subquery(
+        OrderItem.objects.filter(order=OuterRef('pk'))
+        .order_by()
+        .values('order')
+        .annotate(value=aggregate)
+        .values('value')
+    )
+
+
+class LowStockFilter(admin.SimpleListFilter):
+    """Produtos esgotados ou com até `LOW_STOCK_THRESHOLD` unidades disponíveis."""
+    title = "estoque disponível"
+    parameter_name = 'disponivel'
+
+    def lookups(self, request, model_admin):
+        return [('baixo', "Estoque baixo"), ('esgotado', "Esgotado")]
+
+    def queryset(self, request, queryset):
+        if self.value() == 'baixo':
+            return queryset.filter(stock__lte=F('reserved') + settings.LOW_STOCK_THRESHOLD)
+        if self.value() == 'esgotado':
+            return queryset.filter(stock__lte=F('reserved'))
+        return queryset
+
 
 # A linha mágica que torna seus produtos gerenciáveis no admin
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ('name', 'price', 'stock', 'created_at')
+    list_display = ('name', 'sku', 'price', 'stock', 'reserved', 'available', 'created_at')
     search_fields = ('name', 'description')
-    list_filter = ('created_at',)
\ No newline at end of file
+    list_filter = (LowStockFilter, 'created_at')
+    readonly_fields = ('reserved',)
+
+    @admin.display(description="Disponível")
+    def available(self, obj):
+        return obj.available
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Usa o índice de texto completo (app/search.py) em vez de
+        `ILIKE '%termo%'` em `search_fields`, que varre a tabela inteira.
+        """
+        return filter_products(queryset, search_term), False
+
+
+@admin.register(Customer)
+class CustomerAdmin(FastListAdmin):
+    list_display = ('id', 'name', 'email', 'user', 'order_count', 'total_spent')
+    # `Customer.__str__` e a coluna `user` usam o usuário: vem no mesmo SELECT
+    list_select_related = ('user',)
+    search_fields = ('name', 'email', 'user__username')
+    raw_id_fields = ('user',)
+
+    def get_queryset(self, request):
+        orders = Order.objects.filter(customer=OuterRef('pk'), complete=True).order_by().values('customer')
+        return super().get_queryset(request).annotate(
+            order_count=Coalesce(Subquery(orders.annotate(value=Count('pk')).values('value')), 0),
+            total_spent=Coalesce(Subquery(orders.annotate(value=Sum('total_amount')).values('value')), 0,
+                                 output_field=MONEY),
+        )
+
+    @admin.display(description="Pedidos", ordering='order_count')
+    def order_count(self, obj):
+        return obj.order_count
+
+    @admin.display(description="Total gasto", ordering='total_spent')
+    def total_spent(self, obj):
+        return obj.total_spent
+
+
+class OrderItemInline(admin.TabularInline):
+    model = OrderItem
+    extra = 0
+    fields = ('product', 'quantity', 'unit_price')
+    autocomplete_fields = ('product',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('product')
+
+
+@admin.register(Order)
+class OrderAdmin(FastListAdmin):
+    list_display = ('__str__', 'date_ordered', 'customer', 'complete', 'items', 'total')
+    # A coluna `customer` chama `Customer.__str__`, que usa `customer.user`
+    list_select_related = ('customer', 'customer__user')
+    list_filter = ('complete',)
+    search_fields = ('=transaction_id', 'customer__email')
+    autocomplete_fields = ('customer',)
+    readonly_fields = ('total_amount', 'item_count')
+    inlines = [OrderItemInline]
+
+    def get_queryset(self, request):
+        # Pedidos finalizados têm os totais gravados; carrinhos em aberto
+        # somam os itens (com o preço atual do produto) numa subconsulta.
+        line_total = ExpressionWrapper(
+            F('quantity') * Coalesce('unit_price', 'product__price'), output_field=MONEY,
+        )
+        # Carrinhos da API guardados pelo DatabaseApiStore não são pedidos
+        queryset = super().get_queryset(request).exclude(
+            complete=False, transaction_id__startswith=DatabaseApiStore.CART_PREFIX,
+        )
+        return queryset.annotate(
+            display_items=Case(
+                When(complete=True, then=F('item_count')),
+                default=Coalesce(_item_subquery(Sum('quantity')), 0),
+                output_field=IntegerField(),
+            ),
+            display_total=Case(
+                When(complete=True, then=F('total_amount')),
+                default=Coalesce(_item_subquery(Sum(line_total)), 0, output_field=MONEY),
+                output_field=MONEY,
+            ),
+        )
+
+    @admin.display(description="Itens", ordering='display_items')
+    def items(self, obj):
+        return obj.display_items
+
+    @admin.display(description="Total", ordering='display_total')
+    def total(self, obj):
+        return obj.display_total
+
+
+@admin.register(OrderItem)
+class OrderItemAdmin(FastListAdmin):
+    list_display = ('id', 'order', 'product', 'quantity', 'unit_price', 'line_total', 'date_added')
+    list_select_related = ('order', 'product')
+    raw_id_fields = ('order',)
+    autocomplete_fields = ('product',)
+    search_fields = ('=order__transaction_id',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            line_total_value=ExpressionWrapper(
+                F('quantity') * Coalesce('unit_price', 'product__price'), output_field=MONEY,
+            ),
+        )
+
+    @admin.display(description="Subtotal", ordering='line_total_value')
+    def line_total(self, obj):
+        return obj.line_total_value
+
+
+@admin.register(StockReservation)
+class StockReservationAdmin(FastListAdmin):
+    list_display = ('id', 'product', 'quantity', 'cart_key', 'expires_at')
+    list_select_related = ('product',)
+    raw_id_fields = ('product',)
+    search_fields = ('=cart_key',)
+    # As reservas andam junto com `Product.reserved`: só leitura aqui
+    readonly_fields = ('cart_key', 'product', 'quantity', 'expires_at')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        # Apagar a reserva não devolveria as unidades a `Product.reserved`
+        return False
+
+
+@admin.register(Job)
+class JobAdmin(FastListAdmin):
+    list_display = ('id', 'name', 'status', 'attempts', 'max_attempts', 'run_at', 'finished_at')
+    list_filter = ('status', 'name')
+    search_fields = ('=idempotency_key',)
+    readonly_fields = (
+        'name', 'payload', 'idempotency_key', 'status', 'attempts', 'max_attempts',
+        'run_at', 'locked_until', 'last_error', 'created_at', 'finished_at',
+    )
+    actions = ['retry_jobs']
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.action(description="Executar de novo as tarefas selecionadas")
+    def retry_jobs(self, request, queryset):
+        updated = queryset.exclude(status=Job.RUNNING).update(
+            status=Job.PENDING, attempts=0, run_at=timezone.now(), locked_until=None, finished_at=None,
+        )
+        self.message_user(request, f"{updated} tarefa(s) de volta à fila.")
@@ -1,126 +1,301 @@
-from django.http import JsonResponse
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse
+from django.utils.http import parse_etags
 from django.views.decorators.csrf import csrf_exempt
 import json
+import random
 from pathlib import Path
+
+from django.conf import settings
+
+from .api_storage import CartConflict, UnknownProduct, get_store
+from .db_router import use_read_replica
+from .json_catalog import JsonCatalog
+from .search import search_products
+from .task_queue import aenqueue, enqueue
+from .tasks import log_api_order
 # Sample product data (would come from your database in production)
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
-def load_products():
-    file_path = BASE_DIR / "app/static/app/data/products.json"
-    with open(file_path, encoding="utf-8") as f:
-        return json.load(f)
+# Lido e indexado uma vez; relido só quando o arquivo muda (veja app/json_catalog.py)
+catalog = JsonCatalog(BASE_DIR / "app/static/app/data/products.json")
+
+# Os carrinhos e pedidos ficam no backend configurado em settings.API_STORE
+# (veja app/api_storage.py), e não mais em variáveis globais deste módulo.
+#
+# Cada carrinho tem uma versão, devolvida em "version" e no cabeçalho ETag.
+# O cliente pode enviá-la de volta ("version" no corpo ou If-Match): se o
+# carrinho tiver mudado nesse meio tempo (outra aba, por exemplo) a resposta
+# é 409 com o estado atual. Sem versão, a alteração é mesclada com as
+# concorrentes (veja `BaseApiStore.update_cart`).
+
+
+def _cart_items(quantities, by_id):
+    """Monta a lista de itens do carrinho (formato da API) a partir das quantidades."""
+    items = []
+    for product_id, quantity in quantities.items():
+        product = by_id.get(product_id)
+        if product is None:
+            continue
+        items.append({
+            "id": product['id'],
+            "name": product['name'],
+            "price": product['price'],
+            "quantity": quantity,
+            "image": product['image']
+        })
+    return items
 
-# In-memory cart storage (replace with database in production)
-user_carts = {}
+def _client_version(request, data=None):
+    """
+    Versão do carrinho que o cliente leu: "version" no corpo JSON ou o
+    cabeçalho If-Match. None se ele não informou.
+    """
+    value = (data or {}).get('version')
+    if value is None:
+        etags = parse_etags(request.headers.get('If-Match', ''))
+        value = etags[0].strip('"') if etags and etags[0] != '*' else None
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+def _cart_response(quantities, version, products, **extra):
+    response = JsonResponse(dict(extra, cart=_cart_items(quantities, products), version=version))
+    response['ETag'] = f'"{version}"'
+    return response
+
+def _conflict_response(conflict, products):
+    """409: o carrinho mudou; o cliente recebe o estado atual para decidir."""
+    response = JsonResponse({
+        "error": "Cart was modified by another request",
+        "cart": _cart_items(conflict.quantities, products),
+        "version": conflict.version,
+    }, status=409)
+    response['ETag'] = f'"{conflict.version}"'
+    return response
+
+def _products_response(request):
+    state = catalog.current()
+    # Requisição condicional: o cliente já tem esta versão do catálogo
+    if state.etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(state.body, content_type='application/json')
+    response['ETag'] = state.etag
+    return response
 
 @csrf_exempt
 def get_products(request):
-    products = load_products()
-    return JsonResponse({"products": products})
+    return _products_response(request)
+
+@use_read_replica
+def search(request):
+    """Busca de produtos do banco (`?q=termo&page=N`), ordenada por relevância."""
+    query = request.GET.get('q', '')
+    try:
+        page_number = int(request.GET.get('page', 1))
+    except ValueError:
+        page_number = 1
+    page = search_products(query, page=page_number, per_page=settings.CATALOG_PAGE_SIZE)
+    return JsonResponse({
+        "query": query,
+        "page": page.number,
+        "has_next": page.has_next,
+        "results": [
+            {
+                "id": product.id,
+                "name": product.name,
+                "description": product.description,
+                "price": float(product.price),
+                "image": product.image.url if product.image else None,
+            }
+            for product in page
+        ],
+    })
+
+def _cart_mutation(request, products):
+    """
+    Interpreta um POST (adicionar) ou DELETE (remover) no carrinho. Retorna
+    `(mutate, versão lida pelo cliente, None)`, onde `mutate` altera o
+    dicionário de quantidades, ou `(None, None, resposta de erro)`.
+    """
+    if request.method not in ('POST', 'DELETE'):
+        return None, None, JsonResponse({"error": "Invalid request method"}, status=405)
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return None, None, JsonResponse({"error": "Invalid JSON"}, status=400)
+    product_id = data.get('product_id')
+
+    if request.method == 'DELETE':
+        # Remove item from cart
+        def mutate(quantities):
+            quantities.pop(product_id, None)
+    else:
+        # Add item to cart
+        quantity = data.get('quantity', 1)
+        if product_id not in products:
+            return None, None, JsonResponse({"error": "Product not found"}, status=404)
+
+        def mutate(quantities):
+            # Soma à quantidade atual, ou adiciona o produto ao fim do carrinho
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+    return mutate, _client_version(request, data), None
+
+def _cart_error_response(exc, products):
+    """Resposta para os erros de `update_cart`: 409 (`CartConflict`) ou 404 (`UnknownProduct`)."""
+    if isinstance(exc, CartConflict):
+        return _conflict_response(exc, products)
+    return JsonResponse({"error": "Product not found"}, status=404)
 
 @csrf_exempt
 def cart(request, user_id):
-    products = load_products()
     """Endpoint to handle cart operations"""
+    products = catalog.current().by_id
+    store = get_store()
     if request.method == 'GET':
         # Get user's cart
-        cart_items = user_carts.get(user_id, [])
-        return JsonResponse({"cart": cart_items})
-    
-    elif request.method == 'POST':
-        # Add item to cart
-        data = json.loads(request.body)
-        product_id = data.get('product_id')
-        quantity = data.get('quantity', 1)
-        
-        product = next((p for p in products if p['id'] == product_id), None)
-        if not product:
-            return JsonResponse({"error": "Product not found"}, status=404)
-        
-        if user_id not in user_carts:
-            user_carts[user_id] = []
-            
-        # Check if product already in cart
-        cart_item = next((item for item in user_carts[user_id] if item['id'] == product_id), None)
-        
-        if cart_item:
-            cart_item['quantity'] += quantity
-        else:
-            user_carts[user_id].append({
-                "id": product['id'],
-                "name": product['name'],
-                "price": product['price'],
-                "quantity": quantity,
-                "image": product['image']
-            })
-            
-        return JsonResponse({"success": True, "cart": user_carts[user_id]})
-    
-    elif request.method == 'DELETE':
-        # Remove item from cart
+        quantities, version = store.get_versioned_cart(user_id)
+        return _cart_response(quantities, version, products)
+
+    mutate, version, error = _cart_mutation(request, products)
+    if error is not None:
+        return error
+    try:
+        quantities, version = store.update_cart(user_id, mutate, version=version)
+    except (CartConflict, UnknownProduct) as exc:
+        return _cart_error_response(exc, products)
+    return _cart_response(quantities, version, products, success=True)
+
+REQUIRED_CHECKOUT_FIELDS = ['name', 'email', 'address', 'payment_method']
+
+def _build_order(user_id, data, cart_items):
+    total = sum(item['price'] * item['quantity'] for item in cart_items)
+
+    # Gera número do pedido
+    order_number = random.randint(10000, 99999)
+
+    # Cria pedido
+    return {
+        "order_number": order_number,
+        "user_id": user_id,
+        "customer": {
+            "name": data['name'],
+            "email": data['email'],
+            "address": data['address'],
+            "payment_method": data['payment_method'],
+        },
+        "items": cart_items,
+        "total": total,
+    }
+
+def _order_key(order):
+    # Chave de idempotência da tarefa de registro do pedido
+    return f"log-order:{order['user_id']}:{order['order_number']}"
+
+def _order_response(order):
+    return JsonResponse({
+        "success": True,
+        "order_number": order['order_number'],
+        "total": order['total'],
+        "items": order['items'],
+        "message": "Pedido confirmado com sucesso!"
+    })
+
+def _checkout_data(request):
+    """Dados de entrega do corpo do checkout: `(data, None)` ou `(None, resposta de erro)`."""
+    if request.method != 'POST':
+        return None, JsonResponse({"error": "Invalid request method"}, status=405)
+    try:
         data = json.loads(request.body)
-        product_id = data.get('product_id')
-        
-        if user_id in user_carts:
-            user_carts[user_id] = [item for item in user_carts[user_id] if item['id'] != product_id]
-            
-        return JsonResponse({"success": True, "cart": user_carts.get(user_id, [])})
+    except ValueError:
+        return None, JsonResponse({"error": "Invalid JSON"}, status=400)
+    if not all(field in data for field in REQUIRED_CHECKOUT_FIELDS):
+        return None, JsonResponse({"error": "Missing required fields"}, status=400)
+    return data, None
 
-orders = []  # lista de pedidos (substituir por DB depois)
+def _prepare_order(request, user_id, data, products, quantities, version):
+    """
+    Monta o pedido a partir do carrinho lido (`quantities` na `version`):
+    `(order, None)` ou `(None, resposta de erro)` se o cliente viu outra
+    versão do carrinho ou se ele está vazio.
+    """
+    expected = _client_version(request, data)
+    if expected is not None and expected != version:
+        return None, _conflict_response(CartConflict(quantities, version), products)
+    cart_items = _cart_items(quantities, products)
+    if not cart_items:
+        return None, JsonResponse({"error": "Cart is empty"}, status=400)
+    return _build_order(user_id, data, cart_items), None
 
 @csrf_exempt
 def checkout(request, user_id):
-    if request.method == 'POST':
-        data = json.loads(request.body)
+    data, error = _checkout_data(request)
+    if error is not None:
+        return error
 
-        required_fields = ['name', 'email', 'address', 'payment_method']
-        if not all(field in data for field in required_fields):
-            return JsonResponse({"error": "Missing required fields"}, status=400)
-
-        cart_items = user_carts.get(user_id, [])
-        if not cart_items:
-            return JsonResponse({"error": "Cart is empty"}, status=400)
-
-        total = sum(item['price'] * item['quantity'] for item in cart_items)
-
-        # Gera número do pedido
-        import random
-        order_number = random.randint(10000, 99999)
-
-        # Cria pedido
-        order = {
-            "order_number": order_number,
-            "user_id": user_id,
-            "customer": {
-                "name": data['name'],
-                "email": data['email'],
-                "address": data['address'],
-                "payment_method": data['payment_method'],
-            },
-            "items": cart_items,
-            "total": total,
-        }
-        orders.append(order)
-
-        # Limpa carrinho
-        user_carts[user_id] = []
-
-        # ======================================================================
-        print("-----------------------------------------")
-        print(f"✅ Pedido #{order_number} recebido com sucesso!")
-        print(f"Cliente: {data['name']}")
-        print(f"Total de pedidos na memória agora: {len(orders)}")
-        print("Lista de todos os pedidos:")
-        # O import json e o indent=2 servem para imprimir o dicionário de forma bonita
-        print(json.dumps(orders, indent=2, ensure_ascii=False))
-        print("-----------------------------------------")
-        # ======================================================================
-        return JsonResponse({
-            "success": True,
-            "order_number": order_number,
-            "total": total,
-            "items": cart_items,
-            "message": "Pedido confirmado com sucesso!"
-        })
-    return JsonResponse({"error": "Invalid request method"}, status=405)
\ No newline at end of file
+    store = get_store()
+    products = catalog.current().by_id
+    quantities, version = store.get_versioned_cart(user_id)
+    order, error = _prepare_order(request, user_id, data, products, quantities, version)
+    if error is not None:
+        return error
+    # Guarda o pedido e limpa o carrinho, desde que ele não tenha mudado
+    # desde a leitura acima
+    try:
+        store.place_order(user_id, order, version)
+    except CartConflict as exc:
+        return _conflict_response(exc, products)
+    # O registro do pedido roda no worker (python manage.py run_worker)
+    enqueue(log_api_order, {'order': order}, idempotency_key=_order_key(order))
+    return _order_response(order)
+
+# ==========================================================
+# VERSÕES ASSÍNCRONAS (ASGI)
+# Usam as mesmas funções das views acima para ler a requisição e montar a
+# resposta; só as chamadas ao backend de armazenamento são assíncronas.
+# Ativadas com settings.ASYNC_VIEWS (veja app/urls.py).
+# ==========================================================
+
+@csrf_exempt
+async def aget_products(request):
+    return _products_response(request)
+
+@csrf_exempt
+async def acart(request, user_id):
+    """Versão assíncrona de `cart`."""
+    products = catalog.current().by_id
+    store = get_store()
+    if request.method == 'GET':
+        quantities, version = await store.aget_versioned_cart(user_id)
+        return _cart_response(quantities, version, products)
+
+    mutate, version, error = _cart_mutation(request, products)
+    if error is not None:
+        return error
+    try:
+        quantities, version = await store.aupdate_cart(user_id, mutate, version=version)
+    except (CartConflict, UnknownProduct) as exc:
+        return _cart_error_response(exc, products)
+    return _cart_response(quantities, version, products, success=True)
+
+@csrf_exempt
+async def acheckout(request, user_id):
+    """Versão assíncrona de `checkout`."""
+    data, error = _checkout_data(request)
+    if error is not None:
+        return error
+
+    store = get_store()
+    products = catalog.current().by_id
+    quantities, version = await store.aget_versioned_cart(user_id)
+    order, error = _prepare_order(request, user_id, data, products, quantities, version)
+    if error is not None:
+        return error
+    try:
+        await store.aplace_order(user_id, order, version)
+    except CartConflict as exc:
+        return _conflict_response(exc, products)
+    await aenqueue(log_api_order, {'order': order}, idempotency_key=_order_key(order))
+    return _order_response(order)
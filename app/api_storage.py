@@ -0,0 +1,576 @@
+"""
+Armazenamento dos carrinhos e pedidos da API JSON (`app/api.py`).
+
+Antes os carrinhos ficavam num dicionário global do módulo, o que quebra com
+vários workers do gunicorn (cada processo via um carrinho diferente) e a
+lista de pedidos crescia sem limite. Agora a API usa um "backend" de
+armazenamento escolhido em `settings.API_STORE`:
+
+* `MemoryApiStore`: em memória, no próprio processo (comportamento antigo,
+  útil com um único worker e em desenvolvimento);
+* `SQLiteApiStore`: um arquivo SQLite local em modo WAL, compartilhado por
+  todos os workers da mesma máquina;
+* `DatabaseApiStore`: no banco principal, usando `Order`/`OrderItem`
+  (o carrinho é um `Order` ainda não finalizado). Só aceita produtos que
+  existem em `Product` (senão `UnknownProduct`).
+
+Todos são limitados (número máximo de carrinhos e pedidos guardados) e
+descartam carrinhos abandonados depois de `cart_ttl` segundos sem uso.
+
+Um carrinho é guardado apenas como `{product_id: quantidade}`, na ordem em
+que os produtos foram adicionados; nome, preço e imagem vêm do catálogo.
+
+Cada carrinho tem um número de versão, que muda a cada gravação (um
+carrinho inexistente tem versão 0). As gravações são compare-and-swap: só
+acontecem se o carrinho ainda estiver na versão lida, senão levantam
+`CartConflict` com o estado atual. Assim duas abas (ou dois threads do
+servidor) alterando o mesmo carrinho não perdem atualizações uma da outra,
+sem um lock global que serialize todos os usuários.
+"""
+import datetime
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils.module_loading import import_string
+
+
+class CartConflict(Exception):
+    """
+    O carrinho mudou desde que foi lido. `quantities` e `version` trazem o
+    estado atual (preenchidos por `BaseApiStore` quando o backend não os informa).
+    """
+
+    def __init__(self, quantities=None, version=None):
+        super().__init__("O carrinho foi alterado por outra requisição.")
+        self.quantities = quantities
+        self.version = version
+
+
+class UnknownProduct(LookupError):
+    """O backend não consegue guardar estes produtos (não existem em `Product`)."""
+
+    def __init__(self, product_ids):
+        super().__init__(f"Produtos inexistentes: {sorted(product_ids)}")
+        self.product_ids = product_ids
+
+
+def _new_version():
+    # Um carrinho novo começa num timestamp em milissegundos, e não em 1: um
+    # cliente com a versão de um carrinho já apagado nunca acerta a do novo.
+    return int(time.time() * 1000)
+
+
+class BaseApiStore:
+    """
+    Interface comum dos backends. As subclasses implementam os métodos
+    `_get_cart`, `_save_cart`, `_place_order` e `evict_abandoned`.
+    """
+
+    def __init__(self, max_carts=10000, max_orders=10000, cart_ttl=60 * 60 * 24, evict_interval=60):
+        self.max_carts = max_carts
+        self.max_orders = max_orders
+        self.cart_ttl = cart_ttl
+        self.evict_interval = evict_interval
+        self._last_eviction = time.monotonic()
+
+    def get_cart(self, user_id):
+        """Retorna o carrinho do usuário como `{product_id: quantidade}`."""
+        return self._get_cart(user_id)[0]
+
+    def get_versioned_cart(self, user_id):
+        """Retorna `(quantidades, versão)`. Um carrinho inexistente tem versão 0."""
+        return self._get_cart(user_id)
+
+    def save_cart(self, user_id, quantities, version=None):
+        """
+        Substitui o carrinho do usuário e retorna a nova versão (0 para um
+        carrinho vazio, que é apagado). Com `version`, só grava se o carrinho
+        ainda estiver nessa versão; senão levanta `CartConflict`.
+        """
+        try:
+            new_version = self._save_cart(user_id, quantities, version)
+        except CartConflict as exc:
+            self._fill_conflict(exc, user_id)
+            raise
+        self.maybe_evict()
+        return new_version
+
+    def update_cart(self, user_id, mutate, version=None, retries=5):
+        """
+        Lê o carrinho, aplica `mutate(quantidades)` (que altera o dicionário)
+        e grava com compare-and-swap. Retorna `(quantidades, versão)`.
+
+        Se outra requisição gravar no meio, `mutate` é reaplicada sobre o
+        estado novo: as operações da API são relativas ("some 1", "remova o
+        produto"), então isso mescla as duas alterações. Se o cliente informar
+        `version`, o carrinho precisa estar exatamente nela: sem nova tentativa.
+        """
+        for attempt in range(retries):
+            quantities, current = self._get_cart(user_id)
+            if version is not None and version != current:
+                raise CartConflict(quantities, current)
+            before = dict(quantities)
+            mutate(quantities)
+            if quantities == before:
+                return quantities, current
+            try:
+                return quantities, self.save_cart(user_id, quantities, current)
+            except CartConflict:
+                if version is not None or attempt == retries - 1:
+                    raise
+
+    def place_order(self, user_id, order, version=None):
+        """
+        Guarda o pedido (um dicionário serializável) e esvazia o carrinho.
+        Com `version`, o pedido só é aceito se o carrinho ainda estiver nessa
+        versão (o cliente pagou pelo carrinho que viu); senão `CartConflict`.
+        """
+        try:
+            self._place_order(user_id, order, version)
+        except CartConflict as exc:
+            self._fill_conflict(exc, user_id)
+            raise
+        self.maybe_evict()
+
+    def _fill_conflict(self, exc, user_id):
+        if exc.version is None:
+            exc.quantities, exc.version = self._get_cart(user_id)
+
+    # Versões assíncronas. Por padrão rodam o método síncrono no thread do
+    # ORM (`thread_sensitive=True`); backends que não fazem E/S bloqueante
+    # ou que têm conexões próprias por thread sobrescrevem.
+    async def aget_cart(self, user_id):
+        return (await self.aget_versioned_cart(user_id))[0]
+
+    async def aget_versioned_cart(self, user_id):
+        return await sync_to_async(self.get_versioned_cart)(user_id)
+
+    async def asave_cart(self, user_id, quantities, version=None):
+        return await sync_to_async(self.save_cart)(user_id, quantities, version)
+
+    async def aupdate_cart(self, user_id, mutate, version=None, retries=5):
+        """Versão assíncrona de `update_cart`."""
+        for attempt in range(retries):
+            quantities, current = await self.aget_versioned_cart(user_id)
+            if version is not None and version != current:
+                raise CartConflict(quantities, current)
+            before = dict(quantities)
+            mutate(quantities)
+            if quantities == before:
+                return quantities, current
+            try:
+                return quantities, await self.asave_cart(user_id, quantities, current)
+            except CartConflict:
+                if version is not None or attempt == retries - 1:
+                    raise
+
+    async def aplace_order(self, user_id, order, version=None):
+        await sync_to_async(self.place_order)(user_id, order, version)
+
+    def maybe_evict(self):
+        """Roda `evict_abandoned` no máximo uma vez a cada `evict_interval` segundos."""
+        now = time.monotonic()
+        if now - self._last_eviction >= self.evict_interval:
+            self._last_eviction = now
+            self.evict_abandoned()
+
+    def evict_abandoned(self):
+        """Apaga carrinhos sem uso há mais de `cart_ttl` e o excesso além dos limites."""
+        raise NotImplementedError
+
+    def _get_cart(self, user_id):
+        """Retorna `(quantidades, versão)`."""
+        raise NotImplementedError
+
+    def _save_cart(self, user_id, quantities, version):
+        """Grava (condicionado a `version`, se não for None) e retorna a nova versão."""
+        raise NotImplementedError
+
+    def _place_order(self, user_id, order, version):
+        raise NotImplementedError
+
+
+class MemoryApiStore(BaseApiStore):
+    """
+    Carrinhos e pedidos em memória, visíveis apenas no processo atual.
+
+    A sequência "ler versão, comparar, gravar" de cada carrinho roda sob um
+    lock escolhido pelo usuário entre `lock_stripes` locks, então usuários
+    diferentes quase nunca esperam um pelo outro. O lock geral protege só as
+    operações O(1) no `OrderedDict` e na fila de pedidos.
+    """
+
+    def __init__(self, lock_stripes=64, **options):
+        super().__init__(**options)
+        self._carts = OrderedDict()  # user_id -> (último_uso, versão, quantidades)
+        self._orders = deque(maxlen=self.max_orders)
+        self._lock = threading.Lock()
+        self._stripes = [threading.Lock() for _ in range(lock_stripes)]
+
+    def _user_lock(self, user_id):
+        return self._stripes[hash(user_id) % len(self._stripes)]
+
+    # Tudo em memória e sem E/S: as versões assíncronas chamam direto,
+    # sem ocupar um thread.
+    async def aget_versioned_cart(self, user_id):
+        return self.get_versioned_cart(user_id)
+
+    async def asave_cart(self, user_id, quantities, version=None):
+        return self.save_cart(user_id, quantities, version)
+
+    async def aplace_order(self, user_id, order, version=None):
+        self.place_order(user_id, order, version)
+
+    def _get_cart(self, user_id):
+        with self._lock:
+            entry = self._carts.get(user_id)
+            if entry is None:
+                return {}, 0
+            return dict(entry[2]), entry[1]
+
+    def _check_version(self, user_id, version):
+        quantities, current = self._get_cart(user_id)
+        if version is not None and version != current:
+            raise CartConflict(quantities, current)
+        return current
+
+    def _save_cart(self, user_id, quantities, version):
+        with self._user_lock(user_id):
+            current = self._check_version(user_id, version)
+            with self._lock:
+                if not quantities:
+                    self._carts.pop(user_id, None)
+                    return 0
+                new_version = current + 1 if current else _new_version()
+                self._carts[user_id] = (time.monotonic(), new_version, dict(quantities))
+                self._carts.move_to_end(user_id)
+                while len(self._carts) > self.max_carts:
+                    self._carts.popitem(last=False)
+            return new_version
+
+    def _place_order(self, user_id, order, version):
+        with self._user_lock(user_id):
+            self._check_version(user_id, version)
+            with self._lock:
+                self._orders.append(order)
+                self._carts.pop(user_id, None)
+
+    def evict_abandoned(self):
+        cutoff = time.monotonic() - self.cart_ttl
+        removed = 0
+        with self._lock:
+            # O OrderedDict está em ordem de uso: os mais antigos vêm primeiro
+            while self._carts:
+                user_id, (last_used, _, _) = next(iter(self._carts.items()))
+                if last_used > cutoff:
+                    break
+                del self._carts[user_id]
+                removed += 1
+        return removed
+
+
+class SQLiteApiStore(BaseApiStore):
+    """
+    Carrinhos e pedidos num arquivo SQLite local em modo WAL.
+    Todos os processos da mesma máquina que apontam para o mesmo arquivo
+    enxergam os mesmos carrinhos. Cada thread usa a sua própria conexão.
+
+    As gravações com versão são um único comando condicional
+    (`UPDATE ... WHERE version = ?`), atômico por si só.
+    """
+
+    def __init__(self, path=None, **options):
+        super().__init__(**options)
+        self.path = str(path or settings.BASE_DIR / 'api_store.sqlite3')
+        self._local = threading.local()
+        with self._transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS carts ("
+                " user_id TEXT PRIMARY KEY,"
+                " items TEXT NOT NULL,"
+                " updated_at REAL NOT NULL,"
+                " version INTEGER NOT NULL DEFAULT 1)"
+            )
+            # Arquivos criados antes das versões não têm a coluna
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(carts)")}
+            if 'version' not in columns:
+                conn.execute("ALTER TABLE carts ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+            conn.execute("CREATE INDEX IF NOT EXISTS carts_updated_at ON carts (updated_at)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS orders ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " data TEXT NOT NULL,"
+                " created_at REAL NOT NULL)"
+            )
+
+    # Conexões SQLite por thread: não precisamos do thread único do ORM
+    async def aget_versioned_cart(self, user_id):
+        return await sync_to_async(self.get_versioned_cart, thread_sensitive=False)(user_id)
+
+    async def asave_cart(self, user_id, quantities, version=None):
+        return await sync_to_async(self.save_cart, thread_sensitive=False)(user_id, quantities, version)
+
+    async def aplace_order(self, user_id, order, version=None):
+        await sync_to_async(self.place_order, thread_sensitive=False)(user_id, order, version)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        return _Transaction(self._connection())
+
+    @staticmethod
+    def _decode(items):
+        # Chaves JSON são sempre strings; os ids de produto são inteiros
+        return {int(product_id): quantity for product_id, quantity in json.loads(items)}
+
+    @staticmethod
+    def _encode(quantities):
+        # Lista de pares para preservar a ordem de inserção
+        return json.dumps(list(quantities.items()))
+
+    def _get_cart(self, user_id, conn=None):
+        # Leitura simples: no modo WAL não bloqueia nem é bloqueada por escritas
+        row = (conn or self._connection()).execute(
+            "SELECT items, version FROM carts WHERE user_id = ?", (str(user_id),)
+        ).fetchone()
+        return (self._decode(row[0]), row[1]) if row else ({}, 0)
+
+    def _save_cart(self, user_id, quantities, version):
+        if version is None:
+            # Gravação incondicional: lê a versão e grava na mesma transação
+            with self._transaction() as conn:
+                new_version = self._write_cart(conn, user_id, quantities, self._get_cart(user_id, conn)[1])
+        else:
+            new_version = self._write_cart(self._connection(), user_id, quantities, version)
+        if new_version is None:
+            raise CartConflict()
+        return new_version
+
+    def _write_cart(self, conn, user_id, quantities, version):
+        """
+        Grava o carrinho se ele estiver em `version` (0 = não existe), com um
+        único comando condicional. Retorna a nova versão, ou None se o
+        carrinho estava em outra versão.
+        """
+        user_id = str(user_id)
+        if version == 0:
+            if not quantities:
+                exists = conn.execute("SELECT 1 FROM carts WHERE user_id = ?", (user_id,)).fetchone()
+                return None if exists else 0
+            new_version = _new_version()
+            cursor = conn.execute(
+                "INSERT INTO carts (user_id, items, updated_at, version) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT(user_id) DO NOTHING",
+                (user_id, self._encode(quantities), time.time(), new_version),
+            )
+        elif not quantities:
+            new_version = 0
+            cursor = conn.execute("DELETE FROM carts WHERE user_id = ? AND version = ?", (user_id, version))
+        else:
+            new_version = version + 1
+            cursor = conn.execute(
+                "UPDATE carts SET items = ?, updated_at = ?, version = version + 1"
+                " WHERE user_id = ? AND version = ?",
+                (self._encode(quantities), time.time(), user_id, version),
+            )
+        return new_version if cursor.rowcount == 1 else None
+
+    def _place_order(self, user_id, order, version):
+        with self._transaction() as conn:
+            current = self._get_cart(user_id, conn)[1]
+            if version is not None and version != current:
+                # Nada foi gravado; o ROLLBACK do `_Transaction` é inofensivo
+                raise CartConflict()
+            conn.execute(
+                "INSERT INTO orders (data, created_at) VALUES (?, ?)",
+                (json.dumps(order, ensure_ascii=False), time.time()),
+            )
+            conn.execute("DELETE FROM carts WHERE user_id = ?", (str(user_id),))
+
+    def evict_abandoned(self):
+        with self._transaction() as conn:
+            removed = conn.execute(
+                "DELETE FROM carts WHERE updated_at < ?", (time.time() - self.cart_ttl,)
+            ).rowcount
+            removed += conn.execute(
+                "DELETE FROM carts WHERE user_id IN ("
+                " SELECT user_id FROM carts ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_carts,),
+            ).rowcount
+            conn.execute(
+                "DELETE FROM orders WHERE id <= (SELECT MAX(id) FROM orders) - ?",
+                (self.max_orders,),
+            )
+        return removed
+
+
+class _Transaction:
+    """Gerenciador de contexto: BEGIN IMMEDIATE / COMMIT (ou ROLLBACK) numa conexão."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+class DatabaseApiStore(BaseApiStore):
+    """
+    Carrinhos e pedidos no banco principal, com os modelos da loja.
+
+    O carrinho de um usuário da API é um `Order` não finalizado com
+    `transaction_id = "api-cart:<user_id>"` e um `OrderItem` por produto.
+    Os ids do catálogo JSON precisam existir em `Product`: um produto que
+    não existe levanta `UnknownProduct` antes de qualquer gravação (a API
+    responde 404). Os carrinhos em aberto não aparecem no admin de pedidos.
+    No checkout esse mesmo `Order` é finalizado e recebe o número do pedido.
+
+    A versão fica em `Order.version`. Cada gravação começa com um
+    `UPDATE ... WHERE version = ?`, que também trava a linha do carrinho até
+    o fim da transação; a restrição `order_open_cart_unique` impede que duas
+    requisições criem o mesmo carrinho ao mesmo tempo.
+    """
+
+    CART_PREFIX = 'api-cart:'
+
+    def _cart_orders(self, user_id):
+        from .models import Order
+        return Order.objects.filter(complete=False, transaction_id=f'{self.CART_PREFIX}{user_id}')
+
+    def _get_cart(self, user_id):
+        from .models import OrderItem
+        rows = list(
+            OrderItem.objects
+            .filter(order__complete=False, order__transaction_id=f'{self.CART_PREFIX}{user_id}')
+            .order_by('id')
+            .values_list('product_id', 'quantity', 'order__version')
+        )
+        # Carrinhos vazios são apagados, então "sem itens" é "não existe"
+        if not rows:
+            return {}, 0
+        return {product_id: quantity for product_id, quantity, _ in rows}, rows[0][2]
+
+    @transaction.atomic
+    def _save_cart(self, user_id, quantities, version):
+        from .models import Order, OrderItem, Product
+        if quantities:
+            # `OrderItem.product` é uma chave estrangeira
+            missing = set(quantities) - set(Product.objects.filter(pk__in=quantities).values_list('pk', flat=True))
+            if missing:
+                raise UnknownProduct(missing)
+        order = self._cart_orders(user_id).only('id', 'version').first()
+        current = order.version if order is not None else 0
+        if version is None:
+            version = current
+        if version != current:
+            raise CartConflict()
+
+        if order is None:
+            if not quantities:
+                return 0
+            try:
+                with transaction.atomic():
+                    order = Order.objects.create(
+                        complete=False, transaction_id=f'{self.CART_PREFIX}{user_id}', version=_new_version(),
+                    )
+            except IntegrityError:
+                # Outra requisição criou o carrinho primeiro
+                raise CartConflict()
+        elif not self._cart_orders(user_id).filter(pk=order.pk, version=version).update(version=version + 1):
+            raise CartConflict()
+        else:
+            order.version = version + 1
+
+        if not quantities:
+            self._delete_carts([order.pk])
+            return 0
+        OrderItem.objects.filter(order=order).delete()
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product_id=product_id, quantity=quantity)
+            for product_id, quantity in quantities.items()
+        ])
+        return order.version
+
+    @transaction.atomic
+    def _place_order(self, user_id, order, version):
+        from .models import Customer, OrderItem
+        # Trava o carrinho: nenhuma gravação concorrente até o commit
+        cart_order = self._cart_orders(user_id).select_for_update().first()
+        current = cart_order.version if cart_order is not None else 0
+        if version is not None and version != current:
+            raise CartConflict()
+        if cart_order is None:
+            return
+        customer = Customer.objects.for_email(order['customer']['email'], order['customer']['name'])
+        # Congela o preço de cada item e os totais do pedido
+        prices = {item['id']: item['price'] for item in order['items']}
+        items = list(cart_order.orderitem_set.all())
+        for item in items:
+            item.unit_price = Decimal(str(prices.get(item.product_id, 0)))
+        OrderItem.objects.bulk_update(items, ['unit_price'])
+
+        cart_order.customer = customer
+        cart_order.complete = True
+        cart_order.transaction_id = str(order['order_number'])
+        cart_order.compute_totals(items)
+        cart_order.save(update_fields=['customer', 'complete', 'transaction_id', 'total_amount', 'item_count'])
+
+    def _delete_carts(self, order_ids):
+        from .models import Order, OrderItem
+        # `OrderItem.order` é SET_NULL: os itens precisam ser apagados antes
+        OrderItem.objects.filter(order_id__in=order_ids).delete()
+        return Order.objects.filter(pk__in=order_ids).delete()[0]
+
+    @transaction.atomic
+    def evict_abandoned(self):
+        from django.db.models import Max
+        from django.utils import timezone
+        from .models import Order
+
+        carts = (
+            Order.objects
+            .filter(complete=False, transaction_id__startswith=self.CART_PREFIX)
+            # Os itens são recriados a cada alteração, então a data do item
+            # mais novo é a data do último uso do carrinho.
+            .annotate(last_used=Max('orderitem__date_added'))
+        )
+        cutoff = timezone.now() - datetime.timedelta(seconds=self.cart_ttl)
+        expired = list(carts.filter(last_used__lt=cutoff).values_list('pk', flat=True))
+        overflow = list(carts.order_by('-last_used').values_list('pk', flat=True)[self.max_carts:])
+        stale = set(expired) | set(overflow)
+        return self._delete_carts(stale) if stale else 0
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Retorna (criando na primeira chamada) o backend configurado em `settings.API_STORE`."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                config = settings.API_STORE
+                backend = import_string(config['BACKEND'])
+                _store = backend(**config.get('OPTIONS', {}))
+    return _store
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class AppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'app'
+
+    def ready(self):
+        # Conecta os receptores de sinais (cache do carrinho, etc.)
+        from . import signals  # noqa: F401
+        # Tempo de renderização dos templates nas métricas por requisição
+        from .instrumentation import install_template_timer
+        install_template_timer()
@@ -0,0 +1,67 @@
+"""
+Autenticação com o `Customer` já carregado.
+
+Quase toda página de usuário logado acaba em `request.user.customer`
+(checkout, pedidos). O `CustomerModelBackend` busca o usuário da sessão com
+`select_related('customer')`: usuário e cliente vêm na mesma consulta, e
+`Customer.objects.for_user(request.user)` não vai mais ao banco.
+"""
+from functools import partial
+
+from django.contrib import auth
+from django.contrib.auth import BACKEND_SESSION_KEY, get_user_model
+from django.contrib.auth import middleware
+from django.contrib.auth.backends import ModelBackend
+from django.utils.functional import SimpleLazyObject
+
+UserModel = get_user_model()
+
+BACKEND_PATH = 'app.auth.CustomerModelBackend'
+# Backend gravado nas sessões abertas antes do CustomerModelBackend
+LEGACY_BACKEND_PATH = 'django.contrib.auth.backends.ModelBackend'
+
+
+class CustomerModelBackend(ModelBackend):
+    """`ModelBackend` que carrega o usuário da sessão junto com o seu `Customer`."""
+
+    def get_user(self, user_id):
+        # `aget_user` (views assíncronas) também passa por aqui
+        try:
+            user = UserModel._default_manager.select_related('customer').get(pk=user_id)
+        except UserModel.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
+
+
+def _upgrade_session(request):
+    if request.session.get(BACKEND_SESSION_KEY) == LEGACY_BACKEND_PATH:
+        request.session[BACKEND_SESSION_KEY] = BACKEND_PATH
+
+
+def get_user(request):
+    if not hasattr(request, '_cached_user'):
+        _upgrade_session(request)
+        request._cached_user = auth.get_user(request)
+    return request._cached_user
+
+
+async def auser(request):
+    if not hasattr(request, '_acached_user'):
+        if await request.session.aget(BACKEND_SESSION_KEY) == LEGACY_BACKEND_PATH:
+            await request.session.aset(BACKEND_SESSION_KEY, BACKEND_PATH)
+        request._acached_user = await auth.aget_user(request)
+    return request._acached_user
+
+
+class AuthenticationMiddleware(middleware.AuthenticationMiddleware):
+    """
+    `AuthenticationMiddleware` do Django que passa as sessões abertas com o
+    `ModelBackend` para o `CustomerModelBackend` (senão o Django, que só
+    aceita backends de `AUTHENTICATION_BACKENDS`, deslogaria essas pessoas).
+    Como no original, a sessão só é lida quando `request.user` é usado.
+    """
+
+    def process_request(self, request):
+        super().process_request(request)
+        request.user = SimpleLazyObject(lambda: get_user(request))
+        request.auser = partial(auser, request)
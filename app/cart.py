@@ -0,0 +1,173 @@
+"""
+Motor de resolução do carrinho.
+
+O carrinho guarda apenas `product_id -> quantidade`. Para exibi-lo precisamos
+do nome, preço, imagem e estoque de cada produto. Em vez de uma consulta por
+item, este módulo busca todos os produtos que faltam em UMA consulta
+(`in_bulk`) e guarda um "retrato" (snapshot) de cada um num cache LRU em
+memória, com tempo de expiração. Um carrinho "quente" não custa nenhuma
+consulta ao banco.
+
+O cache é limpo produto a produto pelos sinais de `post_save`/`post_delete`
+de `Product` (veja `app/signals.py`), então uma alteração feita no admin
+aparece no carrinho imediatamente neste processo.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .models import Product
+
+
+class ProductSnapshot:
+    """
+    Cópia leve e imutável dos campos de um `Product` que o carrinho exibe.
+    """
+    __slots__ = ('id', 'name', 'price', 'image_url', 'image_hash', 'stock')
+
+    def __init__(self, id, name, price, image_url, image_hash, stock):
+        self.id = id
+        self.name = name
+        self.price = price
+        self.image_url = image_url
+        self.image_hash = image_hash
+        self.stock = stock
+
+    @classmethod
+    def from_product(cls, product):
+        return cls(
+            id=product.id,
+            name=product.name,
+            price=product.price,
+            image_url=product.image.url if product.image else '',
+            image_hash=product.image_hash,
+            stock=product.stock,
+        )
+
+    def __repr__(self):
+        return f"<ProductSnapshot {self.id}: {self.name}>"
+
+
+class ProductSnapshotCache:
+    """
+    Cache LRU, com TTL, de `ProductSnapshot` indexado pelo id do produto.
+    É seguro para uso entre threads do mesmo processo.
+    """
+
+    def __init__(self, max_size=1000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()  # product_id -> (expira_em, snapshot)
+        self._lock = threading.Lock()
+
+    def get_many(self, product_ids):
+        """
+        Retorna `(encontrados, faltando)`: um dicionário id -> snapshot com os
+        itens válidos do cache e a lista de ids que precisam ir ao banco.
+        """
+        found = {}
+        missing = []
+        now = time.monotonic()
+        with self._lock:
+            for product_id in product_ids:
+                entry = self._data.get(product_id)
+                if entry is None or entry[0] <= now:
+                    missing.append(product_id)
+                    continue
+                self._data.move_to_end(product_id)
+                found[product_id] = entry[1]
+        return found, missing
+
+    def set_many(self, snapshots):
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            for product_id, snapshot in snapshots.items():
+                self._data[product_id] = (expires_at, snapshot)
+                self._data.move_to_end(product_id)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def evict(self, product_id):
+        with self._lock:
+            self._data.pop(product_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+snapshot_cache = ProductSnapshotCache(
+    max_size=getattr(settings, 'CART_SNAPSHOT_CACHE_SIZE', 1000),
+    ttl=getattr(settings, 'CART_SNAPSHOT_TTL', 300),
+)
+
+
+def _fetch_queryset():
+    return Product.objects.only('id', 'name', 'price', 'image', 'image_hash', 'stock')
+
+
+def _store_fetched(snapshots, products):
+    fetched = {pk: ProductSnapshot.from_product(p) for pk, p in products.items()}
+    snapshot_cache.set_many(fetched)
+    snapshots.update(fetched)
+    return snapshots
+
+
+def get_snapshots(product_ids):
+    """
+    Retorna um dicionário id -> `ProductSnapshot` para os ids informados.
+    Ids de produtos inexistentes simplesmente não aparecem no resultado.
+    Faz no máximo UMA consulta ao banco, e nenhuma se tudo estiver em cache.
+    """
+    snapshots, missing = snapshot_cache.get_many(product_ids)
+    if missing:
+        _store_fetched(snapshots, _fetch_queryset().in_bulk(missing))
+    return snapshots
+
+
+async def aget_snapshots(product_ids):
+    """Versão assíncrona de `get_snapshots` (ORM assíncrono, `ain_bulk`)."""
+    snapshots, missing = snapshot_cache.get_many(product_ids)
+    if missing:
+        _store_fetched(snapshots, await _fetch_queryset().ain_bulk(missing))
+    return snapshots
+
+
+def _build_cart(quantities, snapshots):
+    cart_items = []
+    total_price = 0
+    invalid_ids = []
+    for product_id, quantity in quantities.items():
+        product = snapshots.get(product_id)
+        if product is None:
+            invalid_ids.append(product_id)
+            continue
+        total_item_price = product.price * quantity
+        cart_items.append({
+            'product': product,
+            'quantity': quantity,
+            'total_price': total_item_price,
+        })
+        total_price += total_item_price
+    return cart_items, total_price, invalid_ids
+
+
+def resolve_cart(quantities):
+    """
+    Resolve um carrinho no formato `{product_id: quantidade}`.
+
+    Retorna `(cart_items, total_price, invalid_ids)`, onde `invalid_ids` são
+    os ids que não correspondem a nenhum produto e devem ser removidos do
+    carrinho pelo chamador.
+    """
+    return _build_cart(quantities, get_snapshots(list(quantities)))
+
+
+async def aresolve_cart(quantities):
+    """Versão assíncrona de `resolve_cart`."""
+    return _build_cart(quantities, await aget_snapshots(list(quantities)))
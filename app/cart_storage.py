@@ -0,0 +1,447 @@
+"""
+Armazenamento do carrinho da loja (vitrine).
+
+O carrinho ficava em `request.session['cart']` como um JSON
+`{"id": {"quantity": n}}`. Com o backend de sessão no banco, cada clique em
+"Adicionar", "+", "-" ou "Remover" virava um `UPDATE` em `django_session`.
+Agora o carrinho tem o seu próprio armazenamento, escolhido em
+`settings.CART_STORE`:
+
+* `SignedCookieCartStore` (padrão): o carrinho vai num cookie assinado.
+  Nenhuma escrita no servidor.
+* `CacheCartStore`: num cache do Django (LocMem, Redis...). O cookie guarda
+  apenas um id aleatório do carrinho.
+* `FileCartStore`: um arquivo por carrinho numa pasta local, também
+  identificado pelo cookie.
+
+O conteúdo é codificado de forma compacta por `encode_cart`: os pares
+`(id, quantidade)` em varints, com os ids ordenados e guardados como
+diferença para o anterior. Um carrinho de 10 itens ocupa cerca de 25 bytes.
+
+O `CartMiddleware` carrega o carrinho em `request.cart` (um `Cart`) e só o
+grava de volta se ele mudou de fato.
+
+Carrinhos antigos, ainda em `request.session['cart']`, são migrados pelo
+`CartMiddleware` na primeira requisição sem o cookie do carrinho: o
+conteúdo vai para o backend atual e sai da sessão (veja `legacy_cart`).
+
+Cada carrinho tem também um id aleatório, `Cart.key`, criado no primeiro uso:
+ele identifica as reservas de estoque do carrinho (veja app/stock.py). Nos
+backends do servidor é o próprio id guardado no cookie; no cookie assinado
+vai junto com o conteúdo.
+"""
+import base64
+import binascii
+import os
+import secrets
+import threading
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+CART_FORMAT_VERSION = 1
+
+
+def _write_varint(out, value):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, pos):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]  # IndexError se os dados estiverem truncados
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+        if shift > 63:
+            raise ValueError("varint longo demais")
+
+
+def encode_cart(quantities):
+    """Codifica `{product_id: quantidade}` em bytes (veja o docstring do módulo)."""
+    out = bytearray([CART_FORMAT_VERSION])
+    previous = 0
+    for product_id in sorted(quantities):
+        _write_varint(out, product_id - previous)
+        _write_varint(out, quantities[product_id])
+        previous = product_id
+    return bytes(out)
+
+
+def decode_cart(data):
+    """
+    Decodifica o resultado de `encode_cart`. Dados inválidos, truncados ou de
+    outra versão resultam num carrinho vazio.
+    """
+    if not data or data[0] != CART_FORMAT_VERSION:
+        return {}
+    quantities = {}
+    product_id = 0
+    pos = 1
+    try:
+        while pos < len(data):
+            delta, pos = _read_varint(data, pos)
+            quantity, pos = _read_varint(data, pos)
+            product_id += delta
+            if quantity > 0:
+                quantities[product_id] = quantity
+    except (IndexError, ValueError):
+        return {}
+    return quantities
+
+
+class Cart:
+    """
+    O carrinho de um visitante: `product_id -> quantidade`, na ordem dos ids.
+    `modified` indica se ele precisa ser gravado ao fim da requisição.
+    """
+
+    def __init__(self, quantities=None, key=None):
+        self._items = dict(quantities or {})
+        self._key = key
+        self.modified = False
+
+    @property
+    def key(self):
+        """Id aleatório e estável do carrinho, criado na primeira vez que é usado."""
+        if self._key is None:
+            self._key = secrets.token_urlsafe(24)
+            self.modified = True
+        return self._key
+
+    @property
+    def has_key(self):
+        return self._key is not None
+
+    def add(self, product_id, quantity=1):
+        self.set(product_id, self._items.get(product_id, 0) + quantity)
+
+    def set(self, product_id, quantity):
+        """Define a quantidade do produto; zero ou menos o remove."""
+        if quantity <= 0:
+            self.remove(product_id)
+        elif self._items.get(product_id) != quantity:
+            self._items[product_id] = quantity
+            self.modified = True
+
+    def remove(self, product_id):
+        """Remove o produto. Retorna True se ele estava no carrinho."""
+        if self._items.pop(product_id, None) is None:
+            return False
+        self.modified = True
+        return True
+
+    def replace(self, quantities):
+        """Troca todo o conteúdo do carrinho (apenas quantidades positivas)."""
+        quantities = {pid: qty for pid, qty in quantities.items() if qty > 0}
+        if quantities != self._items:
+            self._items = quantities
+            self.modified = True
+
+    def clear(self):
+        if self._items:
+            self._items.clear()
+            self.modified = True
+
+    @property
+    def quantities(self):
+        """Cópia do carrinho como `{product_id: quantidade}`."""
+        return dict(self._items)
+
+    @property
+    def count(self):
+        """Número total de unidades (o contador do ícone do carrinho)."""
+        return sum(self._items.values())
+
+    def get(self, product_id, default=0):
+        return self._items.get(product_id, default)
+
+    def __contains__(self, product_id):
+        return product_id in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def __bool__(self):
+        return bool(self._items)
+
+
+class BaseCartStore:
+    """
+    Interface comum dos backends: `load(request)` retorna um `Cart` e
+    `save(request, response, cart)` o persiste (grava o cookie na resposta).
+    """
+
+    def __init__(self, cookie_name='cart', max_age=60 * 60 * 24 * 30):
+        self.cookie_name = cookie_name
+        self.max_age = max_age
+
+    def load(self, request):
+        raise NotImplementedError
+
+    def save(self, request, response, cart):
+        raise NotImplementedError
+
+    # Por padrão as versões assíncronas rodam as síncronas num thread à
+    # parte; backends sem E/S bloqueante sobrescrevem.
+    async def aload(self, request):
+        return await sync_to_async(self.load, thread_sensitive=False)(request)
+
+    async def asave(self, request, response, cart):
+        await sync_to_async(self.save, thread_sensitive=False)(request, response, cart)
+
+    def _set_cookie(self, response, value):
+        response.set_cookie(
+            self.cookie_name, value,
+            max_age=self.max_age,
+            secure=settings.SESSION_COOKIE_SECURE,
+            httponly=True,
+            samesite='Lax',
+        )
+
+
+class SignedCookieCartStore(BaseCartStore):
+    """
+    O carrinho inteiro num cookie assinado com a `SECRET_KEY` (o visitante
+    pode lê-lo, mas não alterá-lo). Cookies têm limite de ~4 KB, o que
+    comporta algumas centenas de produtos diferentes. O valor é
+    `<Cart.key>.<conteúdo em base64>`.
+    """
+    salt = 'app.cart_storage'
+
+    def load(self, request):
+        value = request.get_signed_cookie(self.cookie_name, default=None, salt=self.salt, max_age=self.max_age)
+        if not value:
+            return Cart()
+        # Cookies anteriores ao `Cart.key` têm só o conteúdo
+        key, _, value = value.rpartition('.')
+        try:
+            data = base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+        except (binascii.Error, ValueError):
+            return Cart()
+        return Cart(decode_cart(data), key=key or None)
+
+    def save(self, request, response, cart):
+        if not cart:
+            response.delete_cookie(self.cookie_name, samesite='Lax')
+            return
+        value = base64.urlsafe_b64encode(encode_cart(cart.quantities)).decode().rstrip('=')
+        value = f'{cart.key}.{value}'
+        response.set_signed_cookie(
+            self.cookie_name, value, salt=self.salt,
+            max_age=self.max_age,
+            secure=settings.SESSION_COOKIE_SECURE,
+            httponly=True,
+            samesite='Lax',
+        )
+
+    async def aload(self, request):
+        return self.load(request)
+
+    async def asave(self, request, response, cart):
+        self.save(request, response, cart)
+
+
+class KeyedCartStore(BaseCartStore):
+    """
+    Base dos backends que guardam o carrinho no servidor. O cookie leva só
+    o id aleatório do carrinho (`Cart.key`). As subclasses implementam
+    `_read(cart_id)`, `_write(cart_id, data)` e `_delete(cart_id)`.
+    """
+
+    def _cart_id(self, request):
+        cart_id = request.COOKIES.get(self.cookie_name, '')
+        # Ids vêm de `secrets.token_urlsafe`; qualquer outra coisa é ignorada
+        if 16 <= len(cart_id) <= 64 and cart_id.replace('-', '').replace('_', '').isalnum():
+            return cart_id
+        return None
+
+    def load(self, request):
+        cart_id = self._cart_id(request)
+        if cart_id is None:
+            return Cart()
+        return Cart(decode_cart(self._read(cart_id)), key=cart_id)
+
+    def save(self, request, response, cart):
+        cart_id = self._cart_id(request)
+        if not cart:
+            if cart_id is not None:
+                self._delete(cart_id)
+            return
+        self._write(cart.key, encode_cart(cart.quantities))
+        # Renova o cookie para que ele expire junto com o carrinho
+        self._set_cookie(response, cart.key)
+
+    def _read(self, cart_id):
+        raise NotImplementedError
+
+    def _write(self, cart_id, data):
+        raise NotImplementedError
+
+    def _delete(self, cart_id):
+        raise NotImplementedError
+
+
+class CacheCartStore(KeyedCartStore):
+    """Carrinhos num cache do Django (`alias` em `settings.CACHES`)."""
+
+    def __init__(self, alias='default', key_prefix='cart:', **kwargs):
+        super().__init__(**kwargs)
+        self.alias = alias
+        self.key_prefix = key_prefix
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def _read(self, cart_id):
+        return self.cache.get(self.key_prefix + cart_id)
+
+    def _write(self, cart_id, data):
+        self.cache.set(self.key_prefix + cart_id, data, self.max_age)
+
+    def _delete(self, cart_id):
+        self.cache.delete(self.key_prefix + cart_id)
+
+    async def aload(self, request):
+        cart_id = self._cart_id(request)
+        if cart_id is None:
+            return Cart()
+        return Cart(decode_cart(await self.cache.aget(self.key_prefix + cart_id)), key=cart_id)
+
+    async def asave(self, request, response, cart):
+        cart_id = self._cart_id(request)
+        if not cart:
+            if cart_id is not None:
+                await self.cache.adelete(self.key_prefix + cart_id)
+            return
+        await self.cache.aset(self.key_prefix + cart.key, encode_cart(cart.quantities), self.max_age)
+        self._set_cookie(response, cart.key)
+
+
+class FileCartStore(KeyedCartStore):
+    """
+    Um arquivo por carrinho em `path`. A gravação é atômica (arquivo
+    temporário + `os.replace`), então uma leitura concorrente nunca vê um
+    carrinho pela metade. Arquivos mais velhos que `max_age` são ignorados;
+    apague-os periodicamente (ex: `find <path> -mtime +30 -delete`).
+    """
+
+    def __init__(self, path=None, **kwargs):
+        super().__init__(**kwargs)
+        self.path = str(path or settings.BASE_DIR / 'carts')
+        os.makedirs(self.path, exist_ok=True)
+
+    def _file(self, cart_id):
+        return os.path.join(self.path, cart_id)
+
+    def _read(self, cart_id):
+        try:
+            with open(self._file(cart_id), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write(self, cart_id, data):
+        tmp = f'{self._file(cart_id)}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, self._file(cart_id))
+
+    def _delete(self, cart_id):
+        try:
+            os.remove(self._file(cart_id))
+        except FileNotFoundError:
+            pass
+
+
+LEGACY_SESSION_KEY = 'cart'
+
+
+def legacy_cart(data):
+    """
+    Converte o carrinho antigo da sessão (`{"id": {"quantity": n}}`) em
+    `{product_id: quantidade}`, ignorando entradas inválidas.
+    """
+    quantities = {}
+    if not isinstance(data, dict):
+        return quantities
+    for product_id, item in data.items():
+        try:
+            product_id, quantity = int(product_id), int(item['quantity'])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if quantity > 0:
+            quantities[product_id] = quantity
+    return quantities
+
+
+def _has_legacy_cart(request, store, cart):
+    # Só quem ainda não tem o cookie do carrinho mas tem uma sessão pode ter
+    # um carrinho antigo: os demais não pagam a leitura da sessão.
+    return (
+        not cart
+        and store.cookie_name not in request.COOKIES
+        and settings.SESSION_COOKIE_NAME in request.COOKIES
+        and hasattr(request, 'session')
+    )
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_cart_store():
+    """Retorna (criando na primeira chamada) o backend configurado em `settings.CART_STORE`."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                config = settings.CART_STORE
+                backend = import_string(config['BACKEND'])
+                _store = backend(**config.get('OPTIONS', {}))
+    return _store
+
+
+class CartMiddleware:
+    """
+    Disponibiliza o carrinho em `request.cart` e o grava ao fim da
+    requisição, apenas se ele tiver mudado.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        store = get_cart_store()
+        request.cart = store.load(request)
+        if _has_legacy_cart(request, store, request.cart):
+            request.cart.replace(legacy_cart(request.session.pop(LEGACY_SESSION_KEY, None)))
+        response = self.get_response(request)
+        if request.cart.modified:
+            store.save(request, response, request.cart)
+        return response
+
+    async def __acall__(self, request):
+        store = get_cart_store()
+        request.cart = await store.aload(request)
+        if _has_legacy_cart(request, store, request.cart):
+            request.cart.replace(legacy_cart(await request.session.apop(LEGACY_SESSION_KEY, None)))
+        response = await self.get_response(request)
+        if request.cart.modified:
+            await store.asave(request, response, request.cart)
+        return response
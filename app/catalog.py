@@ -0,0 +1,190 @@
+"""
+Cache da grade de produtos da vitrine.
+
+A grade só muda quando alguém altera um `Product`, então ela é renderizada
+uma vez e guardada em cache como HTML pronto. A chave inclui um número de
+versão do catálogo que é incrementado pelos sinais de `post_save` e
+`post_delete` de `Product` (veja `app/signals.py`): qualquer alteração
+invalida todas as páginas de uma vez, sem precisar apagar chave por chave.
+
+As partes que dependem do visitante (contador e modal do carrinho em
+`base.html`) continuam sendo renderizadas a cada requisição. Dentro da
+própria grade há dois "buracos" preenchidos por requisição: o token CSRF
+dos formulários "Adicionar" e, no lugar do botão, a situação do estoque de
+cada produto, que muda a cada reserva sem invalidar a grade (os números vêm
+do contador em cache de `app/stock.py`).
+
+Só vão para o cache as páginas alcançadas por cursores que a própria
+grade emitiu (o "Próxima" de uma página em cache), até a página
+`CATALOG_CACHED_PAGES`. Um cursor inventado ou inválido não cria chaves
+novas: inválido vira a primeira página, e os demais são renderizados sem
+cache.
+"""
+import hashlib
+import re
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.middleware.csrf import get_token
+from django.template.loader import render_to_string
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
+
+from .models import Product
+from .pagination import apaginate_keyset, decode_cursor, encode_cursor, paginate_keyset
+from .stock import aget_available, get_available
+
+CATALOG_VERSION_KEY = 'catalog:version'
+
+# Valor colocado no lugar do token CSRF ao renderizar a grade para o cache
+CSRF_PLACEHOLDER = '__catalog_csrf_token__'
+
+# Marcador do botão "Adicionar" / situação do estoque de cada produto
+STOCK_PLACEHOLDER = '__catalog_stock_{}__'
+STOCK_HOLE = re.compile(r'__catalog_stock_(\d+)__')
+
+
+def get_catalog_version():
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        # Começamos de um timestamp, e não de 1, para que um cache reiniciado
+        # nunca reaproveite fragmentos de uma versão antiga.
+        cache.add(CATALOG_VERSION_KEY, int(time.time() * 1000), timeout=None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+async def aget_catalog_version():
+    """Versão assíncrona de `get_catalog_version`."""
+    version = await cache.aget(CATALOG_VERSION_KEY)
+    if version is None:
+        await cache.aadd(CATALOG_VERSION_KEY, int(time.time() * 1000), timeout=None)
+        version = await cache.aget(CATALOG_VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    """Invalida todos os fragmentos da grade. Chamado ao salvar/excluir produtos."""
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        # A chave ainda não existe (ou expirou): qualquer versão nova serve
+        get_catalog_version()
+
+
+def normalize_cursor(cursor):
+    """O cursor na forma emitida por `encode_cursor`; None se ausente ou inválido."""
+    position = decode_cursor(cursor) if cursor else None
+    return encode_cursor(*position) if position else None
+
+
+def _grid_cache_keys(version, cursor):
+    """Chaves da página no cache: (número da página emitida, HTML da grade)."""
+    cursor_hash = hashlib.md5((cursor or '').encode()).hexdigest()
+    prefix = f'catalog:{version}:{settings.CATALOG_PAGE_SIZE}:{cursor_hash}'
+    return f'{prefix}:page', f'{prefix}:grid'
+
+
+def _cached_grid(cursor, keys, found):
+    """
+    A partir do resultado do `get_many` de `keys`, retorna
+    `(html ou None, número da página ou None)`. Sem número, a página não vem
+    de um cursor emitido por nós e não deve ser guardada.
+    """
+    page_key, grid_key = keys
+    number = 1 if cursor is None else found.get(page_key)
+    return (found.get(grid_key) if number is not None else None), number
+
+
+def _grid_entries(version, page, number, html, keys):
+    """O que gravar no cache depois de renderizar a página `number`."""
+    entries = {keys[1]: html}
+    if page.has_next and number < settings.CATALOG_CACHED_PAGES:
+        entries[_grid_cache_keys(version, page.next_cursor)[0]] = number + 1
+    return entries
+
+
+def _grid_queryset():
+    return Product.objects.only('id', 'name', 'description', 'price', 'image', 'image_hash', 'created_at')
+
+
+def _render_grid(page):
+    return render_to_string('app/partials/product_grid.html', {
+        'products': page,
+        'page': page,
+        'csrf_token': CSRF_PLACEHOLDER,
+        'stock_placeholder': True,
+    })
+
+
+def render_stock_status(available):
+    """
+    O botão "Adicionar" do card, com um aviso quando restam poucas unidades,
+    ou um botão desativado se o produto estiver esgotado.
+    """
+    if available is not None and available <= 0:
+        return format_html(
+            '<button type="button" disabled class="bg-gray-300 text-gray-600 py-2 px-4 rounded-lg cursor-not-allowed">Esgotado</button>'
+        )
+    button = format_html('<button type="submit" class="bg-blue-500 text-white py-2 px-4 rounded-lg hover:bg-blue-600">Adicionar</button>')
+    if available is not None and available <= settings.LOW_STOCK_THRESHOLD:
+        return format_html('<span class="text-xs text-orange-600 mr-2">Restam {}</span>{}', available, button)
+    return button
+
+
+def render_product_grid(cursor=None):
+    """
+    Retorna o HTML da grade de produtos (uma página do catálogo) com o
+    marcador `CSRF_PLACEHOLDER` no lugar do token. Usa o cache quando possível.
+    """
+    cursor = normalize_cursor(cursor)
+    version = get_catalog_version()
+    keys = _grid_cache_keys(version, cursor)
+    html, number = _cached_grid(cursor, keys, cache.get_many(keys))
+    if html is None:
+        page = paginate_keyset(_grid_queryset(), cursor=cursor, per_page=settings.CATALOG_PAGE_SIZE)
+        html = _render_grid(page)
+        if number is not None:
+            cache.set_many(_grid_entries(version, page, number, html, keys), settings.CATALOG_FRAGMENT_TTL)
+    return html
+
+
+async def arender_product_grid(cursor=None):
+    """Versão assíncrona de `render_product_grid`."""
+    cursor = normalize_cursor(cursor)
+    version = await aget_catalog_version()
+    keys = _grid_cache_keys(version, cursor)
+    html, number = _cached_grid(cursor, keys, await cache.aget_many(keys))
+    if html is None:
+        page = await apaginate_keyset(_grid_queryset(), cursor=cursor, per_page=settings.CATALOG_PAGE_SIZE)
+        html = _render_grid(page)
+        if number is not None:
+            await cache.aset_many(_grid_entries(version, page, number, html, keys), settings.CATALOG_FRAGMENT_TTL)
+    return html
+
+
+def _stock_hole_ids(html):
+    return [int(product_id) for product_id in STOCK_HOLE.findall(html)]
+
+
+def _fill_holes(request, html, available):
+    # Produtos que sumiram do banco desde que a grade foi renderizada
+    # aparecem como esgotados.
+    html = STOCK_HOLE.sub(lambda match: render_stock_status(available.get(int(match.group(1)), 0)), html)
+    return mark_safe(html.replace(CSRF_PLACEHOLDER, get_token(request)))
+
+
+def product_grid_for_request(request):
+    """
+    Grade de produtos pronta para o template, com o token CSRF e o estoque
+    disponível desta requisição.
+    """
+    html = render_product_grid(request.GET.get('cursor'))
+    return _fill_holes(request, html, get_available(_stock_hole_ids(html)))
+
+
+async def aproduct_grid_for_request(request):
+    """Versão assíncrona de `product_grid_for_request`."""
+    html = await arender_product_grid(request.GET.get('cursor'))
+    return _fill_holes(request, html, await aget_available(_stock_hole_ids(html)))
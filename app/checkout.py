@@ -0,0 +1,116 @@
+"""
+Criação de pedidos a partir do carrinho.
+
+Todo o checkout roda numa única transação:
+
+1. consome as reservas de estoque do carrinho (app/stock.py) e baixa o
+   estoque de todos os itens com UM `UPDATE` condicional, que só altera as
+   linhas com estoque suficiente; se alguma ficar de fora, o pedido inteiro
+   é cancelado (nada de vender o que não temos). As unidades reservadas
+   pelo próprio carrinho contam como disponíveis para ele;
+2. grava o `Order` já finalizado, com os totais calculados, uma única vez;
+3. grava todos os `OrderItem`, com o preço unitário lido do banco no
+   momento da compra (os snapshots do carrinho servem só para exibição),
+   com um único `bulk_create`.
+"""
+import datetime
+
+from django.db import transaction
+from django.db.models import F
+
+from .cart import snapshot_cache
+from .models import Order, OrderItem, Product, StockReservation
+from .stock import InsufficientStock, ReservationConflict, evict_available, quantity_case, take_reservations
+
+
+class CheckoutConflict(Exception):
+    """
+    Outras requisições do mesmo carrinho alteraram as reservas durante o
+    checkout (ex.: cliques em outra aba). Nada foi gravado; o cliente pode
+    tentar de novo.
+    """
+
+    def __init__(self):
+        super().__init__("Seu carrinho foi alterado enquanto o pedido era finalizado. Tente de novo.")
+
+
+def decrement_stock(quantities, reserved=None):
+    """
+    Baixa o estoque de vários produtos de uma vez (`{product_id: quantidade}`).
+    `reserved` são as unidades que o próprio comprador tinha reservado
+    (`{product_id: quantidade}`, já removidas de `StockReservation`): elas
+    saem de `Product.reserved` no mesmo UPDATE.
+    Deve ser chamada dentro de uma transação: se algum produto não tiver
+    estoque suficiente, levanta `InsufficientStock` e o chamador desfaz tudo.
+    """
+    reserved = reserved or {}
+    quantity = quantity_case(quantities)
+    held = quantity_case(reserved)
+    updated = (
+        Product.objects
+        .filter(id__in=quantities, stock__gte=F('reserved') - held + quantity)
+        .update(stock=F('stock') - quantity, reserved=F('reserved') - held)
+    )
+    if updated != len(quantities):
+        short = [
+            product for product in Product.objects.filter(id__in=quantities).only('id', 'name', 'stock', 'reserved')
+            if product.stock - product.reserved + reserved.get(product.id, 0) < quantities[product.id]
+        ]
+        raise InsufficientStock(short)
+
+    # Reservas de produtos que já não estão no carrinho só voltam ao disponível
+    leftover = {product_id: units for product_id, units in reserved.items() if product_id not in quantities}
+    if leftover:
+        Product.objects.filter(id__in=leftover).update(reserved=F('reserved') - quantity_case(leftover))
+
+    # O UPDATE em lote não dispara sinais: limpamos os snapshots do carrinho
+    # e o disponível em cache depois do commit para que o estoque exibido não
+    # fique desatualizado.
+    touched = set(quantities) | set(reserved)
+    transaction.on_commit(lambda: [snapshot_cache.evict(product_id) for product_id in touched])
+    transaction.on_commit(lambda: evict_available(touched))
+
+
+def place_order(customer, cart_items, cart_key=None):
+    """
+    Cria o pedido finalizado para os `cart_items` (formato de
+    `_get_cart_context`) e baixa o estoque, tudo ou nada. Com `cart_key`
+    (`Cart.key`), as reservas do carrinho são convertidas em venda.
+    Levanta `InsufficientStock` se algum item não puder ser atendido e
+    `CheckoutConflict` se as reservas não pararem de mudar.
+    """
+    quantities = {}
+    for item in cart_items:
+        product_id = item['product'].id
+        quantities[product_id] = quantities.get(product_id, 0) + item['quantity']
+
+    with transaction.atomic():
+        reserved = {}
+        if cart_key:
+            try:
+                reserved = take_reservations(StockReservation.objects.filter(cart_key=cart_key))
+            except ReservationConflict:
+                raise CheckoutConflict()
+        decrement_stock(quantities, reserved)
+
+        # Preço do banco, não do snapshot do carrinho: o cache é por processo
+        # e pode estar até CART_SNAPSHOT_TTL segundos atrasado em relação a
+        # uma edição feita em outro worker. As linhas já estão travadas pelo
+        # UPDATE acima, então o preço lido é o da venda.
+        prices = dict(Product.objects.filter(pk__in=quantities).values_list('id', 'price'))
+        items = [
+            OrderItem(product_id=item['product'].id, quantity=item['quantity'], unit_price=prices[item['product'].id])
+            for item in cart_items
+        ]
+        order = Order(
+            customer=customer,
+            complete=True,
+            transaction_id=datetime.datetime.now().timestamp(),  # ID de transação simples
+        )
+        order.compute_totals(items)
+        order.save()
+
+        for item in items:
+            item.order = order
+        OrderItem.objects.bulk_create(items)
+    return order
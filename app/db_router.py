@@ -0,0 +1,153 @@
+"""
+Roteamento entre o banco primário e as réplicas de leitura.
+
+As réplicas são configuradas em `settings.DATABASES` com aliases
+`replica_1`, `replica_2`... (veja `DB_REPLICA_HOSTS` em settings.py). O
+roteador só manda leituras para uma réplica dentro das views marcadas com
+`@use_read_replica` (vitrine, busca); todo o resto, incluindo qualquer
+view que grave (carrinho, reservas de estoque, checkout), usa o primário
+(`default`). Não marque views que gravam: as leituras que antecedem a
+escrita (ex.: a reserva lida antes do `UPDATE` condicional em
+app/stock.py) viriam de uma réplica possivelmente atrasada.
+
+Logo depois de uma escrita a réplica pode ainda não ter recebido a
+alteração. Por isso, quando uma requisição grava no banco, o
+`DatabaseRoutingMiddleware` devolve um cookie que faz as leituras daquele
+visitante ficarem no primário por `DB_READ_STICKY_SECONDS` segundos.
+
+Sessões, usuários e content types sempre são lidos do primário.
+"""
+import contextvars
+import functools
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+STICKY_COOKIE = 'db_primary_until'
+
+# Apps que nunca são lidos de uma réplica
+PRIMARY_ONLY_APPS = {'auth', 'contenttypes', 'sessions', 'admin'}
+
+
+class RoutingState:
+    """Estado do roteamento na requisição atual."""
+
+    def __init__(self, sticky=False):
+        self.sticky = sticky  # o visitante gravou algo há pouco: só primário
+        self.read_replica = False  # dentro de uma view `@use_read_replica`
+        self.wrote = False
+
+
+_state = contextvars.ContextVar('db_routing_state', default=None)
+
+
+def replica_aliases():
+    return [alias for alias in settings.DATABASES if alias.startswith('replica_')]
+
+
+class PrimaryReplicaRouter:
+    """Roteador do Django (`settings.DATABASE_ROUTERS`)."""
+
+    def __init__(self):
+        self.replicas = replica_aliases()
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if (
+            not self.replicas
+            or state is None
+            or not state.read_replica
+            or state.sticky
+            or state.wrote
+            or model._meta.app_label in PRIMARY_ONLY_APPS
+        ):
+            return DEFAULT_DB_ALIAS
+        return random.choice(self.replicas)
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Primário e réplicas têm os mesmos dados
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+def use_read_replica(view):
+    """
+    Decorador de views somente leitura: as consultas da view podem ir para
+    uma réplica. Nunca em views que gravam no banco. Funciona com views
+    síncronas e assíncronas.
+    """
+    if iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            state = _state.get()
+            if state is not None:
+                state.read_replica = True
+            return await view(request, *args, **kwargs)
+    else:
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            state = _state.get()
+            if state is not None:
+                state.read_replica = True
+            return view(request, *args, **kwargs)
+    return wrapper
+
+
+class DatabaseRoutingMiddleware:
+    """
+    Cria o `RoutingState` da requisição e, se ela gravou no banco, marca o
+    visitante para ler do primário pelos próximos `DB_READ_STICKY_SECONDS`.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = self._start(request)
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self._finish(state, response)
+
+    async def __acall__(self, request):
+        state = self._start(request)
+        token = _state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self._finish(state, response)
+
+    @staticmethod
+    def _start(request):
+        try:
+            primary_until = float(request.COOKIES.get(STICKY_COOKIE, 0))
+        except ValueError:
+            primary_until = 0
+        return RoutingState(sticky=primary_until > time.time())
+
+    @staticmethod
+    def _finish(state, response):
+        if state.wrote:
+            window = settings.DB_READ_STICKY_SECONDS
+            response.set_cookie(STICKY_COOKIE, f'{time.time() + window:.0f}', max_age=window, httponly=True, samesite='Lax')
+        return response
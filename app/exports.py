@@ -0,0 +1,145 @@
+"""
+Exportação de pedidos, itens e clientes em CSV ou JSONL, para relatórios.
+
+As linhas são geradas uma a uma, direto do cursor do banco
+(`iterator(chunk_size=...)`, que no PostgreSQL usa um cursor no servidor),
+e escritas assim que ficam prontas. A memória usada é a mesma para mil ou
+para milhões de pedidos. Usado pelo comando `export_orders` e pela view
+`export_view` (apenas equipe), que responde com `StreamingHttpResponse`.
+
+Cada exportação lê `values_list` com os campos relacionados já no JOIN
+(`customer__email`, `product__name`...), sem instanciar modelos.
+
+No CSV, textos que uma planilha interpretaria como fórmula (começando com
+`=`, `+`, `-` ou `@`) recebem um `'` na frente. O JSONL sai sem alteração.
+"""
+import csv
+import datetime
+import json
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import Customer, Order, OrderItem
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+
+def _orders(start, end):
+    queryset = Order.objects.filter(complete=True)
+    if start:
+        queryset = queryset.filter(date_ordered__gte=start)
+    if end:
+        queryset = queryset.filter(date_ordered__lt=end)
+    return queryset.values_list(
+        'id', 'date_ordered', 'transaction_id', 'customer_id', 'customer__name', 'customer__email',
+        'item_count', 'total_amount',
+    )
+
+
+def _items(start, end):
+    queryset = OrderItem.objects.filter(order__complete=True)
+    if start:
+        queryset = queryset.filter(order__date_ordered__gte=start)
+    if end:
+        queryset = queryset.filter(order__date_ordered__lt=end)
+    return queryset.values_list(
+        'id', 'order_id', 'order__date_ordered', 'order__customer__email',
+        'product_id', 'product__name', 'quantity', 'unit_price',
+    )
+
+
+def _customers(start, end):
+    queryset = Customer.objects.all()
+    if start or end:
+        # Clientes com pedidos no período
+        orders = Order.objects.filter(complete=True)
+        if start:
+            orders = orders.filter(date_ordered__gte=start)
+        if end:
+            orders = orders.filter(date_ordered__lt=end)
+        queryset = queryset.filter(pk__in=orders.values('customer_id'))
+    return queryset.values_list('id', 'name', 'email', 'user_id', 'user__username')
+
+
+# nome -> (consulta, cabeçalho). A ordem do cabeçalho é a do `values_list`.
+EXPORTS = {
+    'orders': (_orders, [
+        'order_id', 'date_ordered', 'transaction_id', 'customer_id', 'customer_name', 'customer_email',
+        'item_count', 'total_amount',
+    ]),
+    'items': (_items, [
+        'item_id', 'order_id', 'date_ordered', 'customer_email',
+        'product_id', 'product_name', 'quantity', 'unit_price',
+    ]),
+    'customers': (_customers, ['customer_id', 'name', 'email', 'user_id', 'username']),
+}
+
+
+def parse_period(since=None, until=None):
+    """
+    Converte datas `AAAA-MM-DD` em `(início, fim)` no fuso do projeto, com o
+    fim exclusivo (o dia `until` inteiro é incluído). Levanta `ValueError`
+    para datas inválidas.
+    """
+    def to_datetime(value, days=0):
+        if not value:
+            return None
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"Data inválida: {value!r} (use AAAA-MM-DD).")
+        return timezone.make_aware(datetime.datetime.combine(day + datetime.timedelta(days=days), datetime.time()))
+
+    return to_datetime(since), to_datetime(until, days=1)
+
+
+# Um texto que começa com um destes caracteres vira fórmula ao abrir o CSV
+# numa planilha (Excel, LibreOffice): nomes e e-mails vêm dos clientes.
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def _json_default(value):
+    # Datas em ISO 8601; Decimal como string para não perder precisão
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return str(value)
+
+
+class _Echo:
+    """Pseudo-arquivo para o `csv.writer`: `write` devolve a linha em vez de guardá-la."""
+
+    def write(self, value):
+        return value
+
+
+def iter_export(kind, fmt='csv', start=None, end=None, chunk_size=2000):
+    """
+    Gera as linhas (strings, com a quebra de linha) da exportação `kind`
+    (`orders`, `items` ou `customers`) no formato `fmt` (`csv` ou `jsonl`).
+    O CSV começa pelo cabeçalho.
+    """
+    query, header = EXPORTS[kind]
+    rows = query(start, end).order_by('pk').iterator(chunk_size=chunk_size)
+    if fmt == 'csv':
+        writer = csv.writer(_Echo())
+        yield writer.writerow(header)
+        for row in rows:
+            yield writer.writerow([_csv_value(value) for value in row])
+    elif fmt == 'jsonl':
+        for row in rows:
+            yield json.dumps(dict(zip(header, row)), ensure_ascii=False, default=_json_default) + '\n'
+    else:
+        raise ValueError(f"Formato desconhecido: {fmt!r}.")
@@ -0,0 +1,124 @@
+"""
+Hash de senhas com custo configurável.
+
+O custo de cada algoritmo vem do settings (`PASSWORD_SCRYPT_*`,
+`PASSWORD_ARGON2_*`, `PASSWORD_PBKDF2_ITERATIONS`), e o algoritmo usado
+nas senhas novas é o primeiro de `PASSWORD_HASHERS` (`PASSWORD_HASHER` no
+.env). Mudou o custo ou o algoritmo? Nada a migrar: no próximo login o
+Django confere a senha com os parâmetros antigos, gravados no próprio hash,
+e a grava de novo com os atuais (`must_update`).
+
+O hash roda num pool de `PASSWORD_HASH_WORKERS` threads por processo. O
+scrypt, o PBKDF2 e o argon2 liberam o GIL, então o pool usa vários núcleos,
+e limita quantos hashes rodam ao mesmo tempo: numa rajada de logins os
+demais ficam na fila do pool e sobra CPU para as requisições do carrinho. O
+tempo gasto (com a espera) aparece no `Server-Timing` como `hash`.
+
+Para escolher os parâmetros: `python manage.py bench_hashers`.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.contrib.auth.hashers import (
+    Argon2PasswordHasher, PBKDF2PasswordHasher, ScryptPasswordHasher,
+)
+
+from .instrumentation import record_hash_time
+
+_executor = None
+_executor_lock = threading.Lock()
+_local = threading.local()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(settings.PASSWORD_HASH_WORKERS, thread_name_prefix='password-hash')
+    return _executor
+
+
+def _guarded(func, *args):
+    _local.hashing = True
+    try:
+        return func(*args)
+    finally:
+        _local.hashing = False
+
+
+def run_hash(func, *args):
+    """
+    Executa `func(*args)` no pool de hash e espera o resultado. Sem pool
+    (`PASSWORD_HASH_WORKERS = 0`) executa na própria thread; já dentro de
+    um hash (`verify` chama `encode`), direto.
+    """
+    if getattr(_local, 'hashing', False):
+        return func(*args)
+    start = time.perf_counter()
+    try:
+        if settings.PASSWORD_HASH_WORKERS:
+            return _get_executor().submit(_guarded, func, *args).result()
+        return _guarded(func, *args)
+    finally:
+        record_hash_time(time.perf_counter() - start)
+
+
+class PooledHasherMixin:
+    """Passa `encode` e `verify` do hasher pelo pool de hash."""
+
+    def encode(self, password, salt, *args, **kwargs):
+        return run_hash(partial(super().encode, password, salt, *args, **kwargs))
+
+    def verify(self, password, encoded):
+        return run_hash(super().verify, password, encoded)
+
+
+class TunedScryptPasswordHasher(PooledHasherMixin, ScryptPasswordHasher):
+    """
+    scrypt (biblioteca padrão) com o custo do settings. Memória por hash:
+    128 x PASSWORD_SCRYPT_WORK_FACTOR x PASSWORD_SCRYPT_BLOCK_SIZE bytes
+    (16 MB com 2**14 e 8).
+    """
+    # Teto de memória do OpenSSL (o padrão, 32 MB, barra fatores acima de
+    # 2**14); é só um limite, cada hash aloca o que precisa
+    maxmem = 1024 * 1024 * 1024
+
+    @property
+    def work_factor(self):
+        return settings.PASSWORD_SCRYPT_WORK_FACTOR
+
+    @property
+    def block_size(self):
+        return settings.PASSWORD_SCRYPT_BLOCK_SIZE
+
+    @property
+    def parallelism(self):
+        return settings.PASSWORD_SCRYPT_PARALLELISM
+
+
+class TunedArgon2PasswordHasher(PooledHasherMixin, Argon2PasswordHasher):
+    """Argon2id (pacote `argon2-cffi`) com o custo do settings."""
+
+    @property
+    def time_cost(self):
+        return settings.PASSWORD_ARGON2_TIME_COST
+
+    @property
+    def memory_cost(self):
+        return settings.PASSWORD_ARGON2_MEMORY_COST  # KiB
+
+    @property
+    def parallelism(self):
+        return settings.PASSWORD_ARGON2_PARALLELISM
+
+
+class TunedPBKDF2PasswordHasher(PooledHasherMixin, PBKDF2PasswordHasher):
+    """PBKDF2-SHA256 (o padrão do Django) com o número de iterações do settings."""
+
+    @property
+    def iterations(self):
+        return settings.PASSWORD_PBKDF2_ITERATIONS
@@ -0,0 +1,197 @@
+"""
+Miniaturas (renditions) das imagens de produto.
+
+A vitrine e o modal do carrinho exibiam a foto original enviada no admin,
+apenas reduzida por CSS. Aqui geramos, com o Pillow, versões em tamanhos
+fixos de cada imagem, em WebP e JPEG:
+
+* `card`: a imagem da grade de produtos (4:3, recortada);
+* `thumb`: a miniatura do carrinho (quadrada, recortada);
+* `zoom`: uma versão grande, sem recorte, para ampliação.
+
+Os arquivos são endereçados pelo conteúdo: ficam em
+`MEDIA_ROOT/renditions/<hash da imagem original>/<rendition>-<largura>.<ext>`.
+Como o nome muda sempre que a imagem muda, eles podem ser servidos com
+`Cache-Control: immutable` (veja `serve_rendition`). O hash fica gravado em
+`Product.image_hash`; enquanto ele estiver vazio os templates usam a imagem
+original.
+
+A geração roda num pool de threads em segundo plano, disparado depois do
+commit quando um produto é salvo, para não travar o admin. Com
+`IMAGE_WORKERS = 0` ela roda na própria requisição (útil em testes).
+"""
+import hashlib
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+from django.views.static import serve
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+RENDITIONS_DIR = 'renditions'
+
+# nome -> (larguras geradas, proporção altura/largura ou None para não recortar)
+RENDITIONS = {
+    'card': ((320, 640), 3 / 4),
+    'thumb': ((64, 128), 1),
+    'zoom': ((1200,), None),
+}
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+_LANCZOS = getattr(Image, 'Resampling', Image).LANCZOS
+
+
+def rendition_name(image_hash, rendition, width, ext):
+    return f'{RENDITIONS_DIR}/{image_hash}/{rendition}-{width}.{ext}'
+
+
+def rendition_url(image_hash, rendition, width, ext):
+    return default_storage.url(rendition_name(image_hash, rendition, width, ext))
+
+
+def _resize(image, width, ratio):
+    if ratio is None:
+        resized = image.copy()
+        resized.thumbnail((width, width), _LANCZOS)
+        return resized
+    return ImageOps.fit(image, (width, round(width * ratio)), _LANCZOS)
+
+
+def generate_renditions(image_file):
+    """
+    Gera todas as renditions do arquivo de imagem informado (um `FieldFile`
+    ou caminho no storage) e retorna o hash do conteúdo original.
+    Renditions que já existem no storage não são geradas de novo.
+    """
+    if isinstance(image_file, str):
+        with default_storage.open(image_file, 'rb') as f:
+            data = f.read()
+    else:
+        image_file.open('rb')
+        try:
+            data = image_file.read()
+        finally:
+            image_file.close()
+
+    image_hash = hashlib.sha256(data).hexdigest()[:32]
+    source = None
+    for rendition, (widths, ratio) in RENDITIONS.items():
+        for width in widths:
+            for ext, (pil_format, options) in FORMATS.items():
+                name = rendition_name(image_hash, rendition, width, ext)
+                if default_storage.exists(name):
+                    continue
+                if source is None:
+                    source = ImageOps.exif_transpose(Image.open(io.BytesIO(data))).convert('RGB')
+                buffer = io.BytesIO()
+                _resize(source, width, ratio).save(buffer, pil_format, **options)
+                default_storage.save(name, ContentFile(buffer.getvalue()))
+    return image_hash
+
+
+def import_image_file(path, upload_to='products'):
+    """
+    Copia um arquivo de imagem local para o storage e gera as renditions.
+    O nome no storage é derivado do conteúdo, então importar a mesma imagem
+    de novo não duplica o arquivo. Retorna `(nome no storage, hash)`.
+    Levanta `OSError` se o arquivo não existir ou não for uma imagem válida.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    with Image.open(io.BytesIO(data)) as image:
+        image.verify()
+    ext = os.path.splitext(path)[1].lower() or '.jpg'
+    name = f'{upload_to}/{hashlib.sha256(data).hexdigest()[:32]}{ext}'
+    if not default_storage.exists(name):
+        name = default_storage.save(name, ContentFile(data))
+    return name, generate_renditions(name)
+
+
+def process_product_image(product_id):
+    """
+    Gera as renditions da imagem atual do produto e grava o hash.
+    Roda no pool em segundo plano (fora da requisição).
+    """
+    from .cart import snapshot_cache
+    from .catalog import bump_catalog_version
+    from .models import Product
+
+    close_old_connections()
+    try:
+        product = Product.objects.only('id', 'image', 'image_hash').filter(pk=product_id).first()
+        if product is None or not product.image:
+            return
+        try:
+            image_hash = generate_renditions(product.image)
+        except OSError as exc:
+            # Arquivo ausente no storage ou imagem que o Pillow não consegue ler
+            logger.warning("Não foi possível gerar as miniaturas do produto %s: %s", product_id, exc)
+            return
+        if image_hash != product.image_hash:
+            # `update` não dispara sinais, então não entramos em loop
+            Product.objects.filter(pk=product_id).update(image_hash=image_hash)
+            snapshot_cache.evict(product_id)
+            bump_catalog_version()
+    finally:
+        close_old_connections()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.IMAGE_WORKERS,
+                    thread_name_prefix='renditions',
+                )
+    return _executor
+
+
+def _log_failure(product_id, future):
+    # Sem isto, um erro inesperado no pool (fora o `OSError` tratado em
+    # `process_product_image`) ficaria guardado no `Future` sem ninguém ver.
+    if not future.cancelled() and future.exception() is not None:
+        logger.error(
+            "Erro ao gerar as miniaturas do produto %s", product_id, exc_info=future.exception(),
+        )
+
+
+def schedule_product_image(product_id):
+    """
+    Agenda a geração das renditions do produto no pool em segundo plano e
+    retorna o `Future` (None com `IMAGE_WORKERS = 0`, quando ela já terminou).
+    """
+    if settings.IMAGE_WORKERS <= 0:
+        process_product_image(product_id)
+        return None
+    future = _get_executor().submit(process_product_image, product_id)
+    future.add_done_callback(partial(_log_failure, product_id))
+    return future
+
+
+def serve_rendition(request, path):
+    """
+    Serve um arquivo de `MEDIA_ROOT/renditions/`. O nome do arquivo depende
+    do conteúdo, então ele nunca muda: pode ficar em cache "para sempre".
+    Em produção o servidor web pode servir a pasta com o mesmo cabeçalho.
+    """
+    response = serve(request, path, document_root=settings.MEDIA_ROOT / RENDITIONS_DIR)
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
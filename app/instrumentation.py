@@ -0,0 +1,237 @@
+"""
+Métricas por requisição: número de consultas SQL, tempo de banco, tempo de
+renderização de templates, tempo de hash de senhas (app/hashers.py) e
+latência total, agrupados pelo nome da URL (`product_list`, `checkout`,
+`login`, ...).
+
+* `RequestMetricsMiddleware` mede cada requisição e guarda os números num
+  histograma em memória (`metrics_registry`), exposto para a equipe na view
+  `request_metrics`. Os mesmos números vão no cabeçalho `Server-Timing`
+  (visível na aba "Network" do navegador), mas só para a equipe (staff) ou
+  para todos com `REQUEST_METRICS_HEADERS = True` (o padrão é `DEBUG`):
+  eles revelam detalhes internos, como o número de consultas.
+* `settings.VIEW_QUERY_BUDGETS` define um limite de consultas por view.
+  Quando ele é estourado registramos um aviso no log; com
+  `QUERY_BUDGET_STRICT = True` (útil nos testes) levantamos
+  `QueryBudgetExceeded`, fazendo o teste falhar.
+
+As consultas são contadas por um "execute wrapper" instalado em cada conexão
+do banco, e os templates por um invólucro em volta do `Template.render` do
+backend do Django, instalado no `AppConfig.ready()`. Os dois só registram algo quando há uma requisição sendo
+medida no contexto atual (`contextvars`), então funcionam tanto com WSGI
+quanto com ASGI.
+"""
+import contextvars
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.template.backends.django import Template as DjangoTemplate
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+class QueryBudgetExceeded(Exception):
+    """Uma view fez mais consultas SQL do que o permitido em `VIEW_QUERY_BUDGETS`."""
+
+
+class RequestMetrics:
+    """Números acumulados durante uma única requisição."""
+    __slots__ = ('queries', 'db_time', 'template_time', 'hash_time', 'started')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.hash_time = 0.0
+        self.started = time.perf_counter()
+
+
+def record_hash_time(seconds):
+    """Soma `seconds` de hash de senha (incluindo a espera pelo pool) à requisição atual."""
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.hash_time += seconds
+
+
+# Controle de transação não conta como consulta: o TestCase do Django troca
+# BEGIN/COMMIT por savepoints, e os limites valeriam diferente nos testes.
+TRANSACTION_STATEMENTS = ('BEGIN', 'SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+
+
+def _record_query(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None or sql.startswith(TRANSACTION_STATEMENTS):
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.db_time += time.perf_counter() - start
+        metrics.queries += 1
+
+
+def _install_query_recorder(connection):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+@receiver(connection_created)
+def install_query_recorder(sender, connection, **kwargs):
+    _install_query_recorder(connection)
+
+
+_original_template_render = DjangoTemplate.render
+
+
+def _timed_template_render(self, context=None, request=None):
+    metrics = _current.get()
+    if metrics is None:
+        return _original_template_render(self, context, request)
+    start = time.perf_counter()
+    try:
+        return _original_template_render(self, context, request)
+    finally:
+        metrics.template_time += time.perf_counter() - start
+
+
+def install_template_timer():
+    """
+    Passa o `Template.render` do backend do Django pelo medidor. Chamada uma
+    vez, no `AppConfig.ready()` (app/apps.py): importar este módulo não
+    altera nada.
+    """
+    DjangoTemplate.render = _timed_template_render
+
+
+class MetricsRegistry:
+    """
+    Histograma "rolante" por nome de URL: guarda as últimas `window`
+    amostras de cada view e calcula percentis sob demanda.
+    """
+
+    def __init__(self, window=1000):
+        self.window = window
+        self._samples = defaultdict(lambda: deque(maxlen=self.window))
+        self._lock = threading.Lock()
+
+    def record(self, url_name, metrics, total):
+        sample = (total, metrics.queries, metrics.db_time, metrics.template_time, metrics.hash_time)
+        with self._lock:
+            self._samples[url_name].append(sample)
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+
+    @staticmethod
+    def _percentiles(values):
+        values = sorted(values)
+        last = len(values) - 1
+
+        def pick(p):
+            return values[min(last, int(round(p * last)))]
+
+        return {'p50': pick(0.50), 'p95': pick(0.95), 'p99': pick(0.99), 'max': values[-1]}
+
+    def summary(self):
+        """Resumo de todas as views: contagem e percentis de cada métrica."""
+        with self._lock:
+            samples = {name: list(values) for name, values in self._samples.items()}
+
+        result = {}
+        for name, values in sorted(samples.items()):
+            totals, queries, db_times, template_times, hash_times = zip(*values)
+            result[name] = {
+                'count': len(values),
+                'latency_ms': self._percentiles([t * 1000 for t in totals]),
+                'queries': self._percentiles(queries),
+                'db_ms': self._percentiles([t * 1000 for t in db_times]),
+                'template_ms': self._percentiles([t * 1000 for t in template_times]),
+                'hash_ms': self._percentiles([t * 1000 for t in hash_times]),
+            }
+        return result
+
+
+metrics_registry = MetricsRegistry(window=getattr(settings, 'REQUEST_METRICS_WINDOW', 1000))
+
+
+def check_query_budget(url_name, queries):
+    budget = getattr(settings, 'VIEW_QUERY_BUDGETS', {}).get(url_name)
+    if budget is None or queries <= budget:
+        return
+    message = f"A view '{url_name}' fez {queries} consultas SQL (limite: {budget})."
+    if getattr(settings, 'QUERY_BUDGET_STRICT', False):
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+
+
+class RequestMetricsMiddleware:
+    """
+    Mede cada requisição. Deve ser o primeiro item de `MIDDLEWARE` para que a
+    latência total inclua os demais middlewares.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+        # Conexões abertas antes do primeiro request também precisam ser medidas
+        for connection in connections.all(initialized_only=True):
+            _install_query_recorder(connection)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        total = time.perf_counter() - metrics.started
+        user = getattr(request, 'user', None)
+        return self._finish(request, response, metrics, total, self._show_timing(user))
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        total = time.perf_counter() - metrics.started
+        user = await request.auser() if hasattr(request, 'auser') and not settings.REQUEST_METRICS_HEADERS else None
+        return self._finish(request, response, metrics, total, self._show_timing(user))
+
+    @staticmethod
+    def _show_timing(user):
+        return settings.REQUEST_METRICS_HEADERS or bool(user is not None and user.is_staff)
+
+    def _finish(self, request, response, metrics, total, show_timing):
+        match = getattr(request, 'resolver_match', None)
+        url_name = match.url_name if match and match.url_name else None
+
+        if show_timing:
+            timing = (
+                f'db;dur={metrics.db_time * 1000:.1f};desc="{metrics.queries} queries", '
+                f'tpl;dur={metrics.template_time * 1000:.1f}, '
+            )
+            if metrics.hash_time:
+                timing += f'hash;dur={metrics.hash_time * 1000:.1f}, '
+            response['Server-Timing'] = timing + f'total;dur={total * 1000:.1f}'
+
+        if url_name is not None:
+            metrics_registry.record(url_name, metrics, total)
+            check_query_budget(url_name, metrics.queries)
+        return response
@@ -0,0 +1,48 @@
+"""
+Catálogo da API JSON, lido de `app/static/app/data/products.json`.
+
+O arquivo é lido e indexado uma única vez e só é relido quando sua data de
+modificação (mtime) muda. Junto com a lista de produtos guardamos:
+
+* um índice `id -> produto`, para buscas O(1) no endpoint do carrinho;
+* os bytes já serializados da resposta de `get_products`, com um ETag,
+  para que requisições condicionais (`If-None-Match`) recebam 304 sem
+  codificar nada de novo.
+"""
+import hashlib
+import json
+import os
+import threading
+
+
+class CatalogState:
+    """Um retrato imutável do catálogo, correspondente a uma versão do arquivo."""
+    __slots__ = ('products', 'by_id', 'body', 'etag')
+
+    def __init__(self, products):
+        self.products = products
+        self.by_id = {product['id']: product for product in products}
+        self.body = json.dumps({"products": products}, ensure_ascii=False).encode('utf-8')
+        self.etag = '"%s"' % hashlib.sha1(self.body).hexdigest()
+
+
+class JsonCatalog:
+    """Carrega o arquivo JSON sob demanda e o recarrega quando ele muda."""
+
+    def __init__(self, path):
+        self.path = path
+        self._mtime = None
+        self._state = None
+        self._lock = threading.Lock()
+
+    def current(self):
+        """Retorna o `CatalogState` atual, relendo o arquivo se ele mudou."""
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime != self._mtime:
+            with self._lock:
+                # Outra thread pode ter recarregado enquanto esperávamos
+                if mtime != self._mtime:
+                    with open(self.path, encoding="utf-8") as f:
+                        self._state = CatalogState(json.load(f))
+                    self._mtime = mtime
+        return self._state
@@ -0,0 +1,83 @@
+"""
+Mede o custo dos hashers de senha configurados (veja app/hashers.py).
+
+    python manage.py bench_hashers
+    python manage.py bench_hashers --seconds 5 --threads 8
+    PASSWORD_SCRYPT_WORK_FACTOR=32768 python manage.py bench_hashers --hashers scrypt
+
+Para cada algoritmo de `PASSWORD_HASHERS` (com a biblioteca instalada),
+com os parâmetros atuais do settings: o tempo de um hash numa thread e
+quantos hashes por segundo cabem em cada núcleo com `--threads` threads ao
+mesmo tempo. Cada login ou cadastro custa um hash: é o teto de logins por
+segundo por núcleo. Escolha parâmetros que deixem o hash caro para quem
+tenta adivinhar senhas e barato o bastante para os picos de login.
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.hashers import get_hashers
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+PASSWORD = 'senha-de-benchmark-123'
+
+
+class Command(BaseCommand):
+    help = "Mede hashes de senha por segundo (por núcleo) dos hashers configurados."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hashers', nargs='+', metavar='ALGORITMO',
+                            help="Algoritmos a medir (ex.: scrypt argon2 pbkdf2_sha256). Padrão: todos.")
+        parser.add_argument('--seconds', type=float, default=2.0, help="Duração de cada medição.")
+        parser.add_argument('--threads', type=int, default=os.cpu_count() or 1,
+                            help="Threads simultâneas na medição de vazão (padrão: núcleos da máquina).")
+
+    def handle(self, *args, **options):
+        hashers = [
+            hasher for hasher in get_hashers()
+            if not options['hashers'] or hasher.algorithm in options['hashers']
+        ]
+        if not hashers:
+            raise CommandError("Nenhum dos algoritmos pedidos está em PASSWORD_HASHERS.")
+        threads = max(1, options['threads'])
+        cores = min(threads, os.cpu_count() or 1)
+
+        self.stdout.write(f"{'algoritmo':<16} {'parâmetros':<48} {'ms/hash':>8} {'hash/s/núcleo':>14} {'hash/s total':>13}")
+        # Mede o hash em si, sem o pool de app/hashers.py (que limitaria as threads)
+        with override_settings(PASSWORD_HASH_WORKERS=0):
+            for hasher in hashers:
+                try:
+                    encoded = hasher.encode(PASSWORD, hasher.salt())
+                except ValueError as exc:  # biblioteca não instalada (argon2-cffi, bcrypt)
+                    self.stdout.write(f"{hasher.algorithm:<16} (ignorado: {exc})")
+                    continue
+                params = ', '.join(
+                    f'{name}={value}' for name, value in hasher.safe_summary(encoded).items()
+                    if name not in ('algorithm', 'salt', 'hash', 'checksum')
+                )
+                count, elapsed = self.run(hasher, options['seconds'])
+                single_ms = elapsed / count * 1000
+                with ThreadPoolExecutor(threads) as pool:
+                    results = list(pool.map(lambda _: self.run(hasher, options['seconds']), range(threads)))
+                total = sum(count / elapsed for count, elapsed in results)
+                self.stdout.write(
+                    f"{hasher.algorithm:<16} {params:<48} {single_ms:>8.1f} {total / cores:>14.1f} {total:>13.1f}"
+                )
+        self.stdout.write(
+            f"\n{threads} thread(s) em {cores} núcleo(s) na medição de vazão; "
+            "o primeiro hasher é o usado nas senhas novas."
+        )
+
+    @staticmethod
+    def run(hasher, seconds):
+        """Calcula hashes por `seconds` segundos. Retorna (quantidade, segundos)."""
+        salt = hasher.salt()
+        count = 0
+        start = time.perf_counter()
+        while True:
+            hasher.encode(PASSWORD, salt)
+            count += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= seconds:
+                return count, elapsed
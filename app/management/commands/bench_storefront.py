@@ -0,0 +1,244 @@
+"""
+Benchmark dos caminhos mais usados da loja.
+
+Cria um banco de teste descartável (SQLite em memória ou `test_<DB_NAME>`
+no Postgres local, como o `manage.py test`), popula catálogos do tamanho
+pedido e mede, com o cliente de testes do Django, a latência (p50/p95) e o
+número de consultas SQL de cada view da vitrine e da API JSON.
+
+Exemplos:
+
+    python manage.py bench_storefront --products 1000 10000 --cart-width 10
+    python manage.py bench_storefront --output bench.json
+    python manage.py bench_storefront --baseline bench.json --tolerance 0.2
+
+Com `--baseline` o resultado é comparado com uma execução salva e o comando
+termina com erro se algum p95 piorar mais do que a tolerância.
+"""
+import json
+import platform
+import statistics
+import time
+from decimal import Decimal
+
+import django
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import (
+    CaptureQueriesContext, override_settings, setup_databases, setup_test_environment,
+    teardown_databases, teardown_test_environment,
+)
+from django.urls import reverse
+from django.utils import timezone
+
+from app.api import catalog as api_catalog
+from app.models import Product
+
+SHIPPING = {'name': 'Cliente Benchmark', 'email': 'bench@example.com', 'address': 'Rua do Teste, 1'}
+API_CHECKOUT = dict(SHIPPING, payment_method='pix')
+
+
+class Command(BaseCommand):
+    help = "Mede latência e consultas SQL das views da loja e da API JSON num banco de teste."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, nargs='+', default=[1000],
+                            help="Tamanhos de catálogo a testar (ex.: 1000 10000 100000).")
+        parser.add_argument('--cart-width', type=int, default=10,
+                            help="Número de produtos diferentes no carrinho.")
+        parser.add_argument('--iterations', type=int, default=50,
+                            help="Requisições medidas por cenário.")
+        parser.add_argument('--output', help="Arquivo JSON onde salvar os resultados.")
+        parser.add_argument('--baseline', help="Arquivo JSON de uma execução anterior para comparar.")
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help="Piora máxima aceita no p95 em relação ao baseline (0.2 = 20%%).")
+        parser.add_argument('--keepdb', action='store_true', help="Mantém o banco de teste entre execuções.")
+
+    def handle(self, *args, **options):
+        self.iterations = options['iterations']
+        self.cart_width = options['cart_width']
+
+        setup_test_environment(debug=False)
+        old_config = setup_databases(verbosity=0, interactive=False, keepdb=options['keepdb'], aliases={'default'})
+        # Todas as requisições vêm do mesmo "cliente": sem o limite de
+        # requisições (app/ratelimit.py), que as recusaria com 429.
+        bench_settings = override_settings(RATE_LIMITS={})
+        bench_settings.enable()
+        try:
+            results = {}
+            for size in options['products']:
+                self.stdout.write(f"Catálogo com {size} produtos...")
+                self.seed_catalog(size)
+                results[str(size)] = self.run_scenarios()
+        finally:
+            bench_settings.disable()
+            teardown_databases(old_config, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        report = {
+            'meta': {
+                'date': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'iterations': self.iterations,
+                'cart_width': self.cart_width,
+            },
+            'results': results,
+        }
+        self.print_report(results)
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Resultados salvos em {options['output']}"))
+
+        if options['baseline']:
+            self.compare(results, options['baseline'], options['tolerance'])
+
+    # ------------------------------------------------------------------
+    # Dados
+    # ------------------------------------------------------------------
+
+    def seed_catalog(self, size, batch_size=5000):
+        Product.objects.all().delete()
+        for start in range(0, size, batch_size):
+            Product.objects.bulk_create([
+                Product(
+                    name=f"Produto {i}",
+                    description=f"Descrição do produto de benchmark número {i}.",
+                    price=Decimal('9.90') + i % 100,
+                    stock=1_000_000,
+                )
+                for i in range(start, min(start + batch_size, size))
+            ])
+        self.product_ids = list(Product.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        cache.clear()
+
+    def fill_cart(self, client):
+        for product_id in self.product_ids[:self.cart_width]:
+            client.post(reverse('add_to_cart', args=[product_id]))
+
+    def fill_api_cart(self, client, user_id):
+        # O catálogo da API vem do products.json, não do banco
+        for product_id in list(api_catalog.current().by_id)[:self.cart_width]:
+            client.post(reverse('api_cart', args=[user_id]), {'product_id': product_id},
+                        content_type='application/json')
+
+    # ------------------------------------------------------------------
+    # Cenários
+    # ------------------------------------------------------------------
+
+    def measure(self, request, before=None):
+        """
+        Executa `request()` `iterations` vezes, chamando `before()` (fora da
+        medição) antes de cada uma. Retorna latências e consultas.
+        """
+        timings = []
+        queries = []
+        for _ in range(self.iterations):
+            if before is not None:
+                before()
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                response = request()
+                timings.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                raise CommandError(f"Resposta {response.status_code} durante o benchmark.")
+            queries.append(len(captured))
+        return self.summarize(timings, queries)
+
+    @staticmethod
+    def summarize(timings, queries):
+        timings_ms = sorted(t * 1000 for t in timings)
+        last = len(timings_ms) - 1
+        return {
+            'p50_ms': round(timings_ms[int(round(0.50 * last))], 3),
+            'p95_ms': round(timings_ms[int(round(0.95 * last))], 3),
+            'mean_ms': round(statistics.fmean(timings_ms), 3),
+            'queries': max(queries),
+        }
+
+    def run_scenarios(self):
+        client = Client()
+        self.fill_cart(client)
+        home = reverse('product_list')
+        results = {}
+
+        results['product_list'] = self.measure(lambda: client.get(home))
+        results['product_list_cold_cache'] = self.measure(lambda: client.get(home), before=cache.clear)
+
+        # Página "funda" do catálogo: com keyset deve custar o mesmo que a primeira
+        cursor_url = home
+        for _ in range(10):
+            page = client.get(cursor_url).content.decode()
+            marker = page.find('?cursor=')
+            if marker == -1:
+                break
+            cursor_url = home + page[marker:page.index('#', marker)]
+        results['product_list_page_10'] = self.measure(lambda: client.get(cursor_url))
+
+        product_id = self.product_ids[0]
+        results['add_to_cart'] = self.measure(lambda: client.post(reverse('add_to_cart', args=[product_id])))
+        results['update_cart'] = self.measure(
+            lambda: client.post(reverse('update_cart', args=[product_id, 'increase'])))
+
+        checkout = reverse('checkout')
+        results['checkout_get'] = self.measure(lambda: client.get(checkout))
+        results['checkout_post'] = self.measure(
+            lambda: client.post(checkout, SHIPPING), before=lambda: self.fill_cart(client))
+
+        # API JSON (app/api.py)
+        api_client = Client()
+        products_url = reverse('api_products')
+        results['api_products'] = self.measure(lambda: api_client.get(products_url))
+        etag = api_client.get(products_url)['ETag']
+        results['api_products_not_modified'] = self.measure(
+            lambda: api_client.get(products_url, HTTP_IF_NONE_MATCH=etag))
+
+        cart_url = reverse('api_cart', args=[1])
+        self.fill_api_cart(api_client, 1)
+        results['api_cart_get'] = self.measure(lambda: api_client.get(cart_url))
+        results['api_cart_post'] = self.measure(
+            lambda: api_client.post(cart_url, {'product_id': 1}, content_type='application/json'))
+        results['api_checkout'] = self.measure(
+            lambda: api_client.post(reverse('api_checkout', args=[2]), API_CHECKOUT,
+                                    content_type='application/json'),
+            before=lambda: self.fill_api_cart(api_client, 2))
+        return results
+
+    # ------------------------------------------------------------------
+    # Relatório
+    # ------------------------------------------------------------------
+
+    def print_report(self, results):
+        for size, scenarios in results.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(f"\n{size} produtos"))
+            self.stdout.write(f"{'cenário':<28}{'p50 ms':>10}{'p95 ms':>10}{'consultas':>11}")
+            for name, data in scenarios.items():
+                self.stdout.write(f"{name:<28}{data['p50_ms']:>10.2f}{data['p95_ms']:>10.2f}{data['queries']:>11}")
+
+    def compare(self, results, baseline_path, tolerance):
+        with open(baseline_path, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+
+        regressions = []
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\nComparação com {baseline_path}"))
+        for size, scenarios in results.items():
+            for name, data in scenarios.items():
+                old = baseline.get(size, {}).get(name)
+                if old is None:
+                    continue
+                change = (data['p95_ms'] - old['p95_ms']) / old['p95_ms'] if old['p95_ms'] else 0
+                line = (f"{size:>7} {name:<28} p95 {old['p95_ms']:.2f} -> {data['p95_ms']:.2f} ms "
+                        f"({change:+.0%}), consultas {old['queries']} -> {data['queries']}")
+                if change > tolerance or data['queries'] > old['queries']:
+                    regressions.append(line)
+                    self.stdout.write(self.style.ERROR(line))
+                else:
+                    self.stdout.write(line)
+
+        if regressions:
+            raise CommandError(f"{len(regressions)} cenário(s) pioraram em relação ao baseline.")
@@ -0,0 +1,62 @@
+"""
+Gera o CSS do Tailwind só com as classes usadas pela loja.
+
+    python manage.py build_css
+    python manage.py build_css --cli "npx tailwindcss@3"
+    python manage.py build_css && python manage.py collectstatic --noinput
+
+Roda o Tailwind CLI (`settings.TAILWIND_CLI`: o executável standalone, que
+não precisa de Node, ou `npx tailwindcss@3`) com `tailwind.config.js`, que
+varre app/templates, o HTML montado em Python e o JavaScript. Nada é
+baixado durante a execução: o CLI precisa estar instalado. A saída,
+minificada, vai para `settings.TAILWIND_CSS` em app/static; a partir daí
+`{% tailwind_css %}` (base.html) usa esse arquivo em vez do CDN.
+"""
+import gzip
+import os
+import shlex
+import shutil
+import subprocess
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Gera app/static/app/css/tailwind.css (Tailwind CLI, só as classes usadas)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cli', default=settings.TAILWIND_CLI,
+                            help="Comando do Tailwind CLI (padrão: settings.TAILWIND_CLI).")
+        parser.add_argument('--no-minify', action='store_true', help="Não minifica o CSS gerado.")
+
+    def handle(self, *args, **options):
+        if not settings.TAILWIND_CSS:
+            raise CommandError("settings.TAILWIND_CSS está vazio: o projeto está configurado para usar o CDN.")
+        cli = shlex.split(options['cli'])
+        if not cli or shutil.which(cli[0]) is None:
+            raise CommandError(
+                f"Tailwind CLI não encontrado ({options['cli']!r}). Baixe o executável standalone em "
+                "https://github.com/tailwindlabs/tailwindcss/releases ou use --cli \"npx tailwindcss@3\"."
+            )
+
+        base = settings.BASE_DIR
+        output = os.path.join(base, 'app', 'static', settings.TAILWIND_CSS)
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        command = cli + [
+            '--config', os.path.join(base, 'tailwind.config.js'),
+            '--input', os.path.join(base, 'app', 'assets', 'tailwind.css'),
+            '--output', output,
+        ]
+        if not options['no_minify']:
+            command.append('--minify')
+        # O `content` do tailwind.config.js é relativo à raiz do projeto
+        result = subprocess.run(command, cwd=base)
+        if result.returncode:
+            raise CommandError(f"O Tailwind CLI terminou com erro ({result.returncode}).")
+
+        with open(output, 'rb') as f:
+            data = f.read()
+        self.stdout.write(self.style.SUCCESS(
+            f"{output}: {len(data) / 1024:.1f} KB ({len(gzip.compress(data)) / 1024:.1f} KB com gzip)."
+        ))
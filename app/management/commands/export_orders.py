@@ -0,0 +1,49 @@
+"""
+Exporta pedidos, itens de pedido ou clientes em CSV ou JSONL.
+
+    python manage.py export_orders orders --since 2025-01-01 --until 2025-01-31 > pedidos.csv
+    python manage.py export_orders items --format jsonl --output itens.jsonl
+    python manage.py export_orders customers
+
+As linhas são lidas do banco em lotes e escritas à medida que chegam
+(veja app/exports.py), então a memória não cresce com o número de pedidos.
+"""
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.exports import EXPORTS, FORMATS, iter_export, parse_period
+
+
+class Command(BaseCommand):
+    help = "Exporta pedidos, itens ou clientes em CSV ou JSONL (em streaming)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(EXPORTS), help="O que exportar.")
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--since', help="Data inicial (AAAA-MM-DD), inclusive.")
+        parser.add_argument('--until', help="Data final (AAAA-MM-DD), inclusive.")
+        parser.add_argument('--output', help="Arquivo de saída (padrão: saída padrão).")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Linhas lidas do banco por vez.")
+
+    def handle(self, *args, **options):
+        try:
+            start, end = parse_period(options['since'], options['until'])
+        except ValueError as exc:
+            raise CommandError(exc)
+
+        lines = iter_export(options['kind'], options['format'], start, end, chunk_size=options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as f:
+                count = self._write(f, lines)
+            self.stderr.write(self.style.SUCCESS(f"{count} linha(s) gravadas em {options['output']}."))
+        else:
+            self._write(sys.stdout, lines)
+
+    @staticmethod
+    def _write(f, lines):
+        count = 0
+        for line in lines:
+            f.write(line)
+            count += 1
+        return count
@@ -0,0 +1,35 @@
+"""
+Gera as miniaturas (renditions) das imagens de produto já cadastradas.
+
+    python manage.py generate_renditions           # só produtos sem miniaturas
+    python manage.py generate_renditions --all     # todos os produtos
+
+Os produtos salvos depois desta mudança ganham as miniaturas sozinhos
+(veja app/signals.py); este comando serve para os antigos.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from app.images import process_product_image
+from app.models import Product
+
+
+class Command(BaseCommand):
+    help = "Gera as miniaturas das imagens de produto que ainda não as têm."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="Processa também os produtos que já têm miniaturas.")
+        parser.add_argument('--workers', type=int, default=max(1, settings.IMAGE_WORKERS), help="Threads em paralelo.")
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(image='')
+        if not options['all']:
+            products = products.filter(image_hash='')
+        ids = list(products.values_list('id', flat=True))
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            list(executor.map(process_product_image, ids))
+
+        self.stdout.write(self.style.SUCCESS(f"Miniaturas processadas para {len(ids)} produto(s)."))
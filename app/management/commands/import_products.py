@@ -0,0 +1,240 @@
+"""
+Importa (ou atualiza) o catálogo de produtos a partir de um arquivo do ERP.
+
+    python manage.py import_products produtos.csv
+    python manage.py import_products produtos.jsonl --image-root /srv/erp/fotos
+    python manage.py import_products app/static/app/data/products.json
+
+Formatos aceitos (pela extensão, ou `--format`):
+
+* CSV com cabeçalho;
+* JSONL, um objeto por linha;
+* JSON com uma lista de objetos, como `app/static/app/data/products.json`
+  (lido em streaming, objeto a objeto).
+
+Campos: `sku` (ou `id`, como no products.json), `name`, `price`,
+`description`, `stock` e `image`. Sem `stock` o estoque de produtos já
+existentes não é alterado. `image` é um caminho local, relativo a
+`--image-root`; URLs são ignoradas.
+
+Os produtos são gravados em lotes com `bulk_create(update_conflicts=True)`
+sobre o `sku`: um INSERT ... ON CONFLICT DO UPDATE por lote. Só um lote fica
+em memória por vez. As imagens de cada lote são copiadas e convertidas em
+miniaturas num pool de threads. Operações em lote não disparam os sinais
+de `Product`: a cada lote o disponível em cache dos produtos gravados é
+apagado (`evict_available`), e ao final o índice de busca é refeito e a
+versão do catálogo incrementada (a grade em cache, compartilhada, muda na
+hora). Os snapshots do carrinho ficam na memória de cada processo e não há
+como apagá-los daqui: nomes e preços novos aparecem no carrinho em até
+`CART_SNAPSHOT_TTL` segundos (o checkout sempre cobra o preço do banco).
+
+Linhas inválidas são informadas pela linha do arquivo (CSV e JSONL) ou pela
+posição do objeto na lista (JSON).
+"""
+import csv
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from app.catalog import bump_catalog_version
+from app.images import import_image_file
+from app.models import Product
+from app.search import rebuild_search_index
+from app.stock import evict_available
+
+UPDATE_FIELDS = ['name', 'description', 'price']
+MAX_PRICE = Decimal('99999999.99')  # max_digits=10, decimal_places=2
+
+
+class RowError(ValueError):
+    pass
+
+
+# Cada leitor gera (posição, objeto): a linha física do arquivo, ou a
+# posição do objeto na lista JSON.
+
+def _iter_csv(f):
+    reader = csv.DictReader(f)
+    for row in reader:
+        # `line_num`: última linha física do registro (conta o cabeçalho e
+        # as quebras de linha dentro de aspas)
+        yield reader.line_num, row
+
+
+def _iter_jsonl(f):
+    for line_number, line in enumerate(f, start=1):
+        line = line.strip()
+        if line:
+            yield line_number, json.loads(line)
+
+
+def _iter_json_array(f, chunk_size=64 * 1024):
+    """Lê uma lista JSON `[{...}, {...}]` objeto a objeto, sem carregá-la inteira."""
+    decoder = json.JSONDecoder()
+    whitespace = re.compile(r'[\s,]*')
+    buffer = f.read(chunk_size).lstrip()
+    if not buffer.startswith('['):
+        raise ValueError("O arquivo JSON deve conter uma lista de produtos.")
+    pos = 1
+    eof = False
+    position = 0
+    while True:
+        pos = whitespace.match(buffer, pos).end()
+        if buffer.startswith(']', pos):
+            return
+        try:
+            obj, pos = decoder.raw_decode(buffer, pos)
+        except ValueError:
+            # Objeto incompleto: lê mais um pedaço (ou o arquivo acabou)
+            if eof:
+                raise ValueError("Lista JSON inválida ou não terminada.")
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+        position += 1
+        yield position, obj
+
+
+READERS = {'csv': _iter_csv, 'jsonl': _iter_jsonl, 'json': _iter_json_array}
+
+
+def _clean_row(row):
+    """Valida e normaliza uma linha. Retorna um dicionário pronto para `Product`."""
+    if not isinstance(row, dict):
+        raise RowError("a linha não é um objeto")
+    sku = str(row.get('sku') or row.get('id') or '').strip()
+    if not sku or len(sku) > 64:
+        raise RowError("sku ausente ou com mais de 64 caracteres")
+    name = str(row.get('name') or '').strip()
+    if not name or len(name) > 120:
+        raise RowError("nome ausente ou com mais de 120 caracteres")
+    try:
+        price = Decimal(str(row.get('price', ''))).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise RowError(f"preço inválido: {row.get('price')!r}")
+    if not Decimal('0.01') <= price <= MAX_PRICE:
+        raise RowError(f"preço fora do intervalo: {price}")
+
+    cleaned = {'sku': sku, 'name': name, 'price': price, 'description': str(row.get('description') or '')}
+    if row.get('stock') not in (None, ''):
+        try:
+            cleaned['stock'] = int(row['stock'])
+        except (TypeError, ValueError):
+            raise RowError(f"estoque inválido: {row['stock']!r}")
+        if cleaned['stock'] < 0:
+            raise RowError("estoque negativo")
+    image = str(row.get('image') or '').strip()
+    if image and '://' not in image:
+        cleaned['image_path'] = image
+    return cleaned
+
+
+class Command(BaseCommand):
+    help = "Importa/atualiza produtos (upsert por SKU) a partir de CSV, JSONL ou JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Arquivo a importar.")
+        parser.add_argument('--format', choices=sorted(READERS), help="Padrão: pela extensão do arquivo.")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Produtos gravados por comando SQL.")
+        parser.add_argument('--image-root', default='.', help="Pasta base dos caminhos de imagem.")
+        parser.add_argument('--workers', type=int, default=max(2, settings.IMAGE_WORKERS),
+                            help="Threads para processar as imagens.")
+        parser.add_argument('--max-errors', type=int, default=20, help="Linhas inválidas exibidas no relatório.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if fmt not in READERS:
+            raise CommandError(f"Formato desconhecido: {fmt!r}. Use --format {{{','.join(sorted(READERS))}}}.")
+        self.image_root = options['image_root']
+        self.max_errors = options['max_errors']
+        self.stats = {'read': 0, 'imported': 0, 'invalid': 0, 'images': 0, 'image_errors': 0}
+        self.started = time.perf_counter()
+
+        try:
+            with open(path, encoding='utf-8', newline='') as f, \
+                    ThreadPoolExecutor(max_workers=options['workers'], thread_name_prefix='import') as executor:
+                batch = {}
+                self.position_label = 'Objeto' if fmt == 'json' else 'Linha'
+                for position, row in READERS[fmt](f):
+                    self.stats['read'] += 1
+                    try:
+                        cleaned = _clean_row(row)
+                    except RowError as exc:
+                        self._invalid(position, exc)
+                        continue
+                    # O mesmo SKU repetido no lote: vale a última linha
+                    batch[cleaned['sku']] = cleaned
+                    if len(batch) >= options['batch_size']:
+                        self._flush(batch, executor)
+                        batch = {}
+                if batch:
+                    self._flush(batch, executor)
+        except (OSError, ValueError) as exc:
+            raise CommandError(f"Erro lendo {path}: {exc}")
+        finally:
+            if self.stats['imported']:
+                rebuild_search_index()
+                bump_catalog_version()
+
+        elapsed = time.perf_counter() - self.started
+        self.stdout.write(self.style.SUCCESS(
+            f"{self.stats['imported']} produto(s) importados de {self.stats['read']} linha(s) "
+            f"em {elapsed:.1f}s ({self.stats['read'] / elapsed if elapsed else 0:.0f} linhas/s); "
+            f"{self.stats['invalid']} inválida(s), {self.stats['images']} imagem(ns), "
+            f"{self.stats['image_errors']} imagem(ns) com erro."
+        ))
+
+    def _invalid(self, position, exc):
+        self.stats['invalid'] += 1
+        if self.stats['invalid'] <= self.max_errors:
+            self.stderr.write(f"{self.position_label} {position}: {exc}")
+
+    def _store_image(self, row):
+        try:
+            return import_image_file(os.path.join(self.image_root, row['image_path']))
+        except Exception as exc:  # arquivo ausente, imagem corrompida...
+            self.stderr.write(f"SKU {row['sku']}: imagem {row['image_path']!r} ignorada ({exc})")
+            return None
+
+    def _flush(self, batch, executor):
+        rows = list(batch.values())
+        with_image = [row for row in rows if 'image_path' in row]
+        for row, stored in zip(with_image, executor.map(self._store_image, with_image)):
+            if stored is None:
+                self.stats['image_errors'] += 1
+            else:
+                row['image'], row['image_hash'] = stored
+                self.stats['images'] += 1
+
+        # `update_fields` é o mesmo para todo um INSERT: agrupamos as linhas
+        # pelos campos opcionais que elas trazem.
+        groups = {}
+        for row in rows:
+            optional = tuple(field for field in ('stock', 'image', 'image_hash') if field in row)
+            groups.setdefault(optional, []).append(row)
+        product_ids = []
+        for optional, group in groups.items():
+            products = Product.objects.bulk_create(
+                [Product(**{k: v for k, v in row.items() if k != 'image_path'}) for row in group],
+                update_conflicts=True,
+                unique_fields=['sku'],
+                update_fields=UPDATE_FIELDS + list(optional),
+            )
+            product_ids.extend(product.pk for product in products if product.pk is not None)
+        if len(product_ids) < len(rows):
+            # Banco sem RETURNING no upsert: busca os ids pelo SKU
+            product_ids = list(Product.objects.filter(sku__in=batch).values_list('id', flat=True))
+        # O estoque pode ter mudado: o disponível em cache não vale mais
+        evict_available(product_ids)
+        self.stats['imported'] += len(rows)
+        elapsed = time.perf_counter() - self.started
+        self.stdout.write(f"  {self.stats['imported']} produto(s)... ({self.stats['imported'] / elapsed:.0f}/s)")
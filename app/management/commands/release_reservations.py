@@ -0,0 +1,38 @@
+"""
+Libera as reservas de estoque vencidas (veja app/stock.py).
+
+    python manage.py release_reservations
+    python manage.py release_reservations --every 60     # em laço, a cada minuto
+    python manage.py release_reservations --recount      # recalcula Product.reserved
+
+Rode periodicamente (cron, systemd timer) ou deixe rodando com `--every`,
+como o serviço `reservations` do docker-compose.yml.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from app.stock import recount_reserved, release_expired
+
+
+class Command(BaseCommand):
+    help = "Libera as reservas de estoque vencidas dos carrinhos."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Reservas removidas por transação.")
+        parser.add_argument('--every', type=float, default=0,
+                            help="Repete a cada N segundos até ser interrompido (0 = uma vez).")
+        parser.add_argument('--recount', action='store_true',
+                            help="Recalcula Product.reserved a partir das reservas antes de liberar.")
+
+    def handle(self, *args, **options):
+        if options['recount']:
+            recount_reserved()
+            self.stdout.write("Product.reserved recalculado.")
+        while True:
+            released = release_expired(batch_size=options['batch_size'])
+            if released or not options['every']:
+                self.stdout.write(self.style.SUCCESS(f"{released} unidade(s) liberada(s)."))
+            if not options['every']:
+                return
+            time.sleep(options['every'])
@@ -0,0 +1,120 @@
+"""
+Executa as tarefas da fila em segundo plano (veja app/task_queue.py).
+
+    python manage.py run_worker                          # 4 threads
+    python manage.py run_worker --concurrency 8 --pool process
+    python manage.py run_worker --burst                  # esvazia a fila e sai
+
+Threads servem para tarefas que esperam rede (e-mail, APIs); processos,
+para tarefas que usam CPU. Vários workers (na mesma máquina ou não, com a
+fila no banco principal) podem rodar ao mesmo tempo. Ctrl+C / SIGTERM param
+de pegar tarefas novas e esperam as em andamento terminarem.
+"""
+import datetime
+import multiprocessing
+import signal
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+
+from app.task_queue import PermanentError, get_queue, get_task, run_job
+
+
+def _execute(name, payload):
+    """Roda uma tarefa numa thread/processo do pool, com conexões ao banco válidas."""
+    close_old_connections()
+    try:
+        run_job(name, payload)
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = "Executa as tarefas em segundo plano da fila (e-mails, registros de pedidos...)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4, help="Tarefas executadas ao mesmo tempo.")
+        parser.add_argument('--pool', choices=['thread', 'process'], default='thread',
+                            help="Executa as tarefas em threads ou em processos.")
+        parser.add_argument('--poll', type=float, default=1.0,
+                            help="Segundos entre duas consultas à fila quando ela está vazia.")
+        parser.add_argument('--burst', action='store_true',
+                            help="Sai quando não houver mais tarefas prontas para rodar.")
+        parser.add_argument('--purge-after', type=int, default=7,
+                            help="Apaga as tarefas concluídas há mais de N dias (0 = nunca).")
+
+    def handle(self, *args, **options):
+        queue = get_queue()
+        concurrency = max(1, options['concurrency'])
+        if options['pool'] == 'process':
+            # spawn: cada processo configura o Django do zero, sem herdar
+            # conexões abertas do processo principal
+            pool = ProcessPoolExecutor(
+                concurrency, mp_context=multiprocessing.get_context('spawn'), initializer=django.setup,
+            )
+        else:
+            pool = ThreadPoolExecutor(concurrency, thread_name_prefix='task')
+
+        self.stopping = False
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, self._stop)
+
+        if options['purge_after']:
+            purged = queue.purge(timezone.now() - datetime.timedelta(days=options['purge_after']))
+            if purged:
+                self.stdout.write(f"{purged} tarefa(s) concluída(s) antiga(s) apagada(s).")
+
+        self.stdout.write(f"Worker: {concurrency} {options['pool']}(s), fila {type(queue).__name__}.")
+        running = {}
+        done_count = 0
+        try:
+            while True:
+                if not self.stopping and len(running) < concurrency:
+                    for job in queue.claim(concurrency - len(running)):
+                        running[pool.submit(_execute, job.name, job.payload)] = job
+                if not running:
+                    if self.stopping or options['burst']:
+                        break
+                    self._sleep(options['poll'])
+                    continue
+                finished, _ = wait(running, timeout=options['poll'], return_when=FIRST_COMPLETED)
+                for future in finished:
+                    self._finish(queue, running.pop(future), future.exception())
+                    done_count += 1
+        finally:
+            pool.shutdown(wait=True)
+        self.stdout.write(self.style.SUCCESS(f"{done_count} tarefa(s) executada(s)."))
+
+    def _stop(self, signum, frame):
+        if self.stopping:
+            raise KeyboardInterrupt
+        self.stdout.write("Encerrando: esperando as tarefas em andamento...")
+        self.stopping = True
+
+    def _sleep(self, seconds):
+        # Intervalos curtos para responder logo a um pedido de parada
+        deadline = time.monotonic() + seconds
+        while not self.stopping and time.monotonic() < deadline:
+            time.sleep(min(0.2, seconds))
+
+    def _finish(self, queue, job, error):
+        if error is None:
+            queue.complete(job.id)
+            return
+        message = ''.join(traceback.format_exception(error))
+        try:
+            task = get_task(job.name)
+        except KeyError:
+            task = None
+        if task is None or isinstance(error, PermanentError) or job.attempts >= job.max_attempts:
+            queue.fail(job.id, message)
+            self.stderr.write(f"{job.name} #{job.id} falhou de vez ({job.attempts} tentativa(s)): {error!r}")
+        else:
+            run_at = timezone.now() + datetime.timedelta(seconds=task.retry_delay(job.attempts))
+            queue.retry(job.id, message, run_at)
+            self.stderr.write(f"{job.name} #{job.id} falhou ({error!r}); nova tentativa às {run_at:%H:%M:%S}.")
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.6 on 2026-10-18 09:02
+
+from django.db import migrations
+from django.db.models import DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def backfill_order_totals(apps, schema_editor):
+    """
+    Preenche os novos campos dos pedidos antigos, tudo em SQL:
+    `OrderItem.unit_price` recebe o preço atual do produto (o melhor valor
+    que temos) e `Order.total_amount`/`item_count` somam os itens.
+    """
+    Product = apps.get_model('app', 'Product')
+    Order = apps.get_model('app', 'Order')
+    OrderItem = apps.get_model('app', 'OrderItem')
+
+    OrderItem.objects.filter(unit_price__isnull=True, product__isnull=False).update(
+        unit_price=Subquery(Product.objects.filter(pk=OuterRef('product_id')).values('price')[:1])
+    )
+
+    items = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order')
+    line_total = ExpressionWrapper(
+        F('quantity') * F('unit_price'),
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+    Order.objects.update(
+        total_amount=Coalesce(
+            Subquery(items.annotate(total=Sum(line_total)).values('total')), 0,
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+        ),
+        item_count=Coalesce(Subquery(items.annotate(count=Sum('quantity')).values('count')), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_order_totals_orderitem_unit_price'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_order_totals, migrations.RunPython.noop),
+    ]
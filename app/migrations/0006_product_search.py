@@ -0,0 +1,74 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:15
+
+from django.db import migrations
+
+# PostgreSQL: configuração de busca em português que ignora acentos e um
+# índice GIN sobre a mesma expressão usada em app/search.py.
+# Requer permissão para criar a extensão `unaccent`.
+POSTGRES_FORWARD = [
+    "CREATE EXTENSION IF NOT EXISTS unaccent",
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = 'portuguese_unaccent') THEN
+            CREATE TEXT SEARCH CONFIGURATION portuguese_unaccent (COPY = portuguese);
+            ALTER TEXT SEARCH CONFIGURATION portuguese_unaccent
+                ALTER MAPPING FOR hword, hword_part, word WITH unaccent, portuguese_stem;
+        END IF;
+    END
+    $$
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS product_search_idx ON app_product USING GIN (
+        to_tsvector('portuguese_unaccent'::regconfig,
+                    coalesce(name, '') || ' ' || coalesce(description, ''))
+    )
+    """,
+]
+POSTGRES_BACKWARD = [
+    "DROP INDEX IF EXISTS product_search_idx",
+    "DROP TEXT SEARCH CONFIGURATION IF EXISTS portuguese_unaccent",
+]
+
+# SQLite: tabela FTS5 "sombra" com o nome e a descrição de cada produto
+# (rowid = id do produto), mantida pelos sinais de Product.
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS app_product_fts USING fts5("
+    "name, description, tokenize = 'unicode61 remove_diacritics 2')",
+    "INSERT INTO app_product_fts (rowid, name, description) SELECT id, name, description FROM app_product",
+]
+SQLITE_BACKWARD = [
+    "DROP TABLE IF EXISTS app_product_fts",
+]
+
+
+def _run(schema_editor, statements):
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        _run(schema_editor, POSTGRES_FORWARD)
+    elif vendor == 'sqlite':
+        _run(schema_editor, SQLITE_FORWARD)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        _run(schema_editor, POSTGRES_BACKWARD)
+    elif vendor == 'sqlite':
+        _run(schema_editor, SQLITE_BACKWARD)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_backfill_order_totals'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.6 on 2026-10-18 08:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_product_image_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='version',
+            field=models.BigIntegerField(default=0, editable=False, verbose_name='Versão'),
+        ),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(condition=models.Q(('complete', False)), fields=('transaction_id',), name='order_open_cart_unique'),
+        ),
+    ]
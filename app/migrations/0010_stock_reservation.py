@@ -0,0 +1,34 @@
+# Generated by Django 5.2.6 on 2026-10-18 08:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_product_sku'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='reserved',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Reservado'),
+        ),
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cart_key', models.CharField(max_length=64, verbose_name='Carrinho')),
+                ('quantity', models.PositiveIntegerField(verbose_name='Quantidade')),
+                ('expires_at', models.DateTimeField(db_index=True, verbose_name='Expira em')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app.product', verbose_name='Produto')),
+            ],
+            options={
+                'verbose_name': 'Reserva de Estoque',
+                'verbose_name_plural': 'Reservas de Estoque',
+                'constraints': [models.UniqueConstraint(fields=('cart_key', 'product'), name='reservation_cart_product_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.6 on 2026-10-18 09:05
+
+from django.db import migrations
+from django.db.models import Count
+from django.db.models.functions import Lower, Trim
+
+
+def dedupe_customer_emails(apps, schema_editor):
+    """
+    Prepara `Customer.email` para virar único (0013): normaliza os e-mails
+    (sem espaços, minúsculos, vazio -> NULL) e junta os clientes convidados
+    repetidos. De cada grupo com o mesmo e-mail fica o convidado mais antigo:
+    os outros convidados são apagados e os pedidos deles passam para ele.
+    Pedidos de convidados nunca passam para uma conta de usuário (o e-mail da
+    conta não foi verificado); as contas do grupo ficam com os seus pedidos e
+    o e-mail vazio (ele continua em `User.email`), exceto a mais antiga, se
+    não houver convidados.
+    """
+    Customer = apps.get_model('app', 'Customer')
+    Order = apps.get_model('app', 'Order')
+
+    Customer.objects.filter(email__isnull=False).update(email=Lower(Trim('email')))
+    Customer.objects.filter(email='').update(email=None)
+
+    duplicated = (
+        Customer.objects.filter(email__isnull=False).order_by()
+        .values('email').annotate(total=Count('pk')).filter(total__gt=1).values_list('email', flat=True)
+    )
+    for email in duplicated.iterator():
+        # Convidados primeiro, depois o mais antigo
+        customers = list(Customer.objects.filter(email=email).order_by('pk'))
+        customers.sort(key=lambda customer: customer.user_id is not None)
+        keeper, others = customers[0], customers[1:]
+        guests = [customer for customer in others if customer.user_id is None]
+        accounts = [customer for customer in others if customer.user_id is not None]
+        Order.objects.filter(customer__in=guests).update(customer=keeper)
+        if not keeper.name:
+            keeper.name = next((guest.name for guest in guests if guest.name), None)
+            keeper.save(update_fields=['name'])
+        Customer.objects.filter(pk__in=[guest.pk for guest in guests]).delete()
+        Customer.objects.filter(pk__in=[account.pk for account in accounts]).update(email=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0011_job'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_customer_emails, migrations.RunPython.noop),
+    ]
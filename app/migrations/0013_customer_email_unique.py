@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 09:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_customer_email_dedupe'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='customer',
+            name='email',
+            field=models.EmailField(max_length=200, null=True, unique=True, verbose_name='E-mail'),
+        ),
+    ]
@@ -1,4 +1,6 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, Sum
+from django.db.models.functions import Coalesce
 from django.core.validators import MinValueValidator
 from django.contrib.auth.models import User # Importa o modelo de usuário padrão do Django
 
@@ -12,6 +14,10 @@ class Product(models.Model):
     # Campo para o nome do produto. `max_length` é obrigatório.
     name = models.CharField("Nome", max_length=120)
 
+    # Código do produto no ERP; chave do `import_products`. Produtos criados
+    # à mão no admin podem ficar sem SKU (vários NULL não violam o `unique`).
+    sku = models.CharField("SKU", max_length=64, unique=True, null=True, blank=True)
+
     # `TextField` é para textos longos. `blank=True` significa que não é obrigatório.
     description = models.TextField("Descrição", blank=True)
 
@@ -31,12 +37,32 @@ class Product(models.Model):
         default='products/default.png' # Uma imagem padrão, caso nenhuma seja enviada
     )
 
+    # Hash do conteúdo da imagem; identifica as miniaturas geradas em
+    # MEDIA_ROOT/renditions/ (veja app/images.py). Vazio até serem geradas.
+    image_hash = models.CharField("Hash da Imagem", max_length=64, blank=True, default='', editable=False)
+
     # `PositiveIntegerField` garante que o estoque nunca será um número negativo.
     stock = models.PositiveIntegerField("Estoque", default=1)
 
+    # Unidades separadas em carrinhos (soma das `StockReservation` do
+    # produto). O disponível para venda é `stock - reserved`.
+    reserved = models.PositiveIntegerField("Reservado", default=0, editable=False)
+
     # `auto_now_add=True` salva a data e hora exatas de quando o produto foi criado.
     created_at = models.DateTimeField("Criado em", auto_now_add=True)
 
+    # Nome da imagem como foi lido do banco (None num produto novo ou com a
+    # imagem adiada): o sinal de `post_save` só gera as miniaturas de novo
+    # quando ela muda (veja `generate_product_renditions` em app/signals.py).
+    loaded_image_name = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'image' in instance.__dict__:
+            instance.loaded_image_name = str(instance.__dict__['image'])
+        return instance
+
     def __str__(self):
         """
         Define como o objeto será exibido, por exemplo, no painel de administração.
@@ -44,6 +70,11 @@ class Product(models.Model):
         """
         return f"{self.name} (R$ {self.price})"
 
+    @property
+    def available(self):
+        """Unidades que ainda podem ir para um carrinho."""
+        return max(self.stock - self.reserved, 0)
+
     class Meta:
         """
         Metadados do modelo. Usado para configurações como ordenação
@@ -52,6 +83,33 @@ class Product(models.Model):
         verbose_name = "Produto"
         verbose_name_plural = "Produtos"
         ordering = ['-created_at'] # Ordena os produtos do mais novo para o mais antigo
+        indexes = [
+            # Índice composto usado pela paginação por keyset do catálogo
+            models.Index(fields=['-created_at', '-id'], name='product_created_id_idx'),
+        ]
+
+
+class StockReservation(models.Model):
+    """
+    Unidades de um produto separadas para o carrinho de um visitante até
+    `expires_at` (veja app/stock.py). Cada carrinho tem no máximo uma reserva
+    por produto.
+    """
+    # `Cart.key` do carrinho da vitrine (app/cart_storage.py)
+    cart_key = models.CharField("Carrinho", max_length=64)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, verbose_name="Produto")
+    quantity = models.PositiveIntegerField("Quantidade")
+    expires_at = models.DateTimeField("Expira em", db_index=True)
+
+    def __str__(self):
+        return f"{self.quantity} x produto {self.product_id} ({self.cart_key})"
+
+    class Meta:
+        verbose_name = "Reserva de Estoque"
+        verbose_name_plural = "Reservas de Estoque"
+        constraints = [
+            models.UniqueConstraint(fields=['cart_key', 'product'], name='reservation_cart_product_unique'),
+        ]
 
 
 # Nota: Para que o campo ImageField funcione corretamente, você precisa ter a biblioteca Pillow instalada.
@@ -66,6 +124,55 @@ class Product(models.Model):
 # NOVOS MODELOS ABAIXO
 # ==========================================================
 
+def normalize_email(email):
+    """E-mail como guardado em `Customer.email`: sem espaços, minúsculo; vazio vira None."""
+    return (email or '').strip().lower() or None
+
+
+class CustomerQuerySet(models.QuerySet):
+
+    def for_email(self, email, name=None):
+        """
+        O cliente com este e-mail, criado (com `name`) se ainda não existir,
+        numa única consulta: `INSERT ... ON CONFLICT (email) DO UPDATE ...
+        RETURNING id`. Dois checkouts simultâneos com o mesmo e-mail caem no
+        mesmo cliente. Um cliente existente mantém o nome gravado; o objeto
+        retornado só é garantido quanto ao `pk` e ao `email`.
+        """
+        customer = Customer(email=normalize_email(email), name=name)
+        self.bulk_create(
+            [customer], update_conflicts=True, unique_fields=['email'], update_fields=['email'],
+        )
+        return customer
+
+    def for_user(self, user):
+        """
+        O cliente da conta `user`. Sem consulta quando o usuário veio do
+        `CustomerModelBackend` (app/auth.py), que já o carrega junto. Contas
+        sem cliente (cadastro novo, ou criadas no admin) ganham um agora.
+
+        O cliente é sempre novo: o e-mail da conta não foi verificado, então
+        um convidado com o mesmo e-mail (e os pedidos dele) não passa para a
+        conta. Se o e-mail já é de outro cliente, o da conta fica vazio (ele
+        continua em `User.email`).
+        """
+        try:
+            return user.customer
+        except Customer.DoesNotExist:
+            pass
+        email = normalize_email(user.email)
+        if email and self.filter(email=email).exists():
+            email = None
+        try:
+            with transaction.atomic():
+                customer = self.create(user=user, name=user.username, email=email)
+        except IntegrityError:
+            # Um checkout de convidado gravou o e-mail nesse meio tempo
+            customer = self.create(user=user, name=user.username, email=None)
+        user.customer = customer
+        return customer
+
+
 class Customer(models.Model):
     """
     Representa um cliente, que pode ou não ser um usuário registrado.
@@ -75,7 +182,11 @@ class Customer(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, null=True, blank=True, verbose_name="Usuário")
     
     name = models.CharField("Nome", max_length=200, null=True)
-    email = models.EmailField("E-mail", max_length=200, null=True)
+    # Único (e indexado): identifica o cliente convidado no checkout. Sempre
+    # normalizado por `normalize_email`; vários NULL não violam o `unique`.
+    email = models.EmailField("E-mail", max_length=200, null=True, unique=True)
+
+    objects = CustomerQuerySet.as_manager()
 
     def __str__(self):
         if self.user:
@@ -87,6 +198,25 @@ class Customer(models.Model):
         verbose_name_plural = "Clientes"
 
 
+class OrderQuerySet(models.QuerySet):
+    """QuerySet de pedidos com agregações calculadas pelo próprio banco."""
+
+    def with_totals(self):
+        """
+        Anota `computed_total` e `computed_item_count` somando os itens em SQL,
+        numa única consulta para todos os pedidos. Útil para relatórios e para
+        conferir os totais gravados em `total_amount`/`item_count`.
+        """
+        line_total = ExpressionWrapper(
+            F('orderitem__quantity') * F('orderitem__unit_price'),
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+        )
+        return self.annotate(
+            computed_total=Coalesce(Sum(line_total), 0, output_field=DecimalField(max_digits=12, decimal_places=2)),
+            computed_item_count=Coalesce(Sum('orderitem__quantity'), 0),
+        )
+
+
 class Order(models.Model):
     """
     Representa um pedido de compra no e-commerce.
@@ -98,26 +228,57 @@ class Order(models.Model):
     complete = models.BooleanField("Finalizado", default=False)
     transaction_id = models.CharField("ID da Transação", max_length=200, null=True)
 
+    # Totais desnormalizados: calculados uma vez no checkout, para que listar
+    # pedidos não precise somar os itens de cada um.
+    total_amount = models.DecimalField("Valor Total", max_digits=12, decimal_places=2, default=0)
+    item_count = models.PositiveIntegerField("Quantidade de Itens", default=0)
+
+    # Versão do carrinho da API enquanto o pedido não é finalizado; cada
+    # alteração a incrementa (veja DatabaseApiStore em app/api_storage.py).
+    version = models.BigIntegerField("Versão", default=0, editable=False)
+
+    objects = OrderQuerySet.as_manager()
+
     def __str__(self):
         return f"Pedido #{self.id}"
 
     @property
     def get_cart_total(self):
-        """Calcula o total do pedido somando os subtotais de todos os itens."""
-        orderitems = self.orderitem_set.all()
+        """
+        Total do pedido. Pedidos finalizados usam o valor gravado no checkout;
+        os ainda em aberto somam os subtotais dos itens.
+        """
+        if self.complete:
+            return self.total_amount
+        orderitems = self.orderitem_set.select_related('product')
         total = sum([item.get_total for item in orderitems])
         return total
 
     @property
     def get_cart_items(self):
-        """Calcula a quantidade total de itens no pedido."""
+        """Quantidade total de itens no pedido (gravada no checkout se finalizado)."""
+        if self.complete:
+            return self.item_count
         orderitems = self.orderitem_set.all()
         total = sum([item.quantity for item in orderitems])
         return total
 
+    def compute_totals(self, items):
+        """Preenche `total_amount` e `item_count` a partir dos `OrderItem` informados."""
+        self.total_amount = sum(item.unit_price * item.quantity for item in items)
+        self.item_count = sum(item.quantity for item in items)
+
     class Meta:
         verbose_name = "Pedido"
         verbose_name_plural = "Pedidos"
+        constraints = [
+            # Um único carrinho em aberto por `transaction_id` (carrinhos da API)
+            models.UniqueConstraint(
+                fields=['transaction_id'],
+                condition=models.Q(complete=False),
+                name='order_open_cart_unique',
+            ),
+        ]
 
 
 class OrderItem(models.Model):
@@ -133,12 +294,58 @@ class OrderItem(models.Model):
     quantity = models.IntegerField("Quantidade", default=0, null=True, blank=True)
     date_added = models.DateTimeField("Data de Adição", auto_now_add=True)
 
+    # Preço do produto no momento da compra (o preço do Product pode mudar depois)
+    unit_price = models.DecimalField("Preço Unitário", max_digits=10, decimal_places=2, null=True, blank=True)
+
     @property
     def get_total(self):
         """Calcula o subtotal do item (preço * quantidade)."""
-        total = self.product.price * self.quantity
+        price = self.unit_price if self.unit_price is not None else self.product.price
+        total = price * self.quantity
         return total
 
     class Meta:
         verbose_name = "Item do Pedido"
-        verbose_name_plural = "Itens do Pedido"
\ No newline at end of file
+        verbose_name_plural = "Itens do Pedido"
+
+class Job(models.Model):
+    """
+    Uma tarefa da fila em segundo plano (veja app/task_queue.py), executada
+    pelo `python manage.py run_worker`.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, "Pendente"),
+        (RUNNING, "Executando"),
+        (DONE, "Concluída"),
+        (FAILED, "Falhou"),
+    ]
+
+    name = models.CharField("Tarefa", max_length=100)
+    payload = models.JSONField("Argumentos", default=dict)
+    # Duas tarefas com a mesma chave nunca entram na fila (ex.: um e-mail por pedido)
+    idempotency_key = models.CharField("Chave de Idempotência", max_length=200, unique=True, null=True, blank=True)
+    status = models.CharField("Situação", max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField("Tentativas", default=0)
+    max_attempts = models.PositiveSmallIntegerField("Máximo de Tentativas", default=5)
+    run_at = models.DateTimeField("Executar a partir de")
+    # Enquanto `running`: até quando o worker tem a tarefa. Depois disso
+    # (worker morto) outra execução pode pegá-la.
+    locked_until = models.DateTimeField("Reservada até", null=True, blank=True)
+    last_error = models.TextField("Último Erro", blank=True)
+    created_at = models.DateTimeField("Criada em", auto_now_add=True)
+    finished_at = models.DateTimeField("Terminada em", null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.status})"
+
+    class Meta:
+        verbose_name = "Tarefa"
+        verbose_name_plural = "Tarefas"
+        indexes = [
+            # Busca das próximas tarefas pelo worker
+            models.Index(fields=['status', 'run_at'], name='job_status_run_at_idx'),
+        ]
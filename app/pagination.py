@@ -0,0 +1,98 @@
+"""
+Paginação por "keyset" (seek) do catálogo.
+
+Em vez de `OFFSET`, que obriga o banco a percorrer e descartar todas as
+linhas das páginas anteriores, cada página continua a partir da última
+linha da página anterior, usando o índice composto `(created_at, id)`.
+Assim a página N custa o mesmo que a página 1.
+
+A posição é passada ao cliente como um cursor opaco (base64 de
+`created_at|id`), que ele apenas devolve na próxima requisição.
+"""
+import base64
+import binascii
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+def encode_cursor(created_at, pk):
+    raw = f"{created_at.isoformat()}|{pk}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Decodifica um cursor gerado por `encode_cursor`.
+    Retorna `(created_at, id)` ou `None` se o cursor for inválido.
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        created_at_str, pk_str = raw.split('|', 1)
+        created_at = parse_datetime(created_at_str)
+        pk = int(pk_str)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+    if created_at is None:
+        return None
+    return created_at, pk
+
+
+class KeysetPage:
+    """Uma página de resultados e o cursor para a próxima, se houver."""
+
+    def __init__(self, object_list, next_cursor, is_first):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.is_first = is_first
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def _seek(queryset, cursor):
+    queryset = queryset.order_by('-created_at', '-id')
+    position = decode_cursor(cursor) if cursor else None
+    if position is not None:
+        created_at, pk = position
+        # `created_at__lte` delimita a varredura do índice; o Q desempata
+        # produtos criados no mesmo instante pelo id.
+        queryset = queryset.filter(created_at__lte=created_at).filter(
+            Q(created_at__lt=created_at) | Q(id__lt=pk)
+        )
+    return queryset, position
+
+
+def _make_page(rows, per_page, position):
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        next_cursor = encode_cursor(last.created_at, last.pk)
+    return KeysetPage(rows, next_cursor, is_first=position is None)
+
+
+def paginate_keyset(queryset, cursor=None, per_page=24):
+    """
+    Retorna uma `KeysetPage` do `queryset`, do mais novo para o mais antigo
+    por `(created_at, id)`. O queryset precisa carregar `created_at` e `id`.
+    """
+    queryset, position = _seek(queryset, cursor)
+    # Buscamos um item a mais só para saber se existe próxima página
+    rows = list(queryset[:per_page + 1])
+    return _make_page(rows, per_page, position)
+
+
+async def apaginate_keyset(queryset, cursor=None, per_page=24):
+    """Versão assíncrona de `paginate_keyset` (iteração assíncrona do ORM)."""
+    queryset, position = _seek(queryset, cursor)
+    rows = [obj async for obj in queryset[:per_page + 1]]
+    return _make_page(rows, per_page, position)
@@ -0,0 +1,303 @@
+"""
+Limite de requisições por cliente.
+
+Cada URL limitada (pelo nome, em `settings.RATE_LIMITS`) tem uma taxa,
+ex.: `'30/m'`, e os critérios que identificam o cliente:
+
+* `ip`: o endereço de origem (atrás de proxies, veja `RATE_LIMIT_PROXY_COUNT`);
+* `session`: o cookie de sessão ou, sem ele, o carrinho (app/cart_storage.py);
+* `user`: o usuário logado (carrega a sessão; use só onde ela já é lida).
+
+Para cada critério há um "balde de fichas" (token bucket): ele começa com
+`N` fichas, cada requisição gasta uma e elas voltam à razão de `N` por
+período. Rajadas curtas passam; quem passa da taxa de forma contínua recebe
+`429 Too Many Requests` com `Retry-After`, antes da view (sem tocar no banco
+nem gravar sessão ou carrinho). Basta um critério estourar para negar.
+
+Os baldes ficam num backend escolhido em `settings.RATE_LIMIT_STORE`:
+
+* `LocMemRateLimitStore`: em memória, um por processo. O mais rápido
+  (~1µs), mas com N workers o limite efetivo é N vezes a taxa.
+* `SQLiteRateLimitStore`: arquivo SQLite local em modo WAL, compartilhado
+  por todos os processos da máquina; um único comando por consulta.
+"""
+import math
+import sqlite3
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.http import HttpResponse, JsonResponse
+from django.utils.module_loading import import_string
+
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+
+def parse_rate(rate):
+    """`'30/m'` -> `(30, 60)`: número de requisições e período em segundos."""
+    try:
+        count, period = rate.split('/')
+        return int(count), PERIODS[period.strip().lower()[0]]
+    except (ValueError, KeyError, IndexError):
+        raise ImproperlyConfigured(f"Taxa inválida em RATE_LIMITS: {rate!r} (use ex.: '30/m')")
+
+
+class LocMemRateLimitStore:
+    """
+    Baldes num dicionário em memória, protegido por uma trava. Com mais de
+    `max_keys` baldes, os que já se encheram de novo (equivalentes a um
+    balde novo) são descartados; se não bastar, os mais antigos.
+    """
+
+    def __init__(self, max_keys=100_000):
+        self.max_keys = max_keys
+        self._buckets = {}  # chave -> [fichas, atualizado em, cheio em]
+        self._lock = threading.Lock()
+
+    def consume(self, key, capacity, rate):
+        """
+        Gasta uma ficha do balde `key` (`capacity` fichas, `rate` fichas por
+        segundo). Retorna 0 se a requisição passa, ou os segundos até haver
+        uma ficha.
+        """
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_keys:
+                    self._prune(now)
+                self._buckets[key] = [capacity - 1, now, now + 1 / rate]
+                return 0
+            tokens = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if tokens >= 1:
+                bucket[0] = tokens - 1
+                bucket[2] = now + (capacity - tokens + 1) / rate
+                return 0
+            bucket[0] = tokens
+            return (1 - tokens) / rate
+
+    async def aconsume(self, key, capacity, rate):
+        # Só memória e uma trava curta: não vale trocar de thread
+        return self.consume(key, capacity, rate)
+
+    def _prune(self, now):
+        buckets = self._buckets
+        for key in [key for key, bucket in buckets.items() if bucket[2] <= now]:
+            del buckets[key]
+        if len(buckets) >= self.max_keys:
+            # Dicionários mantêm a ordem de inserção: descarta a metade mais antiga
+            for key in list(buckets)[:len(buckets) // 2]:
+                del buckets[key]
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class SQLiteRateLimitStore:
+    """
+    Baldes num arquivo SQLite local em modo WAL, compartilhado pelos
+    processos da mesma máquina. Cada consulta é um único `INSERT ... ON
+    CONFLICT DO UPDATE ... RETURNING`, atômico por si só. Baldes parados há
+    mais de `max_idle` segundos (já cheios de novo) são apagados de tempos
+    em tempos.
+    """
+
+    def __init__(self, path=None, max_idle=PERIODS['d'], prune_every=1000):
+        self.path = str(path or settings.BASE_DIR / 'ratelimit.sqlite3')
+        self.max_idle = max_idle
+        self.prune_every = prune_every
+        self._calls = 0
+        self._local = threading.local()
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            " key TEXT PRIMARY KEY,"
+            " tokens REAL NOT NULL,"
+            " updated REAL NOT NULL,"
+            " allowed INTEGER NOT NULL)"
+        )
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")  # perder baldes numa queda não importa
+            self._local.conn = conn
+        return conn
+
+    def consume(self, key, capacity, rate):
+        """Veja `LocMemRateLimitStore.consume`."""
+        now = time.time()
+        conn = self._connection()
+        # Nos SET, `tokens` e `updated` são os valores de antes da atualização
+        allowed, tokens = conn.execute(
+            "INSERT INTO buckets (key, tokens, updated, allowed) VALUES (:key, :capacity - 1, :now, 1)"
+            " ON CONFLICT(key) DO UPDATE SET"
+            "  tokens = CASE WHEN MIN(:capacity, tokens + (:now - updated) * :rate) >= 1"
+            "   THEN MIN(:capacity, tokens + (:now - updated) * :rate) - 1"
+            "   ELSE MIN(:capacity, tokens + (:now - updated) * :rate) END,"
+            "  allowed = MIN(:capacity, tokens + (:now - updated) * :rate) >= 1,"
+            "  updated = :now"
+            " RETURNING allowed, tokens",
+            {'key': key, 'capacity': capacity, 'rate': rate, 'now': now},
+        ).fetchone()
+        self._calls += 1
+        if self._calls % self.prune_every == 0:
+            conn.execute("DELETE FROM buckets WHERE updated < ?", (now - self.max_idle,))
+        return 0 if allowed else (1 - tokens) / rate
+
+    async def aconsume(self, key, capacity, rate):
+        # Conexões SQLite por thread: não precisamos do thread único do ORM
+        return await sync_to_async(self.consume, thread_sensitive=False)(key, capacity, rate)
+
+    def clear(self):
+        self._connection().execute("DELETE FROM buckets")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_rate_limit_store():
+    """Retorna (criando na primeira chamada) o backend configurado em `settings.RATE_LIMIT_STORE`."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                config = settings.RATE_LIMIT_STORE
+                backend = import_string(config['BACKEND'])
+                _store = backend(**config.get('OPTIONS', {}))
+    return _store
+
+
+def client_ip(request):
+    """
+    IP do cliente. Atrás de `RATE_LIMIT_PROXY_COUNT` proxies confiáveis, o
+    IP que o mais externo deles viu, no `X-Forwarded-For` (os valores mais à
+    esquerda podem ter sido inventados pelo cliente).
+    """
+    proxies = settings.RATE_LIMIT_PROXY_COUNT
+    if proxies:
+        forwarded = request.META.get('HTTP_X_FORWARDED_FOR', '').split(',')
+        if len(forwarded) >= proxies:
+            return forwarded[-proxies].strip()
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def _session_key(request):
+    session = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if session:
+        return session
+    cart = getattr(request, 'cart', None)
+    # Sem `cart.key` se ainda não houver um: lê-lo criaria o carrinho
+    return cart.key if cart is not None and cart.has_key else None
+
+
+def _user_key(request):
+    user = getattr(request, 'user', None)
+    return str(user.pk) if user is not None and user.is_authenticated else None
+
+
+# Critério -> função que retorna o identificador do cliente (ou None: não se aplica)
+KEY_FUNCTIONS = {
+    'ip': client_ip,
+    'session': _session_key,
+    'user': _user_key,
+}
+
+
+class Limit:
+    """Um item de `settings.RATE_LIMITS`, já interpretado."""
+    __slots__ = ('name', 'capacity', 'rate', 'keys', 'methods', 'needs_user')
+
+    def __init__(self, name, rate, keys=('ip',), methods=None):
+        self.name = name
+        count, period = parse_rate(rate)
+        self.capacity = count
+        self.rate = count / period  # fichas por segundo
+        unknown = set(keys) - set(KEY_FUNCTIONS)
+        if unknown:
+            raise ImproperlyConfigured(f"RATE_LIMITS[{name!r}]: critérios desconhecidos {sorted(unknown)}")
+        self.keys = [(kind, KEY_FUNCTIONS[kind]) for kind in keys]
+        self.needs_user = 'user' in keys
+        self.methods = {method.upper() for method in methods} if methods else None
+
+    def bucket_keys(self, request):
+        """Chaves dos baldes desta requisição, uma por critério aplicável."""
+        if self.methods is not None and request.method not in self.methods:
+            return []
+        keys = []
+        for kind, key_function in self.keys:
+            value = key_function(request)
+            if value:
+                keys.append(f'{self.name}:{kind}:{value}')
+        return keys
+
+
+def too_many_requests(request, retry_after):
+    """Resposta 429: JSON para a API e chamadas AJAX, texto nas demais."""
+    seconds = max(1, math.ceil(retry_after))
+    message = "Muitas requisições. Tente novamente em instantes."
+    wants_json = (
+        request.path_info.startswith('/api/')
+        or 'application/json' in request.headers.get('Accept', '')
+        or request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+    )
+    if wants_json:
+        response = JsonResponse({"error": "Too many requests", "message": message, "retry_after": seconds}, status=429)
+    else:
+        response = HttpResponse(message, status=429, content_type='text/plain; charset=utf-8')
+    response['Retry-After'] = str(seconds)
+    return response
+
+
+class RateLimitMiddleware:
+    """
+    Aplica `settings.RATE_LIMITS` antes de chamar a view. URLs sem limite
+    custam uma consulta a um dicionário; sem nenhum limite configurado o
+    middleware nem é carregado.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.RATE_LIMITS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.limits = {
+            name: Limit(name, **config) for name, config in settings.RATE_LIMITS.items()
+        }
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+            self.process_view = self.aprocess_view
+
+    def __call__(self, request):
+        # No modo assíncrono get_response retorna a corrotina, aguardada pelo Django
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        limit = self.limits.get(request.resolver_match.url_name)
+        if limit is None:
+            return None
+        store = get_rate_limit_store()
+        retry_after = 0
+        for key in limit.bucket_keys(request):
+            retry_after = max(retry_after, store.consume(key, limit.capacity, limit.rate))
+        return too_many_requests(request, retry_after) if retry_after else None
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        limit = self.limits.get(request.resolver_match.url_name)
+        if limit is None:
+            return None
+        if limit.needs_user:
+            # `request.user` síncrono não pode carregar a sessão aqui
+            request.user = await request.auser()
+        store = get_rate_limit_store()
+        retry_after = 0
+        for key in limit.bucket_keys(request):
+            retry_after = max(retry_after, await store.aconsume(key, limit.capacity, limit.rate))
+        return too_many_requests(request, retry_after) if retry_after else None
@@ -0,0 +1,169 @@
+"""
+Busca de produtos por nome e descrição, com índice.
+
+`ILIKE '%termo%'` obriga o banco a ler a tabela inteira a cada busca. Aqui
+cada banco usa o seu próprio índice de texto completo:
+
+* **PostgreSQL**: um índice GIN sobre `to_tsvector` com a configuração
+  `portuguese_unaccent` (stemming em português e sem acentos, então "cafe"
+  encontra "Café"), criado pela migração `0006_product_search`. O índice é
+  sobre uma expressão da própria tabela, então o banco o mantém sozinho.
+* **SQLite** (desenvolvimento local): uma tabela virtual FTS5
+  `app_product_fts` com uma cópia de `name`/`description`, mantida em dia
+  pelos sinais de `Product` (veja `app/signals.py`). Depois de operações
+  em lote que não disparam sinais, chame `rebuild_search_index()`.
+
+Os resultados vêm ordenados por relevância e paginados.
+"""
+import re
+
+from django.db import connection, connections, router
+from django.db.models import BooleanField, FloatField
+from django.db.models.expressions import RawSQL
+
+from .models import Product
+
+SEARCH_CONFIG = 'portuguese_unaccent'
+FTS_TABLE = 'app_product_fts'
+
+# A mesma expressão é usada no índice GIN (migração 0006) e nas consultas:
+# precisam ser idênticas para o PostgreSQL usar o índice.
+PG_VECTOR_SQL = (
+    f"to_tsvector('{SEARCH_CONFIG}'::regconfig, "
+    "coalesce(\"app_product\".\"name\", '') || ' ' || coalesce(\"app_product\".\"description\", ''))"
+)
+PG_QUERY_SQL = f"websearch_to_tsquery('{SEARCH_CONFIG}'::regconfig, %s)"
+
+
+def _fts_query(term):
+    """
+    Converte o texto digitado numa consulta FTS5 segura: cada palavra entre
+    aspas (para não ser interpretada como operador) e com busca por prefixo.
+    """
+    words = re.findall(r'\w+', term)
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+class SearchPage:
+    """Uma página de resultados da busca."""
+
+    def __init__(self, object_list, number, has_next):
+        self.object_list = object_list
+        self.number = number
+        self.has_next = has_next
+
+    @property
+    def has_previous(self):
+        return self.number > 1
+
+    @property
+    def next_page_number(self):
+        return self.number + 1
+
+    @property
+    def previous_page_number(self):
+        return self.number - 1
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def _ranked_ids_sqlite(term, limit, offset):
+    query = _fts_query(term)
+    if not query:
+        return []
+    # SQL direto não passa pelo roteador: usamos a conexão que ele escolheria
+    # para ler produtos (uma réplica, se houver; veja app/db_router.py)
+    with connections[router.db_for_read(Product)].cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+            f"ORDER BY bm25({FTS_TABLE}) LIMIT %s OFFSET %s",
+            [query, limit, offset],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search_products(term, page=1, per_page=24):
+    """
+    Busca `term` nos produtos e retorna a `SearchPage` pedida, do resultado
+    mais relevante para o menos relevante.
+    """
+    term = (term or '').strip()
+    page = max(1, page)
+    offset = (page - 1) * per_page
+    if not term:
+        return SearchPage([], page, False)
+
+    fields = ('id', 'name', 'description', 'price', 'image', 'image_hash', 'created_at')
+    if connection.vendor == 'postgresql':
+        products = list(
+            Product.objects.only(*fields)
+            .filter(RawSQL(f"{PG_VECTOR_SQL} @@ {PG_QUERY_SQL}", (term,), output_field=BooleanField()))
+            .annotate(rank=RawSQL(f"ts_rank({PG_VECTOR_SQL}, {PG_QUERY_SQL})", (term,), output_field=FloatField()))
+            .order_by('-rank', '-id')[offset:offset + per_page + 1]
+        )
+    else:
+        ids = _ranked_ids_sqlite(term, per_page + 1, offset)
+        by_id = Product.objects.only(*fields).in_bulk(ids)
+        products = [by_id[pk] for pk in ids if pk in by_id]
+
+    has_next = len(products) > per_page
+    return SearchPage(products[:per_page], page, has_next)
+
+
+def filter_products(queryset, term):
+    """
+    Filtra um queryset de `Product` pela busca, sem ordenar por relevância.
+    Usado pela busca do admin.
+    """
+    term = (term or '').strip()
+    if not term:
+        return queryset
+    if connection.vendor == 'postgresql':
+        return queryset.filter(RawSQL(f"{PG_VECTOR_SQL} @@ {PG_QUERY_SQL}", (term,), output_field=BooleanField()))
+    query = _fts_query(term)
+    if not query:
+        return queryset.none()
+    return queryset.filter(pk__in=RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", (query,)))
+
+
+def _write_connection(using=None):
+    # Como em `_ranked_ids_sqlite`: o índice fica no banco onde os produtos
+    # são gravados (o primário), e não necessariamente no `default`.
+    return connections[using or router.db_for_write(Product)]
+
+
+def index_product(product, using=None):
+    """Atualiza o produto no índice FTS5 (apenas SQLite; no PostgreSQL não há nada a fazer)."""
+    conn = _write_connection(using)
+    if conn.vendor != 'sqlite':
+        return
+    with conn.cursor() as cursor:
+        cursor.execute(
+            f"INSERT OR REPLACE INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)",
+            [product.pk, product.name, product.description],
+        )
+
+
+def unindex_product(product_id, using=None):
+    conn = _write_connection(using)
+    if conn.vendor != 'sqlite':
+        return
+    with conn.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [product_id])
+
+
+def rebuild_search_index(using=None):
+    """Recria o índice FTS5 inteiro a partir de `Product` (apenas SQLite)."""
+    conn = _write_connection(using)
+    if conn.vendor != 'sqlite':
+        return
+    with conn.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, name, description) "
+            "SELECT id, name, description FROM app_product"
+        )
@@ -0,0 +1,64 @@
+"""
+Receptores de sinais dos modelos da loja.
+"""
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cart import snapshot_cache
+from .catalog import bump_catalog_version
+from .images import schedule_product_image
+from .search import index_product, unindex_product
+from .stock import evict_available
+from .models import Product
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def evict_product_snapshot(sender, instance, **kwargs):
+    """Remove o snapshot do produto alterado/excluído do cache do carrinho."""
+    snapshot_cache.evict(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def evict_product_available(sender, instance, **kwargs):
+    """O estoque pode ter mudado: o disponível em cache é lido de novo."""
+    evict_available([instance.pk])
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_grid(sender, instance, **kwargs):
+    """Nova versão do catálogo: as grades em cache deixam de ser usadas."""
+    bump_catalog_version()
+
+
+@receiver(post_save, sender=Product)
+def update_search_index(sender, instance, raw=False, using=None, **kwargs):
+    """Mantém o índice de busca (FTS5 no SQLite) em dia com o produto salvo."""
+    if not raw:
+        index_product(instance, using=using)
+
+
+@receiver(post_delete, sender=Product)
+def remove_from_search_index(sender, instance, using=None, **kwargs):
+    unindex_product(instance.pk, using=using)
+
+
+@receiver(post_save, sender=Product)
+def generate_product_renditions(sender, instance, created=False, raw=False, update_fields=None, **kwargs):
+    """
+    Gera as miniaturas da imagem em segundo plano, depois do commit. Nada a
+    fazer se a imagem não mudou desde que o produto foi lido do banco e as
+    miniaturas dela já existem (`image_hash`).
+    """
+    if raw or (update_fields is not None and 'image' not in update_fields):
+        return
+    if not instance.image:
+        return
+    if not created and instance.image_hash and instance.image.name == instance.loaded_image_name:
+        return
+    instance.loaded_image_name = instance.image.name
+    product_id = instance.pk
+    transaction.on_commit(lambda: schedule_product_image(product_id))
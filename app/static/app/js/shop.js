@@ -3,6 +3,16 @@ const userId = 1;
 
 // Cart data
 let cart = [];
+// Versão do carrinho no servidor; enviada no checkout para confirmar que o
+// cliente paga pelo carrinho que está vendo (outra aba pode tê-lo alterado)
+let cartVersion = 0;
+
+function applyCartResponse(data) {
+    if (data.cart) {
+        cart = data.cart;
+        cartVersion = data.version || 0;
+    }
+}
 
 // Fetch products from API
 let products = [];
@@ -23,7 +33,7 @@ document.addEventListener('DOMContentLoaded', function() {
     fetch(`/api/cart/${userId}/`)
         .then(response => response.json())
         .then(data => {
-            cart = data.cart || [];
+            applyCartResponse(data);
             updateCart();
         })
         .catch(error => console.error('Error loading cart:', error));
@@ -103,7 +113,7 @@ function addToCart(productId) {
     .then(response => response.json())
     .then(data => {
         if (data.success) {
-            cart = data.cart;
+            applyCartResponse(data);
             updateCart();
             showCartNotification();
         }
@@ -183,7 +193,7 @@ function adjustQuantity(productId, change) {
             body: JSON.stringify({ product_id: productId, quantity_change: change })
         })
         .then(response => response.json())
-        .then(data => { if(data.success) cart = data.cart; else updateCart(); })
+        .then(data => { applyCartResponse(data); if(!data.success) updateCart(); })
         .catch(error => console.error('Error adjusting quantity:', error));
     }
 }
@@ -197,7 +207,7 @@ function removeFromCart(productId) {
         body: JSON.stringify({ product_id: productId })
     })
     .then(response => response.json())
-    .then(data => { if(data.success) cart = data.cart; else updateCart(); })
+    .then(data => { applyCartResponse(data); if(!data.success) updateCart(); })
     .catch(error => console.error('Error removing from cart:', error));
 }
 
@@ -259,9 +269,15 @@ async function confirmOrder(e) {
         const response = await fetch(`/api/checkout/${userId}/`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json', 'X-CSRFToken': getCookie('csrftoken') },
-            body: JSON.stringify(orderData)
+            body: JSON.stringify({ ...orderData, version: cartVersion })
         });
         const data = await response.json();
+        if (response.status === 409) {
+            // O carrinho mudou em outra aba: mostra o carrinho atual antes de cobrar
+            applyCartResponse(data);
+            updateCart();
+            throw new Error('Seu carrinho foi alterado em outra aba. Confira os itens e finalize novamente.');
+        }
         if (!response.ok || !data.success) throw new Error(data.error || 'Não foi possível completar o pedido.');
         
         document.getElementById('checkout').classList.add('hidden');
@@ -270,6 +286,7 @@ async function confirmOrder(e) {
         confirmationSection.classList.remove('hidden');
         
         cart = [];
+        cartVersion = 0;
         updateCart();
         form.reset();
         window.scrollTo({ top: 0, behavior: 'smooth' });
@@ -0,0 +1,256 @@
+"""
+Arquivos estáticos em produção.
+
+`python manage.py collectstatic` copia os arquivos para `STATIC_ROOT` pelo
+`CompressedManifestStaticFilesStorage`:
+
+* cada arquivo ganha uma cópia com o hash do conteúdo no nome
+  (`shop.js` -> `shop.3f1a9c2b7e4d.js`), e `{% static %}` passa a apontar
+  para ela (manifesto `staticfiles.json`). Um deploy que muda o arquivo
+  muda a URL, então o navegador pode guardá-lo para sempre;
+* os arquivos de texto (CSS, JS, SVG...) ganham irmãos pré-comprimidos
+  `.gz` e, com o pacote `brotli` instalado, `.br`. A compressão acontece
+  uma vez, no build, com o nível máximo.
+
+O `StaticFilesMiddleware` serve `STATIC_ROOT` direto do processo, sem
+passar pelas views: escolhe a variante comprimida pelo `Accept-Encoding` e
+manda os arquivos com hash no nome com `Cache-Control: immutable`. Arquivos
+pequenos ficam em memória depois do primeiro acesso. O índice de arquivos
+é montado no primeiro acesso: reinicie o processo depois do collectstatic.
+Com `DEBUG = True` o `runserver` continua servindo os arquivos originais.
+"""
+import gzip
+import json
+import mimetypes
+import os
+import re
+import threading
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
+
+try:
+    import brotli
+except ImportError:  # opcional: sem ele só geramos .gz
+    brotli = None
+
+# Extensões que valem a pena comprimir (imagens e fontes já são comprimidas)
+COMPRESSIBLE = re.compile(r'\.(css|js|mjs|map|json|svg|txt|html|xml|ico|ttf|otf|eot)$', re.IGNORECASE)
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+# Arquivos até este tamanho ficam em memória depois do primeiro acesso
+MEMORY_LIMIT = 512 * 1024
+
+
+def _gzip(data):
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def _brotli(data):
+    return brotli.compress(data, quality=11)
+
+
+# (extensão do irmão, Content-Encoding, compressor), na ordem de preferência
+ENCODINGS = [('.br', 'br', _brotli), ('.gz', 'gzip', _gzip)] if brotli else [('.gz', 'gzip', _gzip)]
+
+
+def compress_file(path):
+    """
+    Grava os irmãos `.gz`/`.br` de `path`, se ainda não existirem (ou forem
+    mais antigos que ele). Variantes que não economizam ao menos 5% não são
+    gravadas. Retorna os caminhos gravados.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    mtime = os.path.getmtime(path)
+    written = []
+    for suffix, _, compress in ENCODINGS:
+        target = path + suffix
+        if os.path.exists(target) and os.path.getmtime(target) >= mtime:
+            continue
+        compressed = compress(data)
+        if len(compressed) > len(data) * 0.95:
+            if os.path.exists(target):
+                os.remove(target)
+            continue
+        tmp = f'{target}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(compressed)
+        os.replace(tmp, target)
+        written.append(target)
+    return written
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    `ManifestStaticFilesStorage` que também grava os irmãos comprimidos.
+    Arquivos fora do manifesto (ou sem collectstatic, como nos testes) usam
+    o nome original em vez de derrubar a página.
+    """
+    manifest_strict = False
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:  # sem manifesto e sem o arquivo em STATIC_ROOT
+            return name
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        names = set(paths) | set(self.hashed_files.values())
+        for name in sorted(names):
+            if COMPRESSIBLE.search(name) and self.exists(name):
+                compress_file(self.path(name))
+
+
+class StaticFile:
+    """Um arquivo de `STATIC_ROOT` e suas variantes comprimidas."""
+    __slots__ = ('path', 'content_type', 'variants', 'cache_control', 'etag', '_content')
+
+    def __init__(self, path, variants, immutable):
+        self.path = path
+        content_type, _ = mimetypes.guess_type(path)
+        content_type = content_type or 'application/octet-stream'
+        if content_type.startswith('text/') or content_type in ('application/javascript', 'application/json'):
+            content_type += '; charset=utf-8'
+        self.content_type = content_type
+        self.variants = variants  # [(Content-Encoding, caminho)], na ordem de preferência
+        self.cache_control = IMMUTABLE if immutable else f'public, max-age={settings.STATIC_MAX_AGE}'
+        stat = os.stat(path)
+        self.etag = f'{int(stat.st_mtime):x}-{stat.st_size:x}'
+        self._content = {}
+
+    def choose(self, accept_encoding):
+        """Retorna `(encoding ou None, caminho)` da melhor variante aceita pelo cliente."""
+        accepted = _accepted_encodings(accept_encoding)
+        for encoding, path in self.variants:
+            if encoding in accepted:
+                return encoding, path
+        return None, self.path
+
+    def etag_for(self, encoding):
+        # Cada variante é uma representação diferente: ETags diferentes
+        return f'"{self.etag}-{encoding}"' if encoding else f'"{self.etag}"'
+
+    def content(self, path):
+        """Conteúdo do arquivo, guardado em memória se for pequeno; None se for grande."""
+        data = self._content.get(path)
+        if data is None and os.path.getsize(path) <= MEMORY_LIMIT:
+            with open(path, 'rb') as f:
+                data = self._content[path] = f.read()
+        return data
+
+
+def _accepted_encodings(header):
+    accepted = set()
+    for part in header.split(','):
+        encoding, _, params = part.strip().partition(';')
+        if params.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        accepted.add(encoding.strip().lower())
+    return accepted
+
+
+def build_index(root, manifest_name='staticfiles.json'):
+    """
+    `{caminho relativo: StaticFile}` de todos os arquivos de `root`. Os
+    nomes com hash listados no manifesto são marcados como imutáveis.
+    """
+    try:
+        with open(os.path.join(root, manifest_name), encoding='utf-8') as f:
+            hashed = set(json.load(f).get('paths', {}).values())
+    except (OSError, ValueError):
+        hashed = set()
+    suffixes = {suffix: encoding for suffix, encoding, _ in ENCODINGS}
+    index = {}
+    for directory, _, filenames in os.walk(root):
+        present = set(filenames)
+        for filename in filenames:
+            if os.path.splitext(filename)[1] in suffixes or filename == manifest_name:
+                continue
+            path = os.path.join(directory, filename)
+            name = os.path.relpath(path, root).replace(os.sep, '/')
+            variants = [
+                (encoding, path + suffix) for suffix, encoding in suffixes.items()
+                if filename + suffix in present
+            ]
+            index[name] = StaticFile(path, variants, immutable=name in hashed)
+    return index
+
+
+class StaticFilesMiddleware:
+    """
+    Serve os arquivos de `STATIC_ROOT` (veja o docstring do módulo). Outras
+    URLs seguem para o resto da pilha.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        # URLs absolutas (CDN) não passam por aqui
+        if not settings.STATIC_ROOT or '://' in settings.STATIC_URL:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+        self.prefix = '/' + settings.STATIC_URL.lstrip('/')
+        self.root = str(settings.STATIC_ROOT)
+        self._index = None
+        self._lock = threading.Lock()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self._serve(request)
+        if response is None:
+            response = self.get_response(request)
+        return response
+
+    async def __acall__(self, request):
+        response = self._serve(request)
+        if response is None:
+            response = await self.get_response(request)
+        return response
+
+    @property
+    def index(self):
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    self._index = build_index(self.root)
+        return self._index
+
+    def _serve(self, request):
+        if request.method not in ('GET', 'HEAD') or not request.path_info.startswith(self.prefix):
+            return None
+        static_file = self.index.get(request.path_info[len(self.prefix):])
+        if static_file is None:
+            return None
+
+        encoding, path = static_file.choose(request.headers.get('Accept-Encoding', ''))
+        etag = static_file.etag_for(encoding)
+        if request.headers.get('If-None-Match') == etag:
+            response = HttpResponseNotModified()
+        else:
+            data = static_file.content(path)
+            if data is None:
+                response = FileResponse(
+                    open(path, 'rb'), content_type=static_file.content_type,
+                    filename=os.path.basename(static_file.path),
+                )
+            else:
+                response = HttpResponse(b'' if request.method == 'HEAD' else data, content_type=static_file.content_type)
+                response['Content-Length'] = len(data)
+            if encoding:
+                response['Content-Encoding'] = encoding
+        if static_file.variants:
+            response['Vary'] = 'Accept-Encoding'
+        response['ETag'] = etag
+        response['Cache-Control'] = static_file.cache_control
+        return response
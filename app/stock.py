@@ -0,0 +1,274 @@
+"""
+Reservas de estoque do carrinho da vitrine.
+
+Colocar um produto no carrinho separa as unidades por alguns minutos
+(`settings.STOCK_RESERVATION_TTL`): uma `StockReservation` por carrinho e
+produto, e a soma delas em `Product.reserved`. O disponível para venda é
+`stock - reserved`, então durante um pico de vendas dois visitantes não
+conseguem colocar no carrinho a mesma última unidade.
+
+* `reserve_stock` ajusta as reservas quando o carrinho muda; tudo ou nada.
+* O checkout (app/checkout.py) consome as reservas do carrinho com
+  `take_reservations` e baixa `stock` e `reserved` no mesmo `UPDATE`.
+* `release_reservations` devolve as reservas de um carrinho esvaziado e
+  `release_expired` (comando `release_reservations`) as que venceram. Um
+  produto sem disponível também libera na hora as suas reservas vencidas,
+  quando alguém tenta reservá-lo.
+
+Nada disso trava linhas com `select_for_update`: `Product.reserved` só muda
+por `UPDATE` condicional (`reserved = reserved + n WHERE stock >= reserved + n`)
+e uma reserva só é alterada ou removida se continuar como foi lida; se outra
+requisição mexeu nela antes, a operação é refeita.
+
+A vitrine mostra o disponível de cada produto a partir de um contador em
+cache (`get_available`), apagado sempre que uma reserva ou o estoque mudam.
+A grade em cache (app/catalog.py) traz um marcador por produto que é
+preenchido a cada requisição com esses contadores.
+"""
+import datetime
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Product, StockReservation
+
+# Tentativas quando outra requisição altera a mesma reserva ao mesmo tempo
+MAX_ATTEMPTS = 5
+
+AVAILABLE_KEY = 'stock:available:{}'
+
+
+class InsufficientStock(Exception):
+    """Um ou mais produtos do carrinho não têm estoque suficiente."""
+
+    def __init__(self, products):
+        self.products = products
+        names = ', '.join(product.name for product in products)
+        super().__init__(f"Estoque insuficiente para: {names}")
+
+
+class ReservationConflict(Exception):
+    """
+    As reservas do carrinho continuaram mudando em todas as `MAX_ATTEMPTS`
+    tentativas (outras requisições do mesmo carrinho ao mesmo tempo). Nada
+    foi alterado; a operação pode ser repetida.
+    """
+
+
+class _ReservationChanged(Exception):
+    """Uma reserva mudou entre a leitura e a escrita: refazer a operação."""
+
+
+def quantity_case(quantities, field='id'):
+    """`CASE id WHEN ... THEN quantidade END` para usar num único UPDATE."""
+    return Case(
+        *[When(**{field: product_id}, then=Value(quantity)) for product_id, quantity in quantities.items()],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+
+
+def _short_products(product_ids):
+    return list(Product.objects.filter(id__in=product_ids).only('id', 'name'))
+
+
+def _reserve_one(cart_key, product_id, quantity, expires_at):
+    """
+    Deixa a reserva do carrinho para o produto em `quantity` unidades.
+    Retorna False se não houver estoque disponível para o aumento.
+    """
+    reservations = StockReservation.objects.filter(cart_key=cart_key, product_id=product_id)
+    for _ in range(MAX_ATTEMPTS):
+        current = reservations.values_list('quantity', flat=True).first()
+        if current == quantity or (current is None and quantity == 0):
+            return True
+        # Primeiro a reserva, com comparação: se outra requisição do mesmo
+        # carrinho a alterou depois da leitura, nada é gravado e refazemos.
+        if current is None:
+            try:
+                with transaction.atomic():
+                    StockReservation.objects.create(
+                        cart_key=cart_key, product_id=product_id, quantity=quantity, expires_at=expires_at,
+                    )
+            except IntegrityError:
+                continue
+        elif quantity == 0:
+            if not reservations.filter(quantity=current).delete()[0]:
+                continue
+        elif not reservations.filter(quantity=current).update(quantity=quantity, expires_at=expires_at):
+            continue
+
+        # Depois o contador do produto, no mesmo UPDATE que confere o estoque
+        delta = quantity - (current or 0)
+        products = Product.objects.filter(id=product_id)
+        if delta < 0:
+            products.update(reserved=F('reserved') + delta)
+            return True
+        available = products.filter(stock__gte=F('reserved') + delta)
+        if available.update(reserved=F('reserved') + delta):
+            return True
+        # Sem estoque: reservas vencidas de outros carrinhos ainda podem estar
+        # segurando unidades. Libera as do produto aqui mesmo e tenta de novo.
+        return _release_expired_holds(product_id) and available.update(reserved=F('reserved') + delta) == 1
+    return False
+
+
+def _release_expired_holds(product_id):
+    """Libera as reservas vencidas do produto. Retorna True se alguma foi liberada."""
+    try:
+        taken = take_reservations(
+            StockReservation.objects.filter(product_id=product_id, expires_at__lte=timezone.now())
+        )
+    except ReservationConflict:
+        return False
+    _give_back(taken)
+    return bool(taken)
+
+
+def reserve_stock(cart_key, quantities):
+    """
+    Ajusta as reservas do carrinho `cart_key` para `{product_id: quantidade}`
+    (quantidade 0 libera a reserva) e renova o prazo de todas as reservas do
+    carrinho. Tudo ou nada: se algum produto não tiver estoque disponível,
+    levanta `InsufficientStock` e nenhuma reserva muda.
+    """
+    expires_at = timezone.now() + datetime.timedelta(seconds=settings.STOCK_RESERVATION_TTL)
+    with transaction.atomic():
+        short = [
+            product_id for product_id, quantity in quantities.items()
+            if not _reserve_one(cart_key, product_id, quantity, expires_at)
+        ]
+        if short:
+            raise InsufficientStock(_short_products(short))
+        StockReservation.objects.filter(cart_key=cart_key).update(expires_at=expires_at)
+        transaction.on_commit(lambda: evict_available(quantities))
+
+
+async def areserve_stock(cart_key, quantities):
+    """Versão assíncrona de `reserve_stock`."""
+    await sync_to_async(reserve_stock)(cart_key, quantities)
+
+
+def take_reservations(queryset):
+    """
+    Remove as reservas de `queryset` e retorna `{product_id: quantidade}`
+    removida. NÃO devolve as unidades a `Product.reserved`: o chamador faz
+    isso (ou as converte em venda) na mesma transação. Levanta
+    `ReservationConflict` se não conseguir em `MAX_ATTEMPTS` tentativas.
+    """
+    for _ in range(MAX_ATTEMPTS):
+        try:
+            with transaction.atomic():
+                rows = list(queryset.values_list('id', 'product_id', 'quantity', 'expires_at'))
+                if not rows:
+                    return {}
+                # Toda alteração renova `expires_at`: se alguma reserva lida
+                # foi alterada nesse meio tempo, ela não é removida aqui e a
+                # contagem não bate.
+                latest = max(row[3] for row in rows)
+                deleted = StockReservation.objects.filter(
+                    id__in=[row[0] for row in rows], expires_at__lte=latest,
+                ).delete()[0]
+                if deleted != len(rows):
+                    raise _ReservationChanged
+        except _ReservationChanged:
+            continue
+        taken = {}
+        for _, product_id, quantity, _ in rows:
+            taken[product_id] = taken.get(product_id, 0) + quantity
+        return taken
+    raise ReservationConflict("As reservas do carrinho mudaram durante a operação.")
+
+
+def _give_back(taken):
+    """Devolve ao disponível as unidades de reservas removidas."""
+    if taken:
+        Product.objects.filter(id__in=taken).update(reserved=F('reserved') - quantity_case(taken))
+        transaction.on_commit(lambda: evict_available(taken))
+
+
+def release_reservations(cart_key):
+    """Libera todas as reservas do carrinho (ex.: carrinho esvaziado)."""
+    with transaction.atomic():
+        _give_back(take_reservations(StockReservation.objects.filter(cart_key=cart_key)))
+
+
+async def arelease_reservations(cart_key):
+    """Versão assíncrona de `release_reservations`."""
+    await sync_to_async(release_reservations)(cart_key)
+
+
+def release_expired(batch_size=500, now=None):
+    """
+    Libera as reservas vencidas, em lotes de `batch_size` (uma transação
+    por lote). Retorna quantas unidades voltaram a ficar disponíveis.
+    """
+    now = now or timezone.now()
+    released = 0
+    while True:
+        with transaction.atomic():
+            batch = StockReservation.objects.filter(expires_at__lte=now).order_by('expires_at')[:batch_size]
+            taken = take_reservations(batch)
+            _give_back(taken)
+        if not taken:
+            return released
+        released += sum(taken.values())
+
+
+def recount_reserved():
+    """
+    Recalcula `Product.reserved` a partir das reservas existentes. Só é
+    necessário para corrigir um banco alterado à mão.
+    """
+    total = (
+        StockReservation.objects.filter(product=OuterRef('pk'))
+        .order_by().values('product').annotate(total=Sum('quantity')).values('total')
+    )
+    Product.objects.update(reserved=Coalesce(Subquery(total), 0))
+    cache.delete_many([AVAILABLE_KEY.format(pk) for pk in Product.objects.values_list('pk', flat=True)])
+
+
+# ==========================================================
+# Disponível em cache
+# ==========================================================
+
+def _store_available(found, rows):
+    fetched = {pk: max(stock - reserved, 0) for pk, stock, reserved in rows}
+    found.update(fetched)
+    return {AVAILABLE_KEY.format(pk): available for pk, available in fetched.items()}
+
+
+def get_available(product_ids):
+    """
+    `{product_id: unidades disponíveis}` dos produtos informados, lidos do
+    cache. Os que faltam vêm do banco numa única consulta e voltam ao cache.
+    Produtos inexistentes não aparecem no resultado.
+    """
+    keys = {AVAILABLE_KEY.format(pk): pk for pk in product_ids}
+    found = {keys[key]: value for key, value in cache.get_many(list(keys)).items()}
+    missing = [pk for pk in keys.values() if pk not in found]
+    if missing:
+        rows = Product.objects.filter(id__in=missing).values_list('id', 'stock', 'reserved')
+        cache.set_many(_store_available(found, rows), settings.STOCK_AVAILABLE_TTL)
+    return found
+
+
+async def aget_available(product_ids):
+    """Versão assíncrona de `get_available`."""
+    keys = {AVAILABLE_KEY.format(pk): pk for pk in product_ids}
+    found = {keys[key]: value for key, value in (await cache.aget_many(list(keys))).items()}
+    missing = [pk for pk in keys.values() if pk not in found]
+    if missing:
+        rows = [row async for row in Product.objects.filter(id__in=missing).values_list('id', 'stock', 'reserved')]
+        await cache.aset_many(_store_available(found, rows), settings.STOCK_AVAILABLE_TTL)
+    return found
+
+
+def evict_available(product_ids):
+    """Apaga do cache o disponível dos produtos (estoque ou reservas mudaram)."""
+    cache.delete_many([AVAILABLE_KEY.format(pk) for pk in product_ids])
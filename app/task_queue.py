@@ -0,0 +1,370 @@
+"""
+Fila de tarefas em segundo plano.
+
+Trabalho que não precisa acontecer antes da resposta (e-mail de
+confirmação, registro do pedido...) vira uma tarefa: a view chama
+`enqueue` e responde na hora; o `python manage.py run_worker` executa a
+tarefa depois, em outro processo. Uma tarefa lenta ou um serviço de e-mail
+fora do ar não aumentam mais a latência do checkout.
+
+As tarefas são funções registradas com `@task` (veja app/tasks.py) que
+recebem argumentos nomeados serializáveis em JSON:
+
+    @task(max_attempts=5, backoff=30)
+    def send_order_confirmation(order_id):
+        ...
+
+    enqueue(send_order_confirmation, {'order_id': order.pk},
+            idempotency_key=f'order-confirmation:{order.pk}')
+
+* Uma tarefa que levanta exceção é repetida até `max_attempts` vezes, com
+  espera exponencial (`backoff`, 2 x `backoff`, 4 x `backoff`... até
+  `MAX_BACKOFF`). `PermanentError` desiste na hora.
+* `idempotency_key` é única: enfileirar de novo a mesma chave não faz nada.
+* O worker pega uma tarefa com um `UPDATE` condicional (só vence quem
+  encontrar a tarefa ainda livre) e a guarda por `lease` segundos. Se o
+  worker morrer, a tarefa volta a ficar disponível depois desse prazo; por
+  isso as tarefas devem poder ser executadas mais de uma vez.
+
+O armazenamento da fila é escolhido em `settings.TASK_QUEUE`:
+
+* `DatabaseQueue`: no banco principal, no modelo `Job`. Enfileirar dentro
+  de uma transação é atômico com ela: se ela for desfeita, a tarefa some.
+* `SQLiteQueue`: num arquivo SQLite local em modo WAL, sem tocar no banco
+  principal. A tarefa é gravada depois do commit da transação atual.
+"""
+import datetime
+import json
+import random
+import sqlite3
+import threading
+import time
+from importlib import import_module
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+MAX_BACKOFF = 60 * 60  # Espera máxima entre duas tentativas, em segundos
+
+# Tarefas registradas com `@task`: nome -> Task
+registry = {}
+
+
+class PermanentError(Exception):
+    """Levantada por uma tarefa que não adianta repetir (ex.: pedido inexistente)."""
+
+
+class Task:
+    """Uma função registrada como tarefa, com a sua política de repetição."""
+
+    def __init__(self, func, name, max_attempts, backoff):
+        self.func = func
+        self.name = name
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+
+    def __call__(self, **kwargs):
+        return self.func(**kwargs)
+
+    def retry_delay(self, attempts):
+        """Segundos até a próxima tentativa, depois de `attempts` tentativas."""
+        delay = min(self.backoff * 2 ** (attempts - 1), MAX_BACKOFF)
+        # +-10% para que tarefas que falharam juntas não voltem todas juntas
+        return delay * random.uniform(0.9, 1.1)
+
+
+def task(name=None, max_attempts=5, backoff=30):
+    """Registra a função decorada como tarefa (nome padrão: `módulo.função`)."""
+    def decorator(func):
+        task_name = name or f'{func.__module__}.{func.__name__}'
+        registry[task_name] = Task(func, task_name, max_attempts, backoff)
+        return registry[task_name]
+    return decorator
+
+
+def get_task(name):
+    """A tarefa registrada com `name`, importando os `settings.TASK_MODULES`."""
+    if name not in registry:
+        for module in settings.TASK_MODULES:
+            import_module(module)  # registra as tarefas do módulo
+    return registry[name]
+
+
+class ClaimedJob:
+    """Uma tarefa retirada da fila por um worker."""
+    __slots__ = ('id', 'name', 'payload', 'attempts', 'max_attempts')
+
+    def __init__(self, id, name, payload, attempts, max_attempts):
+        self.id = id
+        self.name = name
+        self.payload = payload
+        self.attempts = attempts  # já contando a execução atual
+        self.max_attempts = max_attempts
+
+    def __repr__(self):
+        return f"<ClaimedJob {self.id}: {self.name}>"
+
+
+class BaseQueue:
+    """
+    Interface comum dos backends: `push`, `claim`, `complete`, `retry`,
+    `fail`, `stats` e `purge`.
+    """
+
+    def __init__(self, lease=300):
+        self.lease = lease
+
+    def push(self, name, payload, idempotency_key, max_attempts, run_at):
+        """Grava a tarefa. Retorna o id, ou None se a chave já existia."""
+        raise NotImplementedError
+
+    def claim(self, limit):
+        """Retira até `limit` tarefas prontas para rodar. Retorna `ClaimedJob`s."""
+        raise NotImplementedError
+
+    def complete(self, job_id):
+        raise NotImplementedError
+
+    def retry(self, job_id, error, run_at):
+        """Devolve a tarefa à fila para nova tentativa em `run_at`."""
+        raise NotImplementedError
+
+    def fail(self, job_id, error):
+        """Marca a tarefa como falha definitiva."""
+        raise NotImplementedError
+
+    def stats(self):
+        """`{situação: quantidade}`."""
+        raise NotImplementedError
+
+    def purge(self, older_than):
+        """Apaga as tarefas concluídas antes de `older_than`. Retorna quantas."""
+        raise NotImplementedError
+
+
+class DatabaseQueue(BaseQueue):
+    """
+    Fila no banco principal (`Job`). No PostgreSQL vários workers buscam
+    tarefas com `SELECT ... FOR UPDATE SKIP LOCKED`, sem disputar as mesmas
+    linhas; em todos os bancos a posse é decidida por um `UPDATE` condicional.
+    """
+
+    def push(self, name, payload, idempotency_key, max_attempts, run_at):
+        try:
+            with transaction.atomic():
+                job = Job.objects.create(
+                    name=name, payload=payload, idempotency_key=idempotency_key,
+                    max_attempts=max_attempts, run_at=run_at,
+                )
+        except IntegrityError:
+            if idempotency_key and Job.objects.filter(idempotency_key=idempotency_key).exists():
+                return None
+            raise
+        return job.pk
+
+    @staticmethod
+    def _ready(now):
+        # Pendentes que já podem rodar, ou em execução por um worker que sumiu
+        return Q(status=Job.PENDING, run_at__lte=now) | Q(status=Job.RUNNING, locked_until__lt=now)
+
+    def claim(self, limit):
+        now = timezone.now()
+        with transaction.atomic():
+            candidates = list(
+                Job.objects.filter(self._ready(now))
+                .order_by('run_at')
+                .select_for_update(skip_locked=connection.features.has_select_for_update_skip_locked)
+                .values_list('pk', 'name', 'payload', 'attempts', 'max_attempts')[:limit]
+            )
+            claimed = []
+            for pk, name, payload, attempts, max_attempts in candidates:
+                won = Job.objects.filter(self._ready(now), pk=pk, attempts=attempts).update(
+                    status=Job.RUNNING,
+                    attempts=F('attempts') + 1,
+                    locked_until=now + datetime.timedelta(seconds=self.lease),
+                )
+                if won:
+                    claimed.append(ClaimedJob(pk, name, payload, attempts + 1, max_attempts))
+        return claimed
+
+    def complete(self, job_id):
+        Job.objects.filter(pk=job_id).update(
+            status=Job.DONE, locked_until=None, finished_at=timezone.now(), last_error='',
+        )
+
+    def retry(self, job_id, error, run_at):
+        Job.objects.filter(pk=job_id).update(status=Job.PENDING, locked_until=None, run_at=run_at, last_error=error)
+
+    def fail(self, job_id, error):
+        Job.objects.filter(pk=job_id).update(
+            status=Job.FAILED, locked_until=None, finished_at=timezone.now(), last_error=error,
+        )
+
+    def stats(self):
+        return dict(Job.objects.order_by().values_list('status').annotate(total=Count('pk')))
+
+    def purge(self, older_than):
+        return Job.objects.filter(status=Job.DONE, finished_at__lt=older_than).delete()[0]
+
+
+class SQLiteQueue(BaseQueue):
+    """
+    Fila num arquivo SQLite local em modo WAL, compartilhado pelos processos
+    da mesma máquina (workers web e `run_worker`). Cada thread usa a sua
+    própria conexão; `claim` roda em `BEGIN IMMEDIATE`, então dois workers
+    nunca pegam a mesma tarefa.
+    """
+
+    def __init__(self, path=None, **options):
+        super().__init__(**options)
+        self.path = str(path or settings.BASE_DIR / 'task_queue.sqlite3')
+        self._local = threading.local()
+        with self._transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " name TEXT NOT NULL,"
+                " payload TEXT NOT NULL,"
+                " idempotency_key TEXT UNIQUE,"
+                " status TEXT NOT NULL DEFAULT 'pending',"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " max_attempts INTEGER NOT NULL,"
+                " run_at REAL NOT NULL,"
+                " locked_until REAL,"
+                " last_error TEXT NOT NULL DEFAULT '',"
+                " created_at REAL NOT NULL,"
+                " finished_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_run_at ON jobs (status, run_at)")
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        return _Transaction(self._connection())
+
+    def push(self, name, payload, idempotency_key, max_attempts, run_at):
+        cursor = self._connection().execute(
+            "INSERT INTO jobs (name, payload, idempotency_key, max_attempts, run_at, created_at)"
+            " VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(idempotency_key) DO NOTHING",
+            (name, json.dumps(payload), idempotency_key, max_attempts, run_at.timestamp(), time.time()),
+        )
+        return cursor.lastrowid if cursor.rowcount == 1 else None
+
+    def claim(self, limit):
+        now = time.time()
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT id, name, payload, attempts, max_attempts FROM jobs"
+                " WHERE (status = 'pending' AND run_at <= ?) OR (status = 'running' AND locked_until < ?)"
+                " ORDER BY run_at LIMIT ?",
+                (now, now, limit),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, locked_until = ? WHERE id = ?",
+                [(now + self.lease, row[0]) for row in rows],
+            )
+        return [ClaimedJob(pk, name, json.loads(payload), attempts + 1, max_attempts)
+                for pk, name, payload, attempts, max_attempts in rows]
+
+    def complete(self, job_id):
+        self._connection().execute(
+            "UPDATE jobs SET status = 'done', locked_until = NULL, finished_at = ?, last_error = '' WHERE id = ?",
+            (time.time(), job_id),
+        )
+
+    def retry(self, job_id, error, run_at):
+        self._connection().execute(
+            "UPDATE jobs SET status = 'pending', locked_until = NULL, run_at = ?, last_error = ? WHERE id = ?",
+            (run_at.timestamp(), error, job_id),
+        )
+
+    def fail(self, job_id, error):
+        self._connection().execute(
+            "UPDATE jobs SET status = 'failed', locked_until = NULL, finished_at = ?, last_error = ? WHERE id = ?",
+            (time.time(), error, job_id),
+        )
+
+    def stats(self):
+        return dict(self._connection().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def purge(self, older_than):
+        return self._connection().execute(
+            "DELETE FROM jobs WHERE status = 'done' AND finished_at < ?", (older_than.timestamp(),)
+        ).rowcount
+
+
+class _Transaction:
+    """Gerenciador de contexto: BEGIN IMMEDIATE / COMMIT (ou ROLLBACK) numa conexão."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    """Retorna (criando na primeira chamada) o backend configurado em `settings.TASK_QUEUE`."""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                config = settings.TASK_QUEUE
+                backend = import_string(config['BACKEND'])
+                _queue = backend(**config.get('OPTIONS', {}))
+    return _queue
+
+
+def enqueue(task_or_name, payload=None, idempotency_key=None, delay=0):
+    """
+    Coloca uma tarefa na fila. `payload` são os argumentos nomeados da
+    tarefa (JSON). Com `idempotency_key`, uma tarefa com a mesma chave já
+    enfileirada faz desta chamada uma operação nula.
+    """
+    target = task_or_name if isinstance(task_or_name, Task) else get_task(task_or_name)
+    payload = payload or {}
+    json.dumps(payload)  # falha aqui, e não no worker, se não for serializável
+    queue = get_queue()
+
+    def push():
+        run_at = timezone.now() + datetime.timedelta(seconds=delay)
+        queue.push(target.name, payload, idempotency_key, target.max_attempts, run_at)
+
+    if isinstance(queue, DatabaseQueue):
+        push()
+    else:
+        # Fora do banco principal: só depois que os dados da transação atual
+        # (ex.: o pedido) estiverem visíveis para o worker.
+        transaction.on_commit(push)
+
+
+async def aenqueue(task_or_name, payload=None, idempotency_key=None, delay=0):
+    """Versão assíncrona de `enqueue`."""
+    await sync_to_async(enqueue)(task_or_name, payload, idempotency_key, delay)
+
+
+def run_job(name, payload):
+    """Executa uma tarefa. Usado pelo worker (inclusive em outro processo)."""
+    get_task(name)(**payload)
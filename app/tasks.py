@@ -0,0 +1,51 @@
+"""
+Tarefas executadas em segundo plano pelo `python manage.py run_worker`
+(veja app/task_queue.py). Os módulos com tarefas são listados em
+`settings.TASK_MODULES`.
+"""
+import json
+import logging
+
+from django.conf import settings
+from django.core.mail import send_mail
+
+from .models import Order
+from .task_queue import PermanentError, task
+
+logger = logging.getLogger(__name__)
+
+
+@task(name='log_api_order')
+def log_api_order(order):
+    """Registra um pedido recebido pela API JSON (`order` é o dicionário do pedido)."""
+    logger.info(
+        "Pedido #%s recebido (cliente: %s): %s",
+        order['order_number'], order['customer']['name'], json.dumps(order, ensure_ascii=False),
+    )
+
+
+@task(name='send_order_confirmation', max_attempts=8, backoff=60)
+def send_order_confirmation(order_id):
+    """Envia o e-mail de confirmação de um pedido da vitrine."""
+    try:
+        order = Order.objects.select_related('customer__user').get(pk=order_id)
+    except Order.DoesNotExist:
+        raise PermanentError(f"Pedido {order_id} não existe")
+    customer = order.customer
+    email = customer and (customer.email or (customer.user and customer.user.email))
+    if not email:
+        return  # cliente sem e-mail: nada a enviar
+    lines = [
+        f"{item.quantity} x {item.product.name if item.product else 'Produto removido'}"
+        for item in order.orderitem_set.select_related('product')
+    ]
+    send_mail(
+        subject=f"Pedido #{order.pk} confirmado",
+        message=(
+            f"Olá, {customer.name or customer}!\n\n"
+            f"Recebemos o seu pedido #{order.pk}:\n\n" + "\n".join(lines) +
+            f"\n\nTotal: R$ {order.total_amount}\n"
+        ),
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        recipient_list=[email],
+    )
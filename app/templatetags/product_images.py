@@ -0,0 +1,58 @@
+"""
+Tags de template para as miniaturas de produto (veja app/images.py).
+
+    {% load product_images %}
+    {% product_picture product 'card' sizes='(min-width: 1024px) 25vw, 100vw' class='w-full h-48 object-cover' %}
+
+Funciona com um `Product` ou com um `ProductSnapshot` do carrinho. Enquanto
+as miniaturas não tiverem sido geradas, usa a imagem original.
+"""
+from django import template
+from django.utils.html import format_html
+
+from ..images import RENDITIONS, rendition_url
+
+register = template.Library()
+
+
+def _original_url(product):
+    # ProductSnapshot guarda a URL pronta; Product tem o campo de imagem
+    url = getattr(product, 'image_url', None)
+    if url is None and product.image:
+        url = product.image.url
+    return url or ''
+
+
+@register.simple_tag
+def rendition_srcset(product, rendition, ext='webp'):
+    """O atributo `srcset` (`url 320w, url 640w`) de uma rendition do produto."""
+    image_hash = getattr(product, 'image_hash', '')
+    if not image_hash:
+        return ''
+    widths = RENDITIONS[rendition][0]
+    return ', '.join(f'{rendition_url(image_hash, rendition, width, ext)} {width}w' for width in widths)
+
+
+@register.simple_tag
+def product_picture(product, rendition, sizes='100vw', **attrs):
+    """
+    Um `<picture>` com WebP e JPEG em vários tamanhos para o navegador
+    escolher. Atributos extras (`class`, `loading`...) vão para o `<img>`.
+    """
+    attrs.setdefault('loading', 'lazy')
+    extra = format_html(''.join(f' {key}="{{}}"' for key in attrs), *attrs.values())
+    image_hash = getattr(product, 'image_hash', '')
+    if not image_hash:
+        return format_html('<img src="{}" alt="{}"{}>', _original_url(product), product.name, extra)
+
+    widths = RENDITIONS[rendition][0]
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" alt="{}"{}>'
+        '</picture>',
+        rendition_srcset(product, rendition, 'webp'), sizes,
+        rendition_url(image_hash, rendition, widths[0], 'jpg'),
+        rendition_srcset(product, rendition, 'jpg'), sizes,
+        product.name, extra,
+    )
@@ -0,0 +1,24 @@
+"""
+Tag de template do botão "Adicionar" dos cards, com a situação do estoque
+(veja app/stock.py).
+
+    {% load product_stock %}
+    {% stock_status product %}
+
+Na grade em cache da vitrine (`stock_placeholder` no contexto) deixa um
+marcador, preenchido a cada requisição por app/catalog.py. Nas outras
+páginas usa `stock_available` (`{product_id: disponível}`, de
+`get_available`) do contexto; sem ele mostra apenas o botão.
+"""
+from django import template
+
+from ..catalog import STOCK_PLACEHOLDER, render_stock_status
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def stock_status(context, product):
+    if context.get('stock_placeholder'):
+        return STOCK_PLACEHOLDER.format(product.id)
+    return render_stock_status((context.get('stock_available') or {}).get(product.id))
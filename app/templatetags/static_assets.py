@@ -0,0 +1,39 @@
+"""
+Tags de template dos arquivos estáticos (veja app/static_assets.py).
+
+    {% load static_assets %}
+    {% tailwind_css %}
+
+Usa o CSS do Tailwind gerado por `python manage.py build_css`
+(`settings.TAILWIND_CSS`) quando ele existe, e o script do CDN do Tailwind
+(que gera o CSS no navegador) quando não.
+"""
+import functools
+
+from django import template
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.templatetags.static import static
+from django.utils.html import format_html
+
+register = template.Library()
+
+TAILWIND_CDN = 'https://cdn.tailwindcss.com'
+
+
+@functools.lru_cache(maxsize=None)
+def _tailwind_build():
+    """Nome do CSS compilado, se ele existir (verificado uma vez por processo)."""
+    name = settings.TAILWIND_CSS
+    if name and (finders.find(name) or staticfiles_storage.exists(name)):
+        return name
+    return None
+
+
+@register.simple_tag
+def tailwind_css():
+    name = _tailwind_build()
+    if name:
+        return format_html('<link rel="stylesheet" href="{}">', static(name))
+    return format_html('<script src="{}"></script>', TAILWIND_CDN)
@@ -1,3 +1,1390 @@
-from django.test import TestCase
+import csv
+import datetime
+import gzip
+import io
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import F, QuerySet
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path, reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import api, hashers, images, task_queue, views
+from .api import catalog
+from .admin import EstimatedCountPaginator
+from .api_storage import CartConflict, DatabaseApiStore, MemoryApiStore, SQLiteApiStore, UnknownProduct
+from .cart import snapshot_cache
+from .cart_storage import decode_cart, encode_cart, legacy_cart
+from .catalog import get_catalog_version, normalize_cursor, render_product_grid
+from .db_router import STICKY_COOKIE, PrimaryReplicaRouter
+from .exports import iter_export, parse_period
+from .hashers import TunedScryptPasswordHasher
+from .json_catalog import JsonCatalog
+from .management.commands.bench_storefront import Command as BenchStorefrontCommand
+from .management.commands.run_worker import Command as RunWorkerCommand
+from .models import Customer, Job, Order, OrderItem, Product, StockReservation
+from .pagination import decode_cursor, encode_cursor, paginate_keyset
+from .ratelimit import LocMemRateLimitStore, get_rate_limit_store, parse_rate
+from .search import filter_products, rebuild_search_index, search_products
+from .static_assets import ENCODINGS, IMMUTABLE, compress_file
+from .stock import InsufficientStock, ReservationConflict, release_expired, reserve_stock, take_reservations
+from .task_queue import DatabaseQueue, PermanentError, enqueue, run_job, task
+
+
+def reset_caches():
+    # Os ids se repetem entre testes (cada um é desfeito): nada de cache velho
+    cache.clear()
+    snapshot_cache.clear()
+    get_rate_limit_store().clear()
+
+
+def create_product(name='Produto', price='10.00', stock=10):
+    return Product.objects.create(name=name, price=Decimal(price), stock=stock)
+
+
+@override_settings(QUERY_BUDGET_STRICT=True)
+class QueryBudgetTests(TestCase):
+    """
+    As views principais dentro de `VIEW_QUERY_BUDGETS`: com
+    `QUERY_BUDGET_STRICT` uma consulta a mais levanta `QueryBudgetExceeded`
+    e o teste falha (veja app/instrumentation.py).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = [create_product(f'Produto {i}') for i in range(3)]
+
+    def setUp(self):
+        reset_caches()
+
+    def add(self, product):
+        return self.client.post(reverse('add_to_cart', args=[product.pk]))
+
+    def test_product_list(self):
+        self.add(self.products[0])
+        self.assertEqual(self.client.get(reverse('product_list')).status_code, 200)
+        # Segunda visita: a grade vem do cache
+        self.assertEqual(self.client.get(reverse('product_list')).status_code, 200)
+
+    def test_cart_views(self):
+        for product in self.products:
+            self.assertEqual(self.add(product).status_code, 302)
+        product = self.products[0]
+        self.assertEqual(self.client.post(reverse('update_cart', args=[product.pk, 'increase'])).status_code, 302)
+        self.assertEqual(self.client.post(reverse('update_cart', args=[product.pk, 'decrease'])).status_code, 302)
+        self.assertEqual(self.client.post(reverse('remove_from_cart', args=[product.pk])).status_code, 302)
+
+    def test_checkout(self):
+        for product in self.products:
+            self.add(product)
+        self.assertEqual(self.client.get(reverse('checkout')).status_code, 200)
+        response = self.client.post(reverse('checkout'), {
+            'name': 'Ana', 'email': 'ana@example.com', 'address': 'Rua 1',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Order.objects.count(), 1)
+
+
+# DATABASE_ROUTERS=[]: com DB_SIMULATE_REPLICA=True a réplica de teste (TEST
+# MIRROR) é outra conexão, que não vê os dados criados na transação do
+# TestCase; a vitrine (`@use_read_replica`) fica no primário.
+@override_settings(REQUEST_METRICS_HEADERS=False, DATABASE_ROUTERS=[])
+class ServerTimingTests(TestCase):
+
+    def get(self, client=None):
+        return (client or self.client).get(reverse('product_list'))
+
+    def test_hidden_from_visitors(self):
+        self.assertNotIn('Server-Timing', self.get())
+
+    def test_sent_to_staff(self):
+        self.client.force_login(User.objects.create_user('equipe', 'equipe@example.com', 'x', is_staff=True))
+        self.assertIn('db;dur=', self.get()['Server-Timing'])
+
+    def test_sent_to_everyone_when_enabled(self):
+        with self.settings(REQUEST_METRICS_HEADERS=True):
+            self.assertIn('total;dur=', self.get()['Server-Timing'])
+
+    async def test_async_hidden_from_visitors(self):
+        response = await self.async_client.get(reverse('product_list'))
+        self.assertNotIn('Server-Timing', response)
+
+    async def test_async_sent_to_staff(self):
+        user = await User.objects.acreate(username='equipe', is_staff=True)
+        await self.async_client.aforce_login(user)
+        response = await self.async_client.get(reverse('product_list'))
+        self.assertIn('Server-Timing', response)
+
+
+class KeysetPaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(7):
+            create_product(f'Produto {i}')
+        # Vários produtos criados no mesmo instante: o id desempata
+        Product.objects.filter(pk__in=list(Product.objects.values_list('pk', flat=True)[:4])).update(
+            created_at=timezone.now(),
+        )
+
+    def test_pages_cover_every_product_once(self):
+        seen = []
+        cursor = None
+        while True:
+            page = paginate_keyset(Product.objects.all(), cursor=cursor, per_page=3)
+            seen.extend(product.pk for product in page)
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        expected = list(Product.objects.order_by('-created_at', '-id').values_list('pk', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_cursor_round_trip(self):
+        created_at = timezone.now()
+        self.assertEqual(decode_cursor(encode_cursor(created_at, 42)), (created_at, 42))
+
+    def test_invalid_cursor_is_the_first_page(self):
+        first = paginate_keyset(Product.objects.all(), per_page=3)
+        for cursor in ['não-é-um-cursor', 'eHl6', encode_cursor(timezone.now(), 1)[:-3]]:
+            page = paginate_keyset(Product.objects.all(), cursor=cursor, per_page=3)
+            self.assertTrue(page.is_first)
+            self.assertEqual([p.pk for p in page], [p.pk for p in first])
+
+
+@override_settings(CATALOG_PAGE_SIZE=2, CATALOG_CACHED_PAGES=2)
+class ProductGridCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(7):
+            create_product(f'Produto {i}')
+
+    def setUp(self):
+        reset_caches()
+        self.version = get_catalog_version()
+
+    def cached_keys(self):
+        return [key for key in cache._cache if f'catalog:{self.version}:' in key]
+
+    def next_cursor(self, cursor=None):
+        return paginate_keyset(Product.objects.all(), cursor=cursor, per_page=2).next_cursor
+
+    def test_issued_cursors_are_cached_up_to_the_limit(self):
+        render_product_grid()
+        second = self.next_cursor()
+        third = self.next_cursor(second)
+        self.assertEqual(normalize_cursor(second), second)
+        before = len(self.cached_keys())
+        render_product_grid(second)
+        self.assertGreater(len(self.cached_keys()), before)
+        # A página 3 passa do limite: renderizada, mas sem entrar no cache
+        before = len(self.cached_keys())
+        self.assertIn('Produto', render_product_grid(third))
+        self.assertEqual(len(self.cached_keys()), before)
+
+    def test_unknown_cursors_add_no_keys(self):
+        first = render_product_grid()
+        before = len(self.cached_keys())
+        # Inválido vira a primeira página; válido mas não emitido fica fora do cache
+        self.assertEqual(render_product_grid('lixo-aleatorio'), first)
+        render_product_grid(encode_cursor(timezone.now(), 12345))
+        self.assertEqual(len(self.cached_keys()), before)
+
+
+class ApiStoreTests(TestCase):
+
+    def post_cart(self, user_id, data):
+        return self.client.post(f'/api/cart/{user_id}/', json.dumps(data), content_type='application/json')
+
+    def test_unknown_product_is_not_found(self):
+        response = self.post_cart(103, {'product_id': -1})
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('error', response.json())
+
+    def test_known_product_is_added(self):
+        product_id = next(iter(catalog.current().by_id))
+        response = self.post_cart(104, {'product_id': product_id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['cart'][0]['quantity'], 1)
+
+    def test_database_store_rejects_unknown_products(self):
+        product = create_product()
+        store = DatabaseApiStore()
+        with self.assertRaises(UnknownProduct) as ctx:
+            store.save_cart(1, {product.pk: 1, -1: 2})
+        self.assertEqual(ctx.exception.product_ids, {-1})
+        self.assertFalse(Order.objects.exists())
+
+    def test_database_store_cart_round_trip(self):
+        product = create_product(price='7.50')
+        store = DatabaseApiStore()
+        version = store.save_cart(1, {product.pk: 2})
+        self.assertEqual(store.get_versioned_cart(1), ({product.pk: 2}, version))
+
+        store.place_order(1, {
+            'order_number': 1001,
+            'customer': {'name': 'Ana', 'email': 'ana@example.com'},
+            'items': [{'id': product.pk, 'price': 7.5}],
+        }, version=version)
+
+        order = Order.objects.get()
+        self.assertTrue(order.complete)
+        self.assertEqual(order.transaction_id, '1001')
+        self.assertEqual(order.total_amount, Decimal('15.00'))
+        self.assertEqual(store.get_cart(1), {})
+
+    def test_open_api_carts_are_hidden_in_admin(self):
+        product = create_product()
+        DatabaseApiStore().save_cart(1, {product.pk: 1})
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'x'))
+        response = self.client.get(reverse('admin:app_order_changelist'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['cl'].result_list), [])
+
+
+class ProductsEndpointTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / 'products.json'
+        self.write([{'id': 1, 'name': 'Caneca', 'price': 10}])
+        patcher = mock.patch.object(api, 'catalog', JsonCatalog(self.path))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write(self, products):
+        self.path.write_text(json.dumps(products), encoding='utf-8')
+        # Garante um mtime diferente mesmo em sistemas de arquivos com pouca resolução
+        stat = self.path.stat()
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    def get(self, **headers):
+        return self.client.get(reverse('api_products'), headers=headers)
+
+    def test_etag_and_not_modified(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['products'][0]['name'], 'Caneca')
+        etag = response['ETag']
+
+        response = self.get(if_none_match=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_rewritten_file_is_reloaded(self):
+        etag = self.get()['ETag']
+        self.write([{'id': 1, 'name': 'Caneca azul', 'price': 12}])
+
+        response = self.get(if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['products'][0]['name'], 'Caneca azul')
+
+
+class CheckoutTests(TestCase):
+
+    def setUp(self):
+        reset_caches()
+        self.mug = create_product('Caneca', '10.00', stock=5)
+        self.shirt = create_product('Camiseta', '40.00', stock=3)
+
+    def add(self, product):
+        self.client.post(reverse('add_to_cart', args=[product.pk]))
+
+    def checkout(self):
+        return self.client.post(reverse('checkout'), {
+            'name': 'Ana', 'email': 'Ana@Example.com', 'address': 'Rua 1',
+        })
+
+    def test_order_items_and_stock(self):
+        self.add(self.mug)
+        self.add(self.mug)
+        self.add(self.shirt)
+
+        self.assertRedirects(self.checkout(), reverse('product_list'), fetch_redirect_response=False)
+
+        order = Order.objects.get()
+        self.assertTrue(order.complete)
+        self.assertEqual(order.customer.email, 'ana@example.com')
+        self.assertEqual(
+            sorted(order.orderitem_set.values_list('product_id', 'quantity', 'unit_price')),
+            sorted([(self.mug.pk, 2, Decimal('10.00')), (self.shirt.pk, 1, Decimal('40.00'))]),
+        )
+        self.mug.refresh_from_db()
+        self.shirt.refresh_from_db()
+        self.assertEqual((self.mug.stock, self.mug.reserved), (3, 0))
+        self.assertEqual((self.shirt.stock, self.shirt.reserved), (2, 0))
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertTrue(Job.objects.filter(idempotency_key=f'order-confirmation:{order.pk}').exists())
+
+    def test_insufficient_stock_changes_nothing(self):
+        self.add(self.mug)
+        self.add(self.shirt)
+        Product.objects.filter(pk=self.mug.pk).update(stock=0)  # ex.: acertado no admin
+
+        self.assertRedirects(self.checkout(), reverse('checkout'), fetch_redirect_response=False)
+
+        self.assertFalse(Order.objects.exists())
+        self.shirt.refresh_from_db()
+        self.assertEqual((self.shirt.stock, self.shirt.reserved), (3, 1))
+
+    def test_order_totals(self):
+        self.add(self.mug)
+        self.add(self.mug)
+        self.add(self.shirt)
+        self.checkout()
+
+        order = Order.objects.get()
+        self.assertEqual((order.total_amount, order.item_count), (Decimal('60.00'), 3))
+        # Pedido finalizado: os totais vêm das colunas, sem consultar os itens
+        with self.assertNumQueries(0):
+            self.assertEqual((order.get_cart_total, order.get_cart_items), (Decimal('60.00'), 3))
+
+    def test_charges_database_price_not_cached_snapshot(self):
+        self.add(self.mug)
+        self.client.get(reverse('checkout'))  # snapshot em cache com o preço antigo
+        # `update` não dispara sinais: o snapshot continua com R$ 10,00
+        Product.objects.filter(pk=self.mug.pk).update(price=Decimal('12.50'))
+
+        self.checkout()
+
+        order = Order.objects.get()
+        self.assertEqual(order.orderitem_set.get().unit_price, Decimal('12.50'))
+        self.assertEqual(order.total_amount, Decimal('12.50'))
+
+
+@override_settings(RATE_LIMITS={})
+class BenchStorefrontTests(TestCase):
+
+    def setUp(self):
+        reset_caches()
+        self.command = BenchStorefrontCommand(stdout=io.StringIO(), stderr=io.StringIO())
+        self.command.iterations = 2
+        self.command.cart_width = 2
+
+    def test_scenarios(self):
+        self.command.seed_catalog(30)
+        results = self.command.run_scenarios()
+        self.assertIn('product_list_page_10', results)
+        self.assertIn('api_checkout', results)
+        for data in results.values():
+            self.assertLessEqual(data['p50_ms'], data['p95_ms'])
+        self.assertLessEqual(results['product_list']['queries'], settings.VIEW_QUERY_BUDGETS['product_list'])
+
+    def test_baseline_comparison(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        baseline = Path(directory.name) / 'bench.json'
+        old = {'p50_ms': 1.0, 'p95_ms': 2.0, 'mean_ms': 1.0, 'queries': 3}
+        baseline.write_text(json.dumps({'results': {'10': {'product_list': old}}}))
+
+        self.command.compare({'10': {'product_list': dict(old, p95_ms=2.2)}}, baseline, tolerance=0.2)
+        with self.assertRaises(CommandError):
+            self.command.compare({'10': {'product_list': dict(old, p95_ms=3.0)}}, baseline, tolerance=0.2)
+        with self.assertRaises(CommandError):
+            self.command.compare({'10': {'product_list': dict(old, queries=4)}}, baseline, tolerance=0.2)
+
+
+# Rotas com as views assíncronas, como em app/urls.py com ASYNC_VIEWS = True
+# (usadas com `ROOT_URLCONF=__name__`)
+urlpatterns = [
+    path('', views.aproduct_list, name='product_list'),
+    path('add-to-cart/<int:product_id>/', views.aadd_to_cart, name='add_to_cart'),
+    path('update-cart/<int:product_id>/<str:action>/', views.aupdate_cart, name='update_cart'),
+    path('remove-from-cart/<int:product_id>/', views.aremove_from_cart, name='remove_from_cart'),
+    path('cart/batch/', views.acart_batch, name='cart_batch'),
+    path('api/products/', api.aget_products, name='api_products'),
+    path('api/cart/<int:user_id>/', api.acart, name='api_cart'),
+    path('api/checkout/<int:user_id>/', api.acheckout, name='api_checkout'),
+    path('', include('app.urls')),
+]
+
+
+@override_settings(ROOT_URLCONF=__name__, DATABASE_ROUTERS=[])  # veja ServerTimingTests
+class AsyncViewTests(TestCase):
+
+    def setUp(self):
+        reset_caches()
+        self.product = create_product('Caneca', '10.00', stock=5)
+        self.api_product_id = next(iter(catalog.current().by_id))
+
+    async def add(self):
+        return await self.async_client.post(reverse('add_to_cart', args=[self.product.pk]))
+
+    async def cart(self):
+        response = await self.async_client.post(reverse('cart_batch'), {'ops': []}, content_type='application/json')
+        return {item['product_id']: item['quantity'] for item in response.json()['items']}
+
+    async def test_product_list(self):
+        response = await self.async_client.get(reverse('product_list'))
+        self.assertIs(response.resolver_match.func, views.aproduct_list)
+        self.assertContains(response, 'Caneca')
+
+    async def test_add_update_and_remove(self):
+        self.assertEqual((await self.add()).status_code, 302)
+        await self.async_client.post(reverse('update_cart', args=[self.product.pk, 'increase']))
+        self.assertEqual(await self.cart(), {self.product.pk: 2})
+        await self.async_client.post(reverse('remove_from_cart', args=[self.product.pk]))
+        self.assertEqual(await self.cart(), {})
+        self.assertFalse(await StockReservation.objects.aexists())
+
+    async def test_cart_batch(self):
+        response = await self.async_client.post(reverse('cart_batch'), {
+            'ops': [{'op': 'set', 'product_id': self.product.pk, 'quantity': 3}],
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 3)
+
+    async def test_api_products(self):
+        response = await self.async_client.get(reverse('api_products'))
+        self.assertEqual(response.status_code, 200)
+        response = await self.async_client.get(reverse('api_products'), headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    async def test_api_cart(self):
+        url = reverse('api_cart', args=[201])
+        response = await self.async_client.post(url, {'product_id': self.api_product_id}, content_type='application/json')
+        self.assertEqual(response.json()['cart'][0]['quantity'], 1)
+        response = await self.async_client.post(url, {'product_id': -1}, content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+        response = await self.async_client.delete(url, {'product_id': self.api_product_id}, content_type='application/json')
+        self.assertEqual(response.json()['cart'], [])
+
+    async def test_api_checkout(self):
+        await self.async_client.post(reverse('api_cart', args=[202]), {'product_id': self.api_product_id},
+                                     content_type='application/json')
+        response = await self.async_client.post(reverse('api_checkout', args=[202]), {
+            'name': 'Ana', 'email': 'ana@example.com', 'address': 'Rua 1', 'payment_method': 'pix',
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['success'])
+        self.assertTrue(await Job.objects.filter(idempotency_key__startswith='log-order:202:').aexists())
+
+    async def test_api_invalid_requests(self):
+        url = reverse('api_cart', args=[203])
+        response = await self.async_client.post(url, 'não é json', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual((await self.async_client.put(url)).status_code, 405)
+        response = await self.async_client.post(reverse('api_checkout', args=[203]), {'name': 'Ana'},
+                                                content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class SearchTests(TestCase):
+    """Busca pelo índice FTS5 do SQLite (no PostgreSQL, o índice GIN da migração 0006)."""
+
+    def setUp(self):
+        self.coffee = Product.objects.create(
+            name='Café especial', description='Grãos torrados do cerrado', price=Decimal('30.00'), stock=1,
+        )
+        self.mug = Product.objects.create(
+            name='Caneca', description='Caneca para café', price=Decimal('20.00'), stock=1,
+        )
+
+    def names(self, term, **kwargs):
+        return [product.name for product in search_products(term, **kwargs)]
+
+    def test_found_after_save(self):
+        # Sem acento e por prefixo, no nome e na descrição
+        self.assertCountEqual(self.names('cafe'), ['Café especial', 'Caneca'])
+        self.assertEqual(self.names('torrad'), ['Café especial'])
+
+        self.mug.name = 'Xícara'
+        self.mug.description = 'Porcelana'
+        self.mug.save()
+        self.assertEqual(self.names('cafe'), ['Café especial'])
+        self.assertEqual(self.names('xicara'), ['Xícara'])
+
+        self.coffee.delete()
+        self.assertEqual(self.names('cafe'), [])
+
+    def test_pages_and_operators(self):
+        page = search_products('cafe', per_page=1)
+        self.assertEqual((len(page), page.has_next), (1, True))
+        self.assertFalse(search_products('cafe', page=2, per_page=1).has_next)
+        # Aspas e operadores do FTS5 são tratados como texto
+        self.assertEqual(self.names('"café" OR'), [])
+        self.assertEqual(self.names('   '), [])
+
+    def test_rebuild_after_bulk_update(self):
+        Product.objects.filter(pk=self.mug.pk).update(name='Garrafa')  # sem sinais
+        self.assertEqual(self.names('garrafa'), [])
+        rebuild_search_index()
+        self.assertEqual(self.names('garrafa'), ['Garrafa'])
+
+    def test_filter_products_and_admin_search(self):
+        self.assertEqual(list(filter_products(Product.objects.all(), 'torrados')), [self.coffee])
+        self.assertEqual(filter_products(Product.objects.all(), '').count(), 2)
+
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'x'))
+        response = self.client.get(reverse('admin:app_product_changelist'), {'q': 'cerrado'})
+        self.assertEqual(list(response.context['cl'].result_list), [self.coffee])
+
+
+def image_upload(color='red', name='foto.png'):
+    buffer = io.BytesIO()
+    Image.new('RGB', (40, 30), color).save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+@override_settings(IMAGE_WORKERS=0)
+class ProductImageTests(TestCase):
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_settings = self.settings(MEDIA_ROOT=Path(media.name))
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+    def create(self, image):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(name='Caneca', price=Decimal('10.00'), image=image)
+        return Product.objects.get(pk=product.pk)
+
+    def test_renditions_are_generated(self):
+        product = self.create(image_upload())
+        self.assertTrue(product.image_hash)
+        for rendition, (widths, _) in images.RENDITIONS.items():
+            for width in widths:
+                for ext in images.FORMATS:
+                    self.assertTrue(default_storage.exists(images.rendition_name(product.image_hash, rendition, width, ext)))
+
+    def test_unchanged_image_is_not_processed_again(self):
+        product = self.create(image_upload())
+        with mock.patch('app.signals.schedule_product_image') as schedule:
+            with self.captureOnCommitCallbacks(execute=True):
+                product.name = 'Caneca azul'
+                product.save()
+                Product.objects.only('id', 'name').get(pk=product.pk).save()
+            schedule.assert_not_called()
+
+            with self.captureOnCommitCallbacks(execute=True):
+                product.image = image_upload('blue', 'outra.png')
+                product.save()
+            schedule.assert_called_once_with(product.pk)
+
+    def test_same_content_keeps_hash(self):
+        product = self.create(image_upload())
+        with mock.patch('app.catalog.bump_catalog_version') as bump:
+            images.process_product_image(product.pk)
+        bump.assert_not_called()
+
+    @override_settings(IMAGE_WORKERS=1)
+    def test_unexpected_errors_are_logged(self):
+        executor_patch = mock.patch.object(images, '_executor', None)
+        executor_patch.start()
+        self.addCleanup(executor_patch.stop)
+        with mock.patch('app.images.process_product_image', side_effect=RuntimeError('falhou')), \
+                self.assertLogs('app.images', 'ERROR') as logs:
+            future = images.schedule_product_image(42)
+            # Espera também o callback, que roda na thread do pool
+            images._executor.shutdown(wait=True)
+        self.assertIsInstance(future.exception(), RuntimeError)
+        self.assertIn('produto 42', logs.output[0])
+
+
+class CartCodecTests(TestCase):
+
+    def test_round_trip(self):
+        quantities = {3: 1, 70000: 2, 1: 300}
+        data = encode_cart(quantities)
+        self.assertEqual(decode_cart(data), quantities)
+        self.assertEqual(list(decode_cart(data)), [1, 3, 70000])
+
+    def test_invalid_data_is_an_empty_cart(self):
+        data = encode_cart({5: 2, 900: 1})
+        self.assertEqual(decode_cart(data[:-1]), {})  # truncado
+        self.assertEqual(decode_cart(b'\x09' + data[1:]), {})  # outra versão
+        self.assertEqual(decode_cart(b''), {})
+        self.assertEqual(decode_cart(encode_cart({})), {})
+
+    def test_cart_survives_requests(self):
+        reset_caches()
+        product = create_product()
+        self.client.post(reverse('add_to_cart', args=[product.pk]))
+        self.client.post(reverse('update_cart', args=[product.pk, 'increase']))
+        response = self.client.get(reverse('checkout'))
+        self.assertEqual(response.context['cart_items'][0]['quantity'], 2)
+
+    def test_legacy_session_cart_is_migrated(self):
+        reset_caches()
+        product = create_product()
+        session = self.client.session
+        session['cart'] = {str(product.pk): {'quantity': 3}, 'x': {'quantity': 1}, '7': {}}
+        session.save()
+
+        response = self.client.get(reverse('checkout'))
+
+        self.assertEqual(response.context['cart_items'][0]['quantity'], 3)
+        self.assertNotIn('cart', self.client.session)
+        self.assertIn('cart', response.cookies)
+
+    def test_legacy_cart_parsing(self):
+        self.assertEqual(legacy_cart({'1': {'quantity': 2}, '2': {'quantity': 0}, 'x': {'quantity': 1}}), {1: 2})
+        self.assertEqual(legacy_cart(None), {})
+        self.assertEqual(legacy_cart(['1']), {})
+
+
+class CartBatchTests(TestCase):
+
+    def setUp(self):
+        reset_caches()
+        self.mug = create_product('Caneca', '10.00', stock=5)
+        self.shirt = create_product('Camiseta', '40.00', stock=2)
+        self.client.post(reverse('add_to_cart', args=[self.mug.pk]))
+
+    def batch(self, *ops):
+        return self.client.post(reverse('cart_batch'), {'ops': list(ops)}, content_type='application/json')
+
+    def cart(self):
+        return self.client.get(reverse('checkout')).context['cart_items']
+
+    def test_applies_all_operations(self):
+        response = self.batch(
+            {'op': 'add', 'product_id': self.mug.pk, 'quantity': 2},
+            {'op': 'set', 'product_id': self.shirt.pk, 'quantity': 2},
+        )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual((data['count'], data['total_price']), (5, '110.00'))
+        self.assertIn('Camiseta', data['html'])
+        self.shirt.refresh_from_db()
+        self.assertEqual(self.shirt.reserved, 2)
+
+        response = self.batch({'op': 'remove', 'product_id': self.shirt.pk})
+        self.assertEqual(response.json()['count'], 3)
+
+    def test_invalid_operation_rejects_the_whole_batch(self):
+        response = self.batch(
+            {'op': 'set', 'product_id': self.shirt.pk, 'quantity': 1},
+            {'op': 'set', 'product_id': self.mug.pk, 'quantity': -1},
+            {'op': 'add', 'product_id': -5},
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(response.json()['errors']), 1)
+        self.assertEqual([item['quantity'] for item in self.cart()], [1])
+
+        response = self.batch(
+            {'op': 'set', 'product_id': self.shirt.pk, 'quantity': 1},
+            {'op': 'add', 'product_id': 999999},
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'], ['Produto 999999 não encontrado.'])
+        self.assertEqual(response.json()['count'], 1)
+        self.shirt.refresh_from_db()
+        self.assertEqual(self.shirt.reserved, 0)
+
+    def test_insufficient_stock_rejects_the_whole_batch(self):
+        response = self.batch(
+            {'op': 'set', 'product_id': self.mug.pk, 'quantity': 2},
+            {'op': 'set', 'product_id': self.shirt.pk, 'quantity': 3},
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Camiseta', response.json()['errors'][0])
+        self.assertEqual([item['quantity'] for item in self.cart()], [1])
+        self.mug.refresh_from_db()
+        self.shirt.refresh_from_db()
+        self.assertEqual((self.mug.reserved, self.shirt.reserved), (1, 0))
+
+    def test_invalid_body(self):
+        self.assertEqual(self.client.post(reverse('cart_batch'), 'x', content_type='application/json').status_code, 400)
+        self.assertEqual(self.batch().status_code, 400)
+        self.assertEqual(self.client.get(reverse('cart_batch')).status_code, 405)
+
+
+class ApiCartVersionTests(TestCase):
+
+    def setUp(self):
+        self.product_id = next(iter(catalog.current().by_id))
+
+    def post(self, user_id, data, **headers):
+        return self.client.post(f'/api/cart/{user_id}/', json.dumps(data), content_type='application/json', **headers)
+
+    def test_stale_version_is_a_conflict(self):
+        response = self.post(101, {'product_id': self.product_id})
+        version = response.json()['version']
+        self.assertEqual(response['ETag'], f'"{version}"')
+        self.post(101, {'product_id': self.product_id})  # outra aba
+
+        response = self.post(101, {'product_id': self.product_id, 'version': version})
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['cart'][0]['quantity'], 2)
+        self.assertNotEqual(response.json()['version'], version)
+
+    def test_if_match_header(self):
+        version = self.post(105, {'product_id': self.product_id}).json()['version']
+        response = self.post(105, {'product_id': self.product_id}, headers={'If-Match': f'"{version}"'})
+        self.assertEqual(response.status_code, 200)
+        response = self.post(105, {'product_id': self.product_id}, headers={'If-Match': f'"{version}"'})
+        self.assertEqual(response.status_code, 409)
+
+    def test_checkout_with_stale_version(self):
+        version = self.post(102, {'product_id': self.product_id}).json()['version']
+        self.post(102, {'product_id': self.product_id})
+        response = self.client.post('/api/checkout/102/', json.dumps({
+            'name': 'Ana', 'email': 'ana@example.com', 'address': 'Rua 1', 'payment_method': 'pix',
+        }), content_type='application/json', headers={'If-Match': f'"{version}"'})
+        self.assertEqual(response.status_code, 409)
+
+    def assert_compare_and_swap(self, store, product_id=10):
+        version = store.save_cart(1, {product_id: 1})
+        store.save_cart(1, {product_id: 2}, version=version)
+        with self.assertRaises(CartConflict) as ctx:
+            store.save_cart(1, {product_id: 5}, version=version)
+        self.assertEqual(ctx.exception.quantities, {product_id: 2})
+        # Sem versão, a alteração é reaplicada sobre o estado atual
+        quantities, _ = store.update_cart(1, lambda q: q.update({product_id: q[product_id] + 1}))
+        self.assertEqual(quantities, {product_id: 3})
+
+    def test_memory_store_compare_and_swap(self):
+        self.assert_compare_and_swap(MemoryApiStore())
+
+    def test_sqlite_store_compare_and_swap(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.assert_compare_and_swap(SQLiteApiStore(path=Path(directory.name) / 'api.sqlite3'))
+
+    def test_database_store_compare_and_swap(self):
+        self.assert_compare_and_swap(DatabaseApiStore(), product_id=create_product().pk)
+
+
+class ExportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        customer = Customer.objects.create(name='=HYPERLINK("http://x")', email='ana@example.com')
+        product = create_product('-Caneca')
+        cls.order = Order.objects.create(
+            customer=customer, complete=True, transaction_id='A1', total_amount=Decimal('20.00'), item_count=2,
+        )
+        OrderItem.objects.create(order=cls.order, product=product, quantity=2, unit_price=Decimal('10.00'))
+        Order.objects.create(customer=customer, complete=False, transaction_id='aberto')
+
+    def export(self, kind, fmt, **kwargs):
+        return ''.join(iter_export(kind, fmt, **kwargs))
+
+    def test_csv(self):
+        rows = list(csv.reader(io.StringIO(self.export('orders', 'csv'))))
+        self.assertEqual(rows[0][:3], ['order_id', 'date_ordered', 'transaction_id'])
+        self.assertEqual(len(rows), 2)  # só pedidos finalizados
+        row = dict(zip(rows[0], rows[1]))
+        self.assertEqual((row['transaction_id'], row['total_amount']), ('A1', '20.00'))
+        # Textos que a planilha leria como fórmula
+        self.assertEqual(row['customer_name'], '\'=HYPERLINK("http://x")')
+
+        rows = list(csv.reader(io.StringIO(self.export('items', 'csv'))))
+        self.assertEqual(dict(zip(rows[0], rows[1]))['product_name'], "'-Caneca")
+
+    def test_jsonl(self):
+        lines = self.export('items', 'jsonl').splitlines()
+        self.assertEqual(len(lines), 1)
+        item = json.loads(lines[0])
+        self.assertEqual((item['order_id'], item['quantity'], item['unit_price']), (self.order.pk, 2, '10.00'))
+        self.assertEqual(item['product_name'], '-Caneca')
+
+    def test_period(self):
+        today = timezone.localdate()
+        tomorrow = (today + datetime.timedelta(days=1)).isoformat()
+        self.assertEqual(len(self.export('orders', 'jsonl', start=parse_period(tomorrow)[0]).splitlines()), 0)
+        start, end = parse_period(today.isoformat(), today.isoformat())
+        self.assertEqual(end - start, datetime.timedelta(days=1))
+        self.assertEqual(len(self.export('customers', 'jsonl', start=start, end=end).splitlines()), 1)
+
+    def test_invalid_dates(self):
+        for value in ['2024-13-01', '2024-02-30', 'ontem', '01/02/2024']:
+            with self.assertRaises(ValueError):
+                parse_period(value)
+        self.assertEqual(parse_period(), (None, None))
+
+    def test_view(self):
+        self.client.force_login(User.objects.create_user('equipe', 'equipe@example.com', 'x', is_staff=True))
+        response = self.client.get(reverse('export', args=['orders']), {'format': 'csv'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('A1', b''.join(response.streaming_content).decode())
+        response = self.client.get(reverse('export', args=['orders']), {'since': '2024-02-30'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ImportProductsTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+
+    def run_import(self, name, content, *args):
+        path = self.directory / name
+        path.write_text(content, encoding='utf-8')
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('import_products', str(path), *args, stdout=stdout, stderr=stderr)
+        return stderr.getvalue()
+
+    def test_upsert_by_sku_is_idempotent(self):
+        content = (
+            'sku,name,price,stock,description\n'
+            'A-1,Caneca,10.00,5,Branca\n'
+            'A-2,Camiseta,40,,\n'
+        )
+        self.run_import('produtos.csv', content)
+        self.run_import('produtos.csv', content)
+        self.assertEqual(Product.objects.count(), 2)
+
+        Product.objects.filter(sku='A-2').update(stock=7)
+        self.run_import('produtos.csv', 'sku,name,price\nA-1,Caneca azul,12.5\nA-2,Camiseta,40\n', '--batch-size', '1')
+
+        self.assertEqual(
+            sorted(Product.objects.values_list('sku', 'name', 'price', 'stock')),
+            [('A-1', 'Caneca azul', Decimal('12.50'), 5), ('A-2', 'Camiseta', Decimal('40.00'), 7)],
+        )
+        # O índice de busca é refeito ao final
+        self.assertEqual([p.sku for p in search_products('azul')], ['A-1'])
+
+    def test_bad_rows_are_reported_by_line(self):
+        errors = self.run_import('produtos.csv', (
+            'sku,name,price,description\n'
+            'A-1,Caneca,10,"duas\nlinhas"\n'
+            'A-2,,10,\n'
+            'A-3,Copo,caro,\n'
+            'A-4,Prato,0,\n'
+        ))
+        self.assertEqual(
+            [line.split(':')[0] for line in errors.splitlines()],
+            ['Linha 4', 'Linha 5', 'Linha 6'],
+        )
+        self.assertEqual(list(Product.objects.values_list('sku', flat=True)), ['A-1'])
+
+    def test_json_and_jsonl(self):
+        errors = self.run_import('produtos.json', json.dumps([
+            {'id': 1, 'name': 'Caneca', 'price': 10, 'image': 'https://cdn.example.com/a.png'},
+            {'id': 2, 'name': 'Camiseta'},
+        ]))
+        self.assertEqual(errors.splitlines()[0].split(':')[0], 'Objeto 2')
+        errors = self.run_import('produtos.jsonl', '{"sku": "3", "name": "Copo", "price": 5}\n\n{"sku": ""}\n')
+        self.assertEqual(errors.splitlines()[0].split(':')[0], 'Linha 3')
+        self.assertEqual(sorted(Product.objects.values_list('sku', flat=True)), ['1', '3'])
+
+    def test_unknown_format(self):
+        with self.assertRaises(CommandError):
+            self.run_import('produtos.txt', '')
+
+
+class RecordingRouter(PrimaryReplicaRouter):
+    """
+    Decide como o roteador real, com uma réplica fictícia, mas lê sempre do
+    `default` (o banco de teste) e anota o que teria escolhido.
+    """
+    choices = []
+
+    def __init__(self):
+        self.replicas = ['replica_1']
+
+    def db_for_read(self, model, **hints):
+        self.choices.append(super().db_for_read(model, **hints))
+        return DEFAULT_DB_ALIAS
+
+
+@override_settings(DATABASE_ROUTERS=[f'{__name__}.RecordingRouter'], RATE_LIMITS={})
+class DatabaseRoutingTests(TestCase):
+
+    def setUp(self):
+        reset_caches()
+        self.product = create_product()
+        RecordingRouter.choices.clear()
+
+    def choices(self, request):
+        RecordingRouter.choices.clear()
+        response = request()
+        return response, set(RecordingRouter.choices)
+
+    def test_read_only_views_use_the_replica(self):
+        for url in [reverse('product_list'), reverse('search') + '?q=produto', reverse('api_search') + '?q=produto']:
+            response, choices = self.choices(lambda: self.client.get(url))
+            self.assertIn('replica_1', choices, url)
+            self.assertNotIn(STICKY_COOKIE, response.cookies)
+
+    def test_writes_set_the_sticky_cookie(self):
+        response, choices = self.choices(lambda: self.client.post(reverse('add_to_cart', args=[self.product.pk])))
+        self.assertEqual(choices, {DEFAULT_DB_ALIAS})
+        self.assertIn(STICKY_COOKIE, response.cookies)
+
+        # Logo depois da escrita, até a vitrine lê do primário
+        _, choices = self.choices(lambda: self.client.get(reverse('product_list')))
+        self.assertEqual(choices, {DEFAULT_DB_ALIAS})
+
+    def test_cart_views_stay_on_the_primary(self):
+        self.client.post(reverse('add_to_cart', args=[self.product.pk]))
+        del self.client.cookies[STICKY_COOKIE]
+        requests = [
+            lambda: self.client.get(reverse('checkout')),
+            lambda: self.client.post(reverse('update_cart', args=[self.product.pk, 'increase'])),
+            lambda: self.client.post(reverse('cart_batch'), {'ops': [{'op': 'add', 'product_id': self.product.pk}]},
+                                     content_type='application/json'),
+            lambda: self.client.post(reverse('remove_from_cart', args=[self.product.pk])),
+        ]
+        for request in requests:
+            _, choices = self.choices(request)
+            self.assertEqual(choices, {DEFAULT_DB_ALIAS})
+
+
+@skipUnless('replica_1' in settings.DATABASES, "sem réplica configurada (DB_SIMULATE_REPLICA=True)")
+class ReplicaQueryTests(TransactionTestCase):
+    """Com a réplica de verdade (TEST MIRROR: o próprio banco de teste)."""
+    databases = '__all__'
+
+    def setUp(self):
+        reset_caches()
+        # Sem sinais: nada de miniaturas geradas em segundo plano depois do commit
+        self.product = Product.objects.bulk_create([Product(name='Produto', price=Decimal('10.00'), stock=10)])[0]
+
+    def queries(self, request):
+        with CaptureQueriesContext(connections[DEFAULT_DB_ALIAS]) as primary, \
+                CaptureQueriesContext(connections['replica_1']) as replica:
+            request()
+        return len(primary), len(replica)
+
+    def test_routing(self):
+        primary, replica = self.queries(lambda: self.client.get(reverse('product_list')))
+        self.assertGreater(replica, 0)
+
+        self.client.post(reverse('add_to_cart', args=[self.product.pk]))
+        self.assertEqual(self.queries(lambda: self.client.get(reverse('product_list')))[1], 0)  # sticky
+        del self.client.cookies[STICKY_COOKIE]
+        self.assertEqual(self.queries(lambda: self.client.get(reverse('checkout')))[1], 0)
+
+
+class AdminListTests(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'x'))
+        customer = Customer.objects.create(name='Ana', email='ana@example.com')
+        product = create_product()
+        for i in range(3):
+            order = Order.objects.create(customer=customer, complete=True, transaction_id=f'T{i}',
+                                         total_amount=Decimal('10.00'), item_count=1)
+            OrderItem.objects.create(order=order, product=product, quantity=1, unit_price=Decimal('10.00'))
+        DatabaseApiStore().save_cart(1, {product.pk: 1})
+
+    def changelist(self, params=None):
+        with CaptureQueriesContext(connections[DEFAULT_DB_ALIAS]) as captured:
+            response = self.client.get(reverse('admin:app_order_changelist'), params or {})
+        counts = [q['sql'] for q in captured.captured_queries if 'COUNT(' in q['sql'].upper()]
+        return response.context['cl'], counts
+
+    def test_unfiltered_list_uses_the_estimate(self):
+        # Como no PostgreSQL com uma tabela grande; o `exclude` dos carrinhos
+        # da API em `OrderAdmin.get_queryset` não conta como filtro
+        with mock.patch.object(EstimatedCountPaginator, 'estimated_count', return_value=50000):
+            cl, counts = self.changelist()
+            self.assertEqual(cl.result_count, 50000)
+            self.assertEqual(counts, [])
+
+            for params in [{'complete__exact': '1'}, {'q': 'T1'}]:
+                cl, counts = self.changelist(params)
+                self.assertLess(cl.result_count, 50000)
+                self.assertEqual(len(counts), 1, params)
+
+    def test_small_tables_are_counted(self):
+        cl, counts = self.changelist()
+        self.assertEqual(cl.result_count, 3)
+        self.assertEqual(len(counts), 1)
+
+    def test_list_queries_do_not_grow_with_rows(self):
+        self.changelist()
+        with CaptureQueriesContext(connections[DEFAULT_DB_ALIAS]) as few:
+            self.client.get(reverse('admin:app_order_changelist'))
+        for i in range(5):
+            Order.objects.create(complete=True, transaction_id=f'N{i}', total_amount=Decimal('1.00'), item_count=1)
+        with CaptureQueriesContext(connections[DEFAULT_DB_ALIAS]) as many:
+            self.client.get(reverse('admin:app_order_changelist'))
+        self.assertEqual(len(many), len(few))
+
+
+class StockReservationTests(TestCase):
+
+    def setUp(self):
+        reset_caches()
+        self.product = create_product(stock=2)
+        self.other = create_product('Outro', stock=5)
+
+    def reserved(self, product):
+        product.refresh_from_db()
+        return product.reserved
+
+    def test_last_units_go_to_one_cart(self):
+        reserve_stock('a', {self.product.pk: 2})
+        with self.assertRaises(InsufficientStock):
+            reserve_stock('b', {self.product.pk: 1})
+        self.assertEqual(self.reserved(self.product), 2)
+        self.assertFalse(StockReservation.objects.filter(cart_key='b').exists())
+
+    def test_all_or_nothing(self):
+        with self.assertRaises(InsufficientStock) as ctx:
+            reserve_stock('a', {self.other.pk: 1, self.product.pk: 3})
+        self.assertEqual([product.pk for product in ctx.exception.products], [self.product.pk])
+        self.assertEqual((self.reserved(self.product), self.reserved(self.other)), (0, 0))
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_adjust_and_release(self):
+        reserve_stock('a', {self.other.pk: 3})
+        reserve_stock('a', {self.other.pk: 1})
+        self.assertEqual(self.reserved(self.other), 1)
+        reserve_stock('a', {self.other.pk: 0})
+        self.assertEqual(self.reserved(self.other), 0)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_concurrent_write_is_retried(self):
+        reserve_stock('a', {self.other.pk: 1})
+        first = QuerySet.first
+
+        def read_then_concurrent_write(queryset):
+            # Outra requisição do mesmo carrinho altera a reserva logo depois
+            # da leitura desta
+            current = first(queryset)
+            if StockReservation.objects.filter(quantity=1).update(quantity=2):
+                Product.objects.filter(pk=self.other.pk).update(reserved=F('reserved') + 1)
+            return current
+
+        with mock.patch.object(QuerySet, 'first', autospec=True, side_effect=read_then_concurrent_write):
+            reserve_stock('a', {self.other.pk: 3})
+
+        self.assertEqual(StockReservation.objects.get(cart_key='a').quantity, 3)
+        self.assertEqual(self.reserved(self.other), 3)
+
+    def test_take_gives_up_after_max_attempts(self):
+        reserve_stock('a', {self.other.pk: 1})
+        # Outra requisição sempre altera a reserva entre a leitura e a remoção
+        with mock.patch.object(QuerySet, 'delete', return_value=(0, {})) as delete:
+            with self.assertRaises(ReservationConflict):
+                take_reservations(StockReservation.objects.filter(cart_key='a'))
+        self.assertEqual(delete.call_count, 5)
+        self.assertEqual(self.reserved(self.other), 1)
+
+    def test_checkout_with_changing_reservations_can_be_retried(self):
+        self.client.post(reverse('add_to_cart', args=[self.other.pk]))
+        data = {'name': 'Ana', 'email': 'ana@example.com', 'address': 'Rua 1'}
+        with mock.patch.object(QuerySet, 'delete', return_value=(0, {})):
+            response = self.client.post(reverse('checkout'), data, follow=True)
+        self.assertContains(response, 'Tente de novo')
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(self.reserved(self.other), 1)
+
+        self.client.post(reverse('checkout'), data)
+        self.assertTrue(Order.objects.exists())
+
+    def test_expired_holds_are_released(self):
+        reserve_stock('a', {self.product.pk: 2})
+        StockReservation.objects.update(expires_at=timezone.now() - datetime.timedelta(seconds=1))
+
+        # Sem disponível, a reserva libera as vencidas do produto na hora
+        reserve_stock('b', {self.product.pk: 1})
+
+        self.assertEqual(self.reserved(self.product), 1)
+        self.assertEqual(list(StockReservation.objects.values_list('cart_key', flat=True)), ['b'])
+
+    def test_release_expired(self):
+        reserve_stock('a', {self.product.pk: 1, self.other.pk: 2})
+        StockReservation.objects.update(expires_at=timezone.now() - datetime.timedelta(seconds=1))
+        self.assertEqual(release_expired(), 3)
+        self.assertEqual((self.reserved(self.product), self.reserved(self.other)), (0, 0))
+
+
+class StaticAssetsTests(TestCase):
+
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        script = b'function add(a, b) { return a + b; }\n' * 200
+        for name in ('js/shop.js', 'js/shop.3f1a9c2b7e4d.js'):
+            path = Path(root.name, name)
+            path.parent.mkdir(exist_ok=True)
+            path.write_bytes(script)
+            compress_file(str(path))
+        Path(root.name, 'staticfiles.json').write_text(
+            json.dumps({'version': '1.1', 'paths': {'js/shop.js': 'js/shop.3f1a9c2b7e4d.js'}}),
+        )
+        self.script = script
+        override = override_settings(STATIC_ROOT=root.name, STATIC_URL='/static/')
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_compressed_variant_follows_accept_encoding(self):
+        response = self.client.get('/static/js/shop.js', headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(gzip.decompress(response.content), self.script)
+
+        preferred = ENCODINGS[0][1]
+        response = self.client.get('/static/js/shop.js', headers={'Accept-Encoding': 'br, gzip'})
+        self.assertEqual(response['Content-Encoding'], preferred)
+
+    def test_identity_when_compression_is_refused(self):
+        for accept in ('', 'gzip;q=0', 'identity'):
+            response = self.client.get('/static/js/shop.js', headers={'Accept-Encoding': accept})
+            self.assertFalse(response.has_header('Content-Encoding'), accept)
+            self.assertEqual(response.content, self.script)
+            self.assertEqual(response['Vary'], 'Accept-Encoding')
+
+    def test_hashed_names_are_immutable(self):
+        response = self.client.get('/static/js/shop.3f1a9c2b7e4d.js')
+        self.assertEqual(response['Cache-Control'], IMMUTABLE)
+        response = self.client.get('/static/js/shop.js')
+        self.assertEqual(response['Cache-Control'], f'public, max-age={settings.STATIC_MAX_AGE}')
+
+    def test_etag_answers_not_modified(self):
+        headers = {'Accept-Encoding': 'gzip'}
+        etag = self.client.get('/static/js/shop.js', headers=headers)['ETag']
+        response = self.client.get('/static/js/shop.js', headers={**headers, 'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+
+        # A variante sem compressão tem outra ETag: a da gzip não vale para ela
+        response = self.client.get('/static/js/shop.js', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_unknown_files_fall_through(self):
+        self.assertEqual(self.client.get('/static/js/missing.js').status_code, 404)
+
+
+@task(name='tests.flaky', max_attempts=2, backoff=1)
+def flaky(fail=True):
+    if fail:
+        raise RuntimeError("fora do ar")
+
+
+@task(name='tests.permanent')
+def permanent():
+    raise PermanentError("não adianta repetir")
+
+
+class TaskQueueTests(TestCase):
+
+    def setUp(self):
+        self.queue = DatabaseQueue()
+        patcher = mock.patch.object(task_queue, '_queue', self.queue)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.worker = RunWorkerCommand(stdout=io.StringIO(), stderr=io.StringIO())
+
+    def run_once(self):
+        [job] = self.queue.claim(1)
+        try:
+            run_job(job.name, job.payload)
+        except Exception as exc:
+            self.worker._finish(self.queue, job, exc)
+        else:
+            self.worker._finish(self.queue, job, None)
+        return Job.objects.get(pk=job.id)
+
+    def test_idempotency_key(self):
+        enqueue(flaky, {'fail': False}, idempotency_key='k')
+        enqueue(flaky, {'fail': False}, idempotency_key='k')
+        self.assertEqual(Job.objects.count(), 1)
+
+    def test_claim_is_exclusive(self):
+        enqueue(flaky, {'fail': False})
+        self.assertEqual(len(self.queue.claim(5)), 1)
+        self.assertEqual(self.queue.claim(5), [])
+
+    def test_retry_then_fail(self):
+        enqueue(flaky)
+        job = self.run_once()
+        self.assertEqual((job.status, job.attempts), (Job.PENDING, 1))
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIn('fora do ar', job.last_error)
+
+        Job.objects.update(run_at=timezone.now())
+        job = self.run_once()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+
+    def test_permanent_error_does_not_retry(self):
+        enqueue(permanent)
+        job = self.run_once()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 1))
+        self.assertIn('não adianta repetir', job.last_error)
+
+    def test_success(self):
+        enqueue(flaky, {'fail': False})
+        job = self.run_once()
+        self.assertEqual(job.status, Job.DONE)
+        self.assertIsNotNone(job.finished_at)
+
+    def test_expired_lease_is_claimed_again(self):
+        enqueue(flaky, {'fail': False})
+        self.queue.claim(1)
+        self.assertEqual(self.queue.claim(1), [])
+        Job.objects.update(locked_until=timezone.now() - datetime.timedelta(seconds=1))
+        [job] = self.queue.claim(1)
+        self.assertEqual(job.attempts, 2)
+
+
+class CustomerEmailMigrationTests(TransactionTestCase):
+    """`0012_customer_email_dedupe`: e-mails normalizados e convidados repetidos juntados."""
+
+    before = [('app', '0011_job')]
+    after = [('app', '0013_customer_email_unique')]
+
+    def setUp(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        apps = executor.loader.project_state(self.before).apps
+        User = apps.get_model('auth', 'User')
+        OldCustomer = apps.get_model('app', 'Customer')
+        OldOrder = apps.get_model('app', 'Order')
+
+        user = User.objects.create(username='ana', email='ana@example.com')
+        self.guest = OldCustomer.objects.create(name='Ana', email=' Ana@Example.com ')
+        self.duplicate = OldCustomer.objects.create(name=None, email='ana@example.com')
+        self.account = OldCustomer.objects.create(user=user, name='ana', email='ana@example.com')
+        self.empty = OldCustomer.objects.create(name='Sem e-mail', email='')
+        self.guest_order = OldOrder.objects.create(customer=self.duplicate, complete=True, transaction_id='1')
+        self.account_order = OldOrder.objects.create(customer=self.account, complete=True, transaction_id='2')
+
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(self.after)
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_dedupe(self):
+        guest = Customer.objects.get(pk=self.guest.pk)
+        self.assertEqual(guest.email, 'ana@example.com')
+        self.assertFalse(Customer.objects.filter(pk=self.duplicate.pk).exists())
+        self.assertEqual(Order.objects.get(pk=self.guest_order.pk).customer_id, guest.pk)
+        # Pedidos de convidados não passam para a conta com o mesmo e-mail
+        account = Customer.objects.get(pk=self.account.pk)
+        self.assertIsNone(account.email)
+        self.assertEqual(Order.objects.get(pk=self.account_order.pk).customer_id, account.pk)
+        self.assertIsNone(Customer.objects.get(pk=self.empty.pk).email)
+
+
+class RegistrationTests(TestCase):
+
+    def test_does_not_take_over_guest_customer(self):
+        reset_caches()
+        guest = Customer.objects.for_email('ana@example.com', 'Ana')
+        Order.objects.create(customer=guest, complete=True)
+
+        response = self.client.post(reverse('register'), {
+            'username': 'ana', 'email': 'ANA@example.com',
+            'password1': 'Sup3r-senha!x', 'password2': 'Sup3r-senha!x',
+        })
+
+        self.assertEqual(response.status_code, 302)
+        account = Customer.objects.get(user__username='ana')
+        self.assertNotEqual(account.pk, guest.pk)
+        self.assertIsNone(account.email)
+        self.assertIsNone(Customer.objects.get(pk=guest.pk).user)
+
+
+class RateLimitTests(TestCase):
+
+    def setUp(self):
+        reset_caches()
+
+    @override_settings(RATE_LIMITS={'api_cart': {'rate': '2/m', 'keys': ['ip']}})
+    def test_too_many_requests(self):
+        url = reverse('api_cart', args=[1])
+        statuses = [self.client.get(url).status_code for _ in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+        # Outro IP tem o seu próprio balde
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='10.0.0.2').status_code, 200)
+
+    def test_bucket_refills(self):
+        store = LocMemRateLimitStore()
+        self.assertEqual(store.consume('k', 1, rate=1000), 0)
+        self.assertGreater(store.consume('k', 1, rate=1000), 0)
+        bucket = store._buckets['k']
+        bucket[1] -= 1  # um segundo depois
+        self.assertEqual(store.consume('k', 1, rate=1000), 0)
+
+    def test_full_buckets_are_pruned_first(self):
+        store = LocMemRateLimitStore(max_keys=2)
+        store.consume('cheio', 1, rate=1000)
+        store.consume('vazio', 5, rate=0.001)
+        store._buckets['cheio'][2] -= 1  # já se encheu de novo
+        store.consume('novo', 1, rate=1000)
+        self.assertEqual(set(store._buckets), {'vazio', 'novo'})
+
+    def test_invalid_rate(self):
+        self.assertEqual(parse_rate('30/m'), (30, 60))
+        with self.assertRaises(ImproperlyConfigured):
+            parse_rate('30 por minuto')
+
+
+
+@override_settings(
+    PASSWORD_HASHERS=['app.hashers.TunedScryptPasswordHasher'],
+    PASSWORD_SCRYPT_WORK_FACTOR=2 ** 10, PASSWORD_SCRYPT_BLOCK_SIZE=8, PASSWORD_SCRYPT_PARALLELISM=1,
+    PASSWORD_HASH_WORKERS=1,
+)
+class PasswordHasherTests(TestCase):
+
+    def setUp(self):
+        reset_caches()
+        # Pool de um só worker: se o `encode` chamado pelo `verify` voltasse
+        # para o pool, esperaria para sempre pelo próprio worker
+        executor = ThreadPoolExecutor(1, thread_name_prefix='password-hash')
+        self.addCleanup(executor.shutdown)
+        patcher = mock.patch.object(hashers, '_executor', executor)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def cost(self, user):
+        user.refresh_from_db()
+        decoded = TunedScryptPasswordHasher().decode(user.password)
+        return decoded['work_factor'], decoded['block_size'], decoded['parallelism']
+
+    def login(self):
+        return self.client.post(reverse('login'), {'username': 'ana', 'password': 'Sup3r-senha!x'})
+
+    def test_login_rehashes_with_new_cost(self):
+        user = User.objects.create_user('ana', password='Sup3r-senha!x')
+        self.assertEqual(self.cost(user), (2 ** 10, 8, 1))
+
+        with self.settings(PASSWORD_SCRYPT_WORK_FACTOR=2 ** 11, PASSWORD_SCRYPT_PARALLELISM=2):
+            self.assertEqual(self.login().status_code, 302)
+        self.assertEqual(self.cost(user), (2 ** 11, 8, 2))
+        self.assertTrue(user.check_password('Sup3r-senha!x'))
+
+    def test_login_keeps_hash_with_current_cost(self):
+        user = User.objects.create_user('ana', password='Sup3r-senha!x')
+        encoded = user.password
+        self.assertEqual(self.login().status_code, 302)
+        user.refresh_from_db()
+        self.assertEqual(user.password, encoded)
+
+    def test_verify_inside_pool_does_not_deadlock(self):
+        hasher = TunedScryptPasswordHasher()
+        encoded = hasher.encode('Sup3r-senha!x', hasher.salt())
+        # `verify` roda no worker e chama `encode`, que roda ali mesmo
+        self.assertTrue(hasher.verify('Sup3r-senha!x', encoded))
+        self.assertFalse(hasher.verify('outra', encoded))
+        self.assertFalse(getattr(hashers._local, 'hashing', False))
@@ -1,18 +1,42 @@
+from django.conf import settings
 from django.urls import path
 from . import views  # views = arquivo que contém os endpoints
+from . import api  # endpoints JSON usados pelo shop.js
+
+# Com ASYNC_VIEWS = True (servidor ASGI) a vitrine, o carrinho e a API usam
+# as versões `async def` das views.
+if settings.ASYNC_VIEWS:
+    product_list, add_to_cart = views.aproduct_list, views.aadd_to_cart
+    update_cart, remove_from_cart = views.aupdate_cart, views.aremove_from_cart
+    cart_batch = views.acart_batch
+    api_products, api_cart, api_checkout = api.aget_products, api.acart, api.acheckout
+else:
+    product_list, add_to_cart = views.product_list, views.add_to_cart
+    update_cart, remove_from_cart = views.update_cart, views.remove_from_cart
+    cart_batch = views.cart_batch
+    api_products, api_cart, api_checkout = api.get_products, api.cart, api.checkout
 
 urlpatterns = [
     # Quando a URL raiz do app for acessada (''), chame a view 'product_list'.
     # O 'name' é um apelido útil para usarmos nos templates.
-    path("", views.product_list, name="product_list"),  # Página inicial que lista os produtos
-    path('add-to-cart/<int:product_id>/', views.add_to_cart, name='add_to_cart'),
+    path("", product_list, name="product_list"),  # Página inicial que lista os produtos
+    path('add-to-cart/<int:product_id>/', add_to_cart, name='add_to_cart'),
     path('checkout/', views.checkout_view, name='checkout'),
-    path('update-cart/<int:product_id>/<str:action>/', views.update_cart, name='update_cart'),
+    path('busca/', views.search_view, name='search'),
+    path('update-cart/<int:product_id>/<str:action>/', update_cart, name='update_cart'),
+    path('cart/batch/', cart_batch, name='cart_batch'),  # JSON, usado pelo modal do carrinho
     # Novas URLs
     path('clear-session/', views.clear_session, name='clear_session'),
-    path('remove-from-cart/<int:product_id>/', views.remove_from_cart, name='remove_from_cart'),
+    path('metrics/', views.request_metrics, name='request_metrics'),
+    path('exportar/<str:kind>/', views.export_view, name='export'),
+    path('remove-from-cart/<int:product_id>/', remove_from_cart, name='remove_from_cart'),
     path('cadastro/', views.register_view, name='register'),
     path('login/', views.login_view, name='login'),
     path('logout/', views.logout_view, name='logout'),
     path('checkout/', views.checkout_view, name='checkout'),
+    # API JSON
+    path('api/products/', api_products, name='api_products'),
+    path('api/search/', api.search, name='api_search'),
+    path('api/cart/<int:user_id>/', api_cart, name='api_cart'),
+    path('api/checkout/<int:user_id>/', api_checkout, name='api_checkout'),
 ]
@@ -1,137 +1,362 @@
 from django.shortcuts import render,redirect, get_object_or_404
 from django.contrib import messages
 from django.contrib.auth import login, logout, authenticate
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.template.loader import render_to_string
+from django.views.decorators.http import require_POST
+import json
+from django.contrib.admin.views.decorators import staff_member_required
 
 # Importa o modelo Product do models.py
 from .models import Product,Customer, Order, OrderItem
-import datetime
 
 # Importa nossos novos modelos e formulários
 from .forms import CustomUserCreationForm, CustomAuthenticationForm, ShippingForm
+from .cart import aget_snapshots, aresolve_cart, get_snapshots, resolve_cart
+from .catalog import aproduct_grid_for_request, product_grid_for_request
+from .checkout import CheckoutConflict, InsufficientStock, place_order
+from .db_router import use_read_replica
+from .exports import EXPORTS, FORMATS, iter_export, parse_period
+from .instrumentation import metrics_registry
+from .search import search_products
+from .stock import areserve_stock, get_available, release_reservations, reserve_stock
+from .task_queue import enqueue
+from .tasks import send_order_confirmation
 
 
 from django.conf import settings # <- ADICIONE ESTA LINHA
 import os # <- ADICIONE ESTA LINHA
 
-def _get_cart_context(session):
+def _cart_context(cart, cart_items, total_price):
+    return {
+        'cart_items': cart_items,
+        'total_price': total_price,
+        'cart_item_count': cart.count,
+    }
+
+def _get_cart_context(request):
     """
-    Função de ajuda para obter o contexto do carrinho.
-    Esta versão é mais robusta: ela ignora itens inválidos
-    e limpa a sessão de "lixo" para evitar erros.
+    Função de ajuda para obter o contexto do carrinho (`request.cart`, veja
+    app/cart_storage.py).
+
+    Os produtos são resolvidos em lote por `resolve_cart` (uma consulta no
+    máximo, nenhuma com o cache de snapshots quente). Produtos que não
+    existem mais no banco saem do carrinho.
     """
- 
-    cart = session.get('cart', {})
-    
-    cart_items = []
-    total_price = 0
-    
-    keys_to_remove_from_cart = []
+    cart = request.cart
+    cart_items, total_price, invalid_ids = resolve_cart(cart.quantities)
+    for product_id in invalid_ids:
+        cart.remove(product_id)
+    return _cart_context(cart, cart_items, total_price)
+
+async def _aget_cart_context(request):
+    """Versão assíncrona de `_get_cart_context` (ORM assíncrono)."""
+    cart = request.cart
+    cart_items, total_price, invalid_ids = await aresolve_cart(cart.quantities)
+    for product_id in invalid_ids:
+        cart.remove(product_id)
+    return _cart_context(cart, cart_items, total_price)
+
+def _updated_quantity(cart, product_id, action):
+    """Nova quantidade do produto em `update_cart`, ou None se nada muda."""
+    if product_id in cart:
+        if action == 'increase':
+            return cart.get(product_id) + 1
+        if action == 'decrease':
+            return cart.get(product_id) - 1
+    return None
 
-    for product_id_str, item_data in cart.items():
-        try:
-            # Tenta converter o ID para um número. Se falhar (ex: ID vazio ''),
-            # vai pular para o bloco 'except'.
-            product_id_int = int(product_id_str)
-            
-            # Tenta encontrar o produto no banco. Se não encontrar,
-            # vai pular para o bloco 'except'.
-            product = Product.objects.get(id=product_id_int)
-            
-            # Se chegou até aqui, o item é válido.
-            quantity = item_data.get('quantity', 1) # Usar .get() é mais seguro
-            total_item_price = product.price * quantity
-            cart_items.append({
-                'product': product,
-                'quantity': quantity,
-                'total_price': total_item_price
-            })
-            total_price += total_item_price
-
-        # Captura os dois erros possíveis: ID inválido ou produto não existente
-        except (ValueError, Product.DoesNotExist):
-            # Se o item é inválido, marcamos ele para remoção do carrinho
-            keys_to_remove_from_cart.append(product_id_str)
-            continue
-    
-    # Se encontramos alguma chave inválida, limpamos o carrinho na sessão
-    if keys_to_remove_from_cart:
-        for key in keys_to_remove_from_cart:
-            if key in cart:
-                del cart[key]
-        session['cart'] = cart # Salva o carrinho "limpo" de volta na sessão
-    
+def _reservation_changes(old, new):
+    """Produtos cuja quantidade mudou entre dois carrinhos, com a quantidade nova."""
     return {
-        'cart_items': cart_items,
-        'total_price': total_price,
-        'cart_item_count': sum(item.get('quantity', 1) for item in cart.values())
+        product_id: new.get(product_id, 0)
+        for product_id in old.keys() | new.keys()
+        if old.get(product_id, 0) != new.get(product_id, 0)
+    }
+
+# Operações aceitas pelo endpoint em lote `cart_batch`
+CART_OPERATIONS = ('set', 'add', 'remove')
+MAX_CART_OPERATIONS = 100
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def _parse_cart_operations(body):
+    """
+    Lê o corpo JSON do `cart_batch`:
+    `{"ops": [{"op": "set" | "add" | "remove", "product_id": 3, "quantity": 2}, ...]}`.
+    Retorna `(operações, erros)`; com algum erro nenhuma operação é aplicada.
+    """
+    try:
+        ops = json.loads(body or b'{}').get('ops')
+    except (ValueError, AttributeError):
+        return [], ['JSON inválido.']
+    if not isinstance(ops, list) or not ops:
+        return [], ['Envie uma lista "ops" com ao menos uma operação.']
+    if len(ops) > MAX_CART_OPERATIONS:
+        return [], [f'No máximo {MAX_CART_OPERATIONS} operações por requisição.']
+
+    errors = []
+    for index, op in enumerate(ops):
+        if not isinstance(op, dict) or op.get('op') not in CART_OPERATIONS:
+            errors.append(f'Operação {index}: "op" deve ser {", ".join(CART_OPERATIONS)}.')
+            continue
+        if not _is_int(op.get('product_id')):
+            errors.append(f'Operação {index}: "product_id" inválido.')
+        if op['op'] == 'set' and not (_is_int(op.get('quantity')) and op['quantity'] >= 0):
+            errors.append(f'Operação {index}: "quantity" deve ser um inteiro >= 0.')
+        if op['op'] == 'add' and not _is_int(op.setdefault('quantity', 1)):
+            errors.append(f'Operação {index}: "quantity" deve ser um inteiro.')
+    return ops, errors
+
+def _apply_cart_operations(quantities, ops):
+    """Aplica as operações, em ordem, sobre uma cópia de `quantities`."""
+    quantities = dict(quantities)
+    for op in ops:
+        product_id = op['product_id']
+        if op['op'] == 'remove':
+            quantity = 0
+        elif op['op'] == 'set':
+            quantity = op['quantity']
+        else:
+            quantity = quantities.get(product_id, 0) + op['quantity']
+        if quantity > 0:
+            quantities[product_id] = quantity
+        else:
+            quantities.pop(product_id, None)
+    return quantities
+
+def _unknown_products(ops, quantities, snapshots):
+    return [
+        f'Produto {product_id} não encontrado.'
+        for product_id in sorted({op['product_id'] for op in ops if op['op'] != 'remove'})
+        if product_id in quantities and product_id not in snapshots
+    ]
+
+def _cart_batch_response(request, context, errors):
+    """Resumo do carrinho: contador, total, itens e o HTML novo do modal."""
+    data = {
+        'count': context['cart_item_count'],
+        'total_price': str(context['total_price']),
+        'items': [
+            {
+                'product_id': item['product'].id,
+                'quantity': item['quantity'],
+                'total_price': str(item['total_price']),
+            }
+            for item in context['cart_items']
+        ],
+        'html': render_to_string('app/partials/cart_modal.html', context, request=request),
     }
+    if errors:
+        data['errors'] = errors
+    return JsonResponse(data, status=400 if errors else 200)
 
+@use_read_replica
 def product_list(request):
-    """View da página principal."""
-    products = Product.objects.all().order_by('-created_at')
-    context = _get_cart_context(request.session)
-    context['products'] = products
+    """
+    View da página principal.
+    A grade de produtos vem pronta do cache (veja `app/catalog.py`); apenas
+    o carrinho é montado a cada requisição.
+    """
+    context = _get_cart_context(request)
+    context['product_grid'] = product_grid_for_request(request)
     return render(request, 'app/index.html', context)
 
+@use_read_replica
+def search_view(request):
+    """
+    Busca de produtos (`?q=termo&page=N`), ordenada por relevância.
+    Usa o índice de texto completo de `app/search.py`.
+    """
+    query = request.GET.get('q', '').strip()
+    try:
+        page_number = int(request.GET.get('page', 1))
+    except ValueError:
+        page_number = 1
+    context = _get_cart_context(request)
+    context['query'] = query
+    context['page'] = search_products(query, page=page_number, per_page=settings.CATALOG_PAGE_SIZE)
+    context['stock_available'] = get_available([product.id for product in context['page']])
+    return render(request, 'app/search.html', context)
+
 def checkout_view(request):
     """View da página de checkout."""
-    context = _get_cart_context(request.session)
+    context = _get_cart_context(request)
     # Adicione aqui a lógica do formulário de checkout no futuro
     return render(request, 'app/checkout.html', context)
 
 def add_to_cart(request, product_id):
-    """Adiciona um produto ao carrinho ou incrementa sua quantidade."""
+    """
+    Adiciona um produto ao carrinho ou incrementa sua quantidade, reservando
+    a unidade (veja app/stock.py).
+    """
     product = get_object_or_404(Product, id=product_id)
-    cart = request.session.get('cart', {})
-    product_id_str = str(product_id)
-
-    if product_id_str in cart:
-        cart[product_id_str]['quantity'] += 1
+    try:
+        reserve_stock(request.cart.key, {product_id: request.cart.get(product_id) + 1})
+    except InsufficientStock:
+        messages.error(request, f'"{product.name}" não tem mais unidades disponíveis.')
     else:
-        cart[product_id_str] = {'quantity': 1}
-    
-    messages.success(request, f'"{product.name}" foi adicionado ao carrinho!')
-    request.session['cart'] = cart
+        request.cart.add(product_id)
+        messages.success(request, f'"{product.name}" foi adicionado ao carrinho!')
     return redirect(request.META.get('HTTP_REFERER', 'product_list'))
 
 def remove_from_cart(request, product_id):
-    """Remove um item completamente do carrinho."""
-    cart = request.session.get('cart', {})
-    product_id_str = str(product_id)
-
-    if product_id_str in cart:
-        del cart[product_id_str]
-        request.session['cart'] = cart
+    """Remove um item completamente do carrinho e libera sua reserva."""
+    if product_id in request.cart:
+        reserve_stock(request.cart.key, {product_id: 0})
+        request.cart.remove(product_id)
         messages.success(request, 'Item removido do carrinho.')
     
     return redirect(request.META.get('HTTP_REFERER', 'product_list'))
 
 def update_cart(request, product_id, action):
     """Aumenta ou diminui a quantidade de um item no carrinho."""
-    cart = request.session.get('cart', {})
-    product_id_str = str(product_id)
+    quantity = _updated_quantity(request.cart, product_id, action)
+    if quantity is not None:
+        try:
+            reserve_stock(request.cart.key, {product_id: max(quantity, 0)})
+        except InsufficientStock as exc:
+            messages.error(request, str(exc))
+            return redirect(request.META.get('HTTP_REFERER', 'product_list'))
+        request.cart.set(product_id, quantity)
 
-    if product_id_str in cart:
-        if action == 'increase':
-            cart[product_id_str]['quantity'] += 1
-        elif action == 'decrease':
-            cart[product_id_str]['quantity'] -= 1
-            if cart[product_id_str]['quantity'] <= 0:
-                del cart[product_id_str]
-    
     messages.success(request, "Carrinho atualizado!")
-    request.session['cart'] = cart
     return redirect(request.META.get('HTTP_REFERER', 'product_list'))
 
+@require_POST
+def cart_batch(request):
+    """
+    Aplica várias operações no carrinho numa só requisição (tudo ou nada) e
+    devolve o resumo do carrinho em JSON, sem renderizar a vitrine.
+    Usado pelo modal do carrinho (base.html). Produtos inexistentes ou sem
+    estoque disponível invalidam o lote inteiro.
+    """
+    ops, errors = _parse_cart_operations(request.body)
+    if not errors:
+        quantities = _apply_cart_operations(request.cart.quantities, ops)
+        # Uma consulta no máximo; os snapshots ficam em cache para o resumo
+        errors = _unknown_products(ops, quantities, get_snapshots(list(quantities)))
+    if not errors:
+        try:
+            reserve_stock(request.cart.key, _reservation_changes(request.cart.quantities, quantities))
+        except InsufficientStock as exc:
+            errors = [str(exc)]
+        else:
+            request.cart.replace(quantities)
+    return _cart_batch_response(request, _get_cart_context(request), errors)
+
+# ==========================================================
+# VIEWS ASSÍNCRONAS (ASGI)
+# Mesma lógica das views acima, com ORM assíncrono, para que um
+# worker ASGI atenda muitas requisições sem ocupar um thread por requisição.
+# Ativadas com settings.ASYNC_VIEWS (veja app/urls.py).
+# ==========================================================
+
+@use_read_replica
+async def aproduct_list(request):
+    """Versão assíncrona de `product_list`."""
+    context = await _aget_cart_context(request)
+    context['product_grid'] = await aproduct_grid_for_request(request)
+    # O template usa `user`; resolvemos o usuário aqui porque a consulta
+    # síncrona não é permitida durante a renderização numa view assíncrona.
+    request.user = await request.auser()
+    return render(request, 'app/index.html', context)
+
+async def aadd_to_cart(request, product_id):
+    """Versão assíncrona de `add_to_cart`."""
+    try:
+        product = await Product.objects.only('id', 'name').aget(id=product_id)
+    except Product.DoesNotExist:
+        raise Http404("Produto não encontrado.")
+    try:
+        await areserve_stock(request.cart.key, {product_id: request.cart.get(product_id) + 1})
+    except InsufficientStock:
+        messages.error(request, f'"{product.name}" não tem mais unidades disponíveis.')
+    else:
+        request.cart.add(product_id)
+        messages.success(request, f'"{product.name}" foi adicionado ao carrinho!')
+    return redirect(request.META.get('HTTP_REFERER', 'product_list'))
+
+async def aremove_from_cart(request, product_id):
+    """Versão assíncrona de `remove_from_cart`."""
+    if product_id in request.cart:
+        await areserve_stock(request.cart.key, {product_id: 0})
+        request.cart.remove(product_id)
+        messages.success(request, 'Item removido do carrinho.')
+
+    return redirect(request.META.get('HTTP_REFERER', 'product_list'))
+
+async def aupdate_cart(request, product_id, action):
+    """Versão assíncrona de `update_cart`."""
+    quantity = _updated_quantity(request.cart, product_id, action)
+    if quantity is not None:
+        try:
+            await areserve_stock(request.cart.key, {product_id: max(quantity, 0)})
+        except InsufficientStock as exc:
+            messages.error(request, str(exc))
+            return redirect(request.META.get('HTTP_REFERER', 'product_list'))
+        request.cart.set(product_id, quantity)
+
+    messages.success(request, "Carrinho atualizado!")
+    return redirect(request.META.get('HTTP_REFERER', 'product_list'))
+
+@require_POST
+async def acart_batch(request):
+    """Versão assíncrona de `cart_batch`."""
+    ops, errors = _parse_cart_operations(request.body)
+    if not errors:
+        quantities = _apply_cart_operations(request.cart.quantities, ops)
+        errors = _unknown_products(ops, quantities, await aget_snapshots(list(quantities)))
+    if not errors:
+        try:
+            await areserve_stock(request.cart.key, _reservation_changes(request.cart.quantities, quantities))
+        except InsufficientStock as exc:
+            errors = [str(exc)]
+        else:
+            request.cart.replace(quantities)
+    context = await _aget_cart_context(request)
+    request.user = await request.auser()
+    return _cart_batch_response(request, context, errors)
+
 def clear_session(request):
     """
-    Uma view de utilidade para limpar completamente a sessão.
+    Uma view de utilidade para limpar completamente a sessão (e o carrinho).
     Muito útil para debug durante o desenvolvimento.
     """
     request.session.flush()
+    if request.cart.has_key:
+        release_reservations(request.cart.key)
+    request.cart.clear()
     return HttpResponse("<h1>Sessão limpa com sucesso!</h1><a href='/'>Voltar para a loja</a>")
 
+@staff_member_required
+def request_metrics(request):
+    """
+    Percentis de latência, consultas SQL, tempo de banco e de templates por
+    view (veja app/instrumentation.py). Apenas para a equipe (staff).
+    """
+    return JsonResponse(metrics_registry.summary())
+
+@staff_member_required
+def export_view(request, kind):
+    """
+    Exporta pedidos, itens ou clientes (`kind`) em CSV ou JSONL, em streaming
+    (veja app/exports.py). Parâmetros: `?format=csv|jsonl&since=AAAA-MM-DD&until=AAAA-MM-DD`.
+    Apenas para a equipe (staff).
+    """
+    fmt = request.GET.get('format', 'csv')
+    if kind not in EXPORTS or fmt not in FORMATS:
+        raise Http404("Exportação desconhecida.")
+    try:
+        start, end = parse_period(request.GET.get('since'), request.GET.get('until'))
+    except ValueError as exc:
+        return HttpResponseBadRequest(str(exc))
+
+    response = StreamingHttpResponse(iter_export(kind, fmt, start, end), content_type=FORMATS[fmt])
+    response['Content-Disposition'] = f'attachment; filename="{kind}.{fmt}"'
+    return response
+
 # ==========================================================
 # NOVAS VIEWS DE AUTENTICAÇÃO
 # ==========================================================
@@ -152,12 +377,10 @@ def register_view(request):
             user = form.save()
             
             # 2. Cria um 'Customer' associado a esse novo 'User'
-            # Usamos o username como nome padrão, o usuário pode alterar depois
-            Customer.objects.create(
-                user=user,
-                name=user.username,
-                email=user.email
-            )
+            # Usamos o username como nome padrão, o usuário pode alterar depois.
+            # Compras anteriores como convidado não passam para a conta: o
+            # e-mail informado no cadastro não foi verificado.
+            Customer.objects.for_user(user)
 
             # 3. Loga o usuário automaticamente
             login(request, user)
@@ -223,7 +446,7 @@ def checkout_view(request):
     """
     Processa a página e a lógica de finalização de compra.
     """
-    cart_context = _get_cart_context(request.session)
+    cart_context = _get_cart_context(request)
     cart_items = cart_context['cart_items']
 
     # Se o carrinho estiver vazio, redireciona para a loja
@@ -236,38 +459,26 @@ def checkout_view(request):
         if form.is_valid():
             # 1. Obter ou Criar o Cliente
             if request.user.is_authenticated:
-                customer = request.user.customer
+                # Já carregado junto com o usuário (veja app/auth.py)
+                customer = Customer.objects.for_user(request.user)
             else:
-                # Para convidados, usamos o email para identificar ou criar um cliente
-                email = form.cleaned_data['email']
-                name = form.cleaned_data['name']
-                customer, created = Customer.objects.get_or_create(email=email)
-                if created:
-                    customer.name = name
-                    customer.save()
-
-            # 2. Criar o Pedido (Order)
-            order = Order.objects.create(
-                customer=customer,
-                complete=False # Marcamos como incompleto inicialmente
-            )
-            
-            # 3. Criar os Itens do Pedido (OrderItem)
-            for item in cart_items:
-                OrderItem.objects.create(
-                    product=item['product'],
-                    order=order,
-                    quantity=item['quantity']
-                )
-
-            # 4. Finalizar o Pedido
-            order.transaction_id = datetime.datetime.now().timestamp() # ID de transação simples
-            order.complete = True
-            order.save()
-
-            # 5. Limpar o carrinho da sessão
-            if 'cart' in request.session:
-                del request.session['cart']
+                # Para convidados, o email identifica o cliente: uma única
+                # consulta o cria ou encontra (veja CustomerQuerySet.for_email)
+                customer = Customer.objects.for_email(form.cleaned_data['email'], form.cleaned_data['name'])
+
+            # 2. Criar o Pedido (Order) e os Itens (OrderItem) e baixar o
+            #    estoque, tudo numa única transação (veja app/checkout.py)
+            try:
+                order = place_order(customer, cart_items, cart_key=request.cart.key)
+            except (InsufficientStock, CheckoutConflict) as exc:
+                messages.error(request, str(exc))
+                return redirect('checkout')
+            # O e-mail de confirmação é enviado pelo worker, fora da requisição
+            enqueue(send_order_confirmation, {'order_id': order.pk},
+                    idempotency_key=f'order-confirmation:{order.pk}')
+
+            # 3. Esvaziar o carrinho
+            request.cart.clear()
 
             messages.success(request, 'Seu pedido foi finalizado com sucesso!')
             return redirect('product_list') # Idealmente, redirecionar para uma pág de "Obrigado"
@@ -0,0 +1,16 @@
+/**
+ * Configuração do Tailwind usada por `python manage.py build_css`.
+ * `content` lista todo lugar onde aparecem classes: templates, HTML montado
+ * em Python (ex.: app/catalog.py) e no JavaScript.
+ */
+module.exports = {
+  content: [
+    './app/templates/**/*.html',
+    './app/**/*.py',
+    './app/static/app/js/**/*.js',
+  ],
+  theme: {
+    extend: {},
+  },
+  plugins: [],
+};